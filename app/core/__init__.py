@@ -2,11 +2,35 @@
 Инициализация модуля app.core
 """
 
-from .cache import MemoryCache
+from .cache import MemoryCache, MemoryBudget
+from .config import config as app_config
+from .tinylfu import TinyLFU, CountMinSketch
 from .state import StateManager
+from .state_store import SQLiteStateStore, create_state_store
+from .tiered_cache import TieredCache, CacheNamespace, cache_service, make_cache_key, make_text_key
+from .key_normalizer import TextNormalizer, normalize_text, set_key_normalizer
+from .sweeper import Sweeper, sweeper
 
 # Глобальные экземпляры для использования в боте
-memory_cache = MemoryCache()
-state_manager = StateManager()
+memory_cache = MemoryCache(admission=TinyLFU(
+    sketch_width=app_config.cache.admission_sketch_width,
+    window_ratio=app_config.cache.admission_window_ratio
+) if app_config.cache.admission_enabled else None)
+state_manager = StateManager(store=create_state_store(app_config.state),
+                             flush_interval=app_config.state.flush_interval,
+                             batch_size=app_config.state.batch_size,
+                             max_users=app_config.state.max_users,
+                             sync_interval=app_config.state.sync_interval,
+                             max_messages=app_config.state.max_messages)
 
-__all__ = ['memory_cache', 'state_manager', 'MemoryCache', 'StateManager'] 
\ No newline at end of file
+# Истекшие записи удаляются фоновым обходом, а не в обработке запросов
+sweeper.register('memory_cache', memory_cache)
+sweeper.register('state_manager', state_manager)
+sweeper.register('cache_service', cache_service)
+
+__all__ = [
+    'memory_cache', 'state_manager', 'cache_service',
+    'MemoryCache', 'MemoryBudget', 'StateManager', 'TieredCache', 'CacheNamespace', 'make_cache_key',
+    'make_text_key', 'TextNormalizer', 'normalize_text', 'set_key_normalizer', 'TinyLFU',
+    'CountMinSketch', 'Sweeper', 'sweeper', 'SQLiteStateStore', 'create_state_store'
+]
@@ -4,101 +4,938 @@
 
 import asyncio
 import hashlib
-from typing import Any, Dict, Optional
-from datetime import datetime, timedelta
+import hmac
+import itertools
+import mmap
+import os
+import pickle
+import struct
+import sys
+import time
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from loguru import logger
 from config import config
+from .config import config as app_config, RedisConfig
+from .error_handler import CacheError
+from .key_normalizer import normalize_text
+from .timing_wheel import TimingWheel
+from .tinylfu import TinyLFU
+
+try:
+    import redis.asyncio as aioredis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка каталога недоступна
+    fcntl = None
+
+
+# Накладные расходы на запись: узел OrderedDict, объект записи, таймер TTL
+_ENTRY_OVERHEAD = 160
+_MAX_SIZE_DEPTH = 4
+_ATOMIC_TYPES = (str, bytes, bytearray, int, float, bool, type(None))
+_MISSING = object()
+_SLOT_NAMES: Dict[type, Tuple[str, ...]] = {}
+
+
+def estimate_size(value: Any, _depth: int = 0) -> int:
+    """Оценка объема памяти значения в байтах (рекурсивно для контейнеров)"""
+    size = sys.getsizeof(value)
+    if isinstance(value, _ATOMIC_TYPES) or _depth >= _MAX_SIZE_DEPTH:
+        return size
+    if isinstance(value, dict):
+        for item_key, item in value.items():
+            size += estimate_size(item_key, _depth + 1) + estimate_size(item, _depth + 1)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        for item in value:
+            size += estimate_size(item, _depth + 1)
+    else:
+        if hasattr(value, "__dict__"):
+            size += estimate_size(vars(value), _depth + 1)
+        # Объекты со __slots__ (например, обертки значений) не имеют __dict__
+        for slot in _slot_names(type(value)):
+            item = getattr(value, slot, _MISSING)
+            if item is not _MISSING:
+                size += estimate_size(item, _depth + 1)
+    return size
+
+
+def _slot_names(cls: type) -> Tuple[str, ...]:
+    """Имена слотов класса с учетом базовых классов"""
+    names = _SLOT_NAMES.get(cls)
+    if names is None:
+        names = []
+        for klass in cls.__mro__:
+            slots = klass.__dict__.get("__slots__", ())
+            if isinstance(slots, str):
+                slots = (slots,)
+            names.extend(slot for slot in slots if slot not in ("__dict__", "__weakref__"))
+        names = _SLOT_NAMES[cls] = tuple(names)
+    return names
+
+
+class _CacheEntry:
+    """Запись кэша"""
+
+    __slots__ = ("value", "expires_at", "size")
+
+    def __init__(self, value: Any, expires_at: Optional[float], size: int):
+        self.value = value
+        self.expires_at = expires_at
+        self.size = size
+
+
+class MemoryBudget:
+    """Общий бюджет памяти для нескольких MemoryCache
+
+    Каждый кэш сообщает бюджету изменение своего объема. При превышении
+    ``max_bytes`` вытесняется LRU-элемент того кэша, у которого отношение
+    занятых байт к весу максимально, поэтому пространства имен делят
+    память пропорционально весам.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self.evictions = 0
+        self._caches: Dict[str, "MemoryCache"] = {}
+        self._weights: Dict[str, float] = {}
+
+    def register(self, name: str, cache: "MemoryCache", weight: float = 1.0) -> None:
+        """Подключить кэш к бюджету"""
+        self._caches[name] = cache
+        self._weights[name] = weight
+        self.used_bytes += cache.bytes_used
+
+    def get_weight(self, name: str) -> float:
+        return self._weights.get(name, 1.0)
+
+    def set_weight(self, name: str, weight: float) -> None:
+        if weight <= 0:
+            raise ValueError("Вес пространства имен должен быть положительным")
+        self._weights[name] = weight
+        self._reclaim()
+
+    def charge(self, delta: int) -> None:
+        """Учесть изменение объема одного из кэшей"""
+        self.used_bytes += delta
+        if delta > 0:
+            self._reclaim()
+
+    def _reclaim(self) -> None:
+        while self.used_bytes > self.max_bytes:
+            victim = None
+            worst = -1.0
+            for name, cache in self._caches.items():
+                if not len(cache):
+                    continue
+                ratio = cache.bytes_used / self._weights[name]
+                if ratio > worst:
+                    victim, worst = cache, ratio
+            if victim is None:
+                break
+            victim.evict_lru()
+            self.evictions += 1
+
+    def usage(self) -> Dict[str, int]:
+        """Занятые байты по кэшам"""
+        return {name: cache.bytes_used for name, cache in self._caches.items()}
+
 
 class MemoryCache:
-    """In-memory кэш для MVP"""
-    
-    def __init__(self):
-        self._cache: Dict[str, Dict[str, Any]] = {}
-        self._max_size = 1000  # Максимальное количество элементов
-        
+    """In-memory кэш для MVP
+
+    LRU-порядок хранится в ``OrderedDict`` (двусвязный список внутри),
+    истечение TTL отслеживается иерархическим колесом таймеров, поэтому
+    get, set и вытеснение выполняются за O(1).
+
+    Размер записей оценивается в байтах: кэш можно ограничить собственным
+    ``max_bytes`` или подключить к общему ``MemoryBudget``. Ограничение по
+    количеству элементов (``max_size``) необязательно.
+
+    С политикой ``admission`` (W-TinyLFU) новые записи сначала попадают в
+    окно LRU, а при вытеснении кандидат из окна вытесняет LRU-запись
+    основной области, только если по скетчу встречался чаще нее.
+    """
+
+    def __init__(self, max_size: Optional[int] = 1000, default_ttl: Optional[int] = None,
+                 clock: Callable[[], float] = time.monotonic,
+                 max_bytes: Optional[int] = None,
+                 budget: Optional[MemoryBudget] = None,
+                 name: str = "default", weight: float = 1.0,
+                 admission: Optional[TinyLFU] = None):
+        self._cache: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        # Окно W-TinyLFU: новые записи до прохождения фильтра допуска
+        self._window: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._admission = admission
+        self._max_size = max_size  # Максимальное количество элементов
+        self._max_bytes = max_bytes  # Максимальный объем в байтах
+        self._default_ttl = default_ttl
+        self._clock = clock
+        self._expiry = TimingWheel(clock=clock)
+        self._bytes = 0
+        self.evictions = 0
+        self.name = name
+        self._budget = budget
+        if budget is not None:
+            budget.register(name, self, weight)
+
+    @property
+    def bytes_used(self) -> int:
+        """Оценка занятой памяти в байтах"""
+        return self._bytes
+
+    def _release(self, size: int) -> None:
+        self._bytes -= size
+        if self._budget is not None:
+            self._budget.charge(-size)
+
+    def _segment(self, key: str) -> Optional["OrderedDict[str, _CacheEntry]"]:
+        if key in self._cache:
+            return self._cache
+        if key in self._window:
+            return self._window
+        return None
+
+    def _pop(self, key: str) -> Optional[_CacheEntry]:
+        entry = self._cache.pop(key, None)
+        if entry is None:
+            entry = self._window.pop(key, None)
+        return entry
+
+    def _expire(self, now: float, limit: Optional[int] = None) -> int:
+        """Удаление элементов, чей срок истек (не больше ``limit`` за вызов)"""
+        expired = self._expiry.advance(now, limit)
+        for key in expired:
+            entry = self._pop(key)
+            if entry is not None:
+                self._release(entry.size)
+        return len(expired)
+
+    def sweep(self, limit: int) -> int:
+        """Порция фонового удаления истекших элементов (для Sweeper)"""
+        return self._expire(self._clock(), limit)
+
+    def sweep_lag(self) -> float:
+        return self._expiry.lag(self._clock())
+
+    def _window_limit(self) -> int:
+        capacity = self._max_size if self._max_size is not None else len(self)
+        return self._admission.window_size(capacity)
+
+    def evict_lru(self) -> None:
+        """Вытеснить давно не использованный элемент (с учетом политики допуска)"""
+        segment = self._cache
+        if self._window:
+            if not self._cache:
+                segment = self._window
+            elif len(self._window) > self._window_limit():
+                candidate = next(iter(self._window))
+                if self._admission.admit(candidate, next(iter(self._cache))):
+                    # Кандидат занимает место жертвы в основной области
+                    self._cache[candidate] = self._window.pop(candidate)
+                else:
+                    segment = self._window
+        if not segment:
+            return
+        key, entry = segment.popitem(last=False)
+        self._expiry.cancel(key)
+        self._release(entry.size)
+        self.evictions += 1
+
+    def _balance_window(self) -> None:
+        """Перенести лишние записи окна в основную область, пока есть место"""
+        limit = self._window_limit()
+        while len(self._window) > limit:
+            key, entry = self._window.popitem(last=False)
+            self._cache[key] = entry
+
+    def _limit_bytes(self) -> Optional[int]:
+        limits = [limit for limit in (
+            self._max_bytes,
+            self._budget.max_bytes if self._budget is not None else None
+        ) if limit is not None]
+        return min(limits) if limits else None
+
     async def get(self, key: str) -> Optional[Any]:
         """Получение значения из кэша"""
-        if key not in self._cache:
+        return self.get_nowait(key)
+
+    async def set(self, key: str, value: Any, ttl_seconds: int = None) -> None:
+        """Установка значения в кэш"""
+        self.set_nowait(key, value, ttl_seconds)
+
+    async def delete(self, key: str) -> None:
+        """Удаление значения из кэша"""
+        self.delete_nowait(key)
+
+    def get_nowait(self, key: str) -> Optional[Any]:
+        """Синхронное получение значения (операция не требует ожидания)"""
+        if self._admission is not None:
+            self._admission.record(key)
+        segment = self._segment(key)
+        if segment is None:
             return None
-            
-        item = self._cache[key]
-        
+        entry = segment[key]
+
         # Проверяем не истек ли срок
-        if item["expires_at"] and datetime.now() > item["expires_at"]:
-            await self.delete(key)
+        if entry.expires_at is not None and self._clock() >= entry.expires_at:
+            self.delete_nowait(key)
             return None
-            
-        return item["value"]
-        
-    async def set(self, key: str, value: Any, ttl_seconds: int = None) -> None:
-        """Установка значения в кэш"""
+
+        segment.move_to_end(key)
+        return entry.value
+
+    def set_nowait(self, key: str, value: Any, ttl_seconds: int = None) -> None:
+        """Синхронная установка значения"""
         if ttl_seconds is None:
-            ttl_seconds = config.CACHE_TTL
-            
-        # Если кэш переполнен, удаляем самый старый элемент
-        if len(self._cache) >= self._max_size:
-            oldest_key = min(
-                self._cache.keys(), 
-                key=lambda k: self._cache[k]["created_at"]
-            )
-            await self.delete(oldest_key)
-            
+            ttl_seconds = self._default_ttl if self._default_ttl is not None else config.CACHE_TTL
+
+        now = self._clock()
+
+        size = estimate_size(key) + estimate_size(value) + _ENTRY_OVERHEAD
+        limit = self._limit_bytes()
+        if limit is not None and size > limit:
+            # Значение не помещается в бюджет целиком - не кэшируем
+            logger.debug(f"MemoryCache {self.name}: значение {size} байт превышает лимит {limit}")
+            self.delete_nowait(key)
+            return
+
         expires_at = None
         if ttl_seconds and ttl_seconds > 0:
-            expires_at = datetime.now() + timedelta(seconds=ttl_seconds)
-            
-        self._cache[key] = {
-            "value": value,
-            "created_at": datetime.now(),
-            "expires_at": expires_at
-        }
-        
-    async def delete(self, key: str) -> None:
-        """Удаление значения из кэша"""
-        self._cache.pop(key, None)
-        
+            expires_at = now + ttl_seconds
+
+        segment = self._segment(key)
+        if segment is not None:
+            entry = segment[key]
+            delta = size - entry.size
+            entry.value = value
+            entry.expires_at = expires_at
+            entry.size = size
+            segment.move_to_end(key)
+        elif self._admission is not None:
+            # Обращение уже учтено промахом в get_nowait, вставка его не повторяет
+            self._window[key] = _CacheEntry(value, expires_at, size)
+            delta = size
+        else:
+            # Если кэш переполнен, удаляем давно не использованный элемент
+            while self._max_size is not None and len(self._cache) >= self._max_size:
+                self.evict_lru()
+            self._cache[key] = _CacheEntry(value, expires_at, size)
+            delta = size
+
+        if expires_at is None:
+            self._expiry.cancel(key)
+        else:
+            self._expiry.schedule(key, expires_at)
+
+        self._bytes += delta
+        while self._max_size is not None and len(self) > self._max_size:
+            self.evict_lru()
+        while self._max_bytes is not None and self._bytes > self._max_bytes:
+            self.evict_lru()
+        if self._budget is not None:
+            self._budget.charge(delta)
+        if self._window:
+            self._balance_window()
+
+    def delete_nowait(self, key: str) -> None:
+        """Синхронное удаление значения"""
+        entry = self._pop(key)
+        if entry is not None:
+            self._expiry.cancel(key)
+            self._release(entry.size)
+
+    def __len__(self) -> int:
+        return len(self._cache) + len(self._window)
+
+    def __contains__(self, key: str) -> bool:
+        return self._segment(key) is not None
+
+    def export_entries(self, limit: Optional[int] = None) -> List[Tuple[str, Any, Optional[float]]]:
+        """Живые записи от давних к свежим: (ключ, значение, остаток TTL в секундах)"""
+        now = self._clock()
+        entries = []
+        for key, entry in itertools.chain(self._cache.items(), self._window.items()):
+            if entry.expires_at is None:
+                entries.append((key, entry.value, None))
+            elif entry.expires_at > now:
+                entries.append((key, entry.value, entry.expires_at - now))
+        return entries[-limit:] if limit else entries
+
     async def clear(self) -> None:
         """Очистка всего кэша"""
         self._cache.clear()
-        
+        self._window.clear()
+        self._expiry.clear()
+        self._release(self._bytes)
+
     async def cleanup_expired(self) -> None:
         """Очистка истекших элементов"""
-        now = datetime.now()
-        expired_keys = [
-            key for key, item in self._cache.items()
-            if item["expires_at"] and now > item["expires_at"]
-        ]
-        
-        for key in expired_keys:
-            await self.delete(key)
-            
+        self._expire(self._clock())
+
     async def get_cache_key(self, style: str, user_message: str) -> str:
         """Генерация ключа кэша для стиля и сообщения"""
-        message_hash = hashlib.md5(user_message.encode()).hexdigest()
+        message_hash = hashlib.md5(normalize_text(user_message).encode()).hexdigest()
         return f"{style}:{message_hash}"
-        
+
     async def get_stats(self) -> Dict[str, int]:
-        """Получить статистику кэша"""
-        await self.cleanup_expired()
-        return {
-            "total_items": len(self._cache),
-            "max_size": self._max_size
+        """Получить статистику кэша (истекшие элементы удаляет Sweeper)"""
+        stats = {
+            "total_items": len(self),
+            "max_size": self._max_size,
+            "bytes": self._bytes,
+            "max_bytes": self._limit_bytes(),
+            "evictions": self.evictions
         }
+        if self._admission is not None:
+            stats["admission"] = {"window_items": len(self._window),
+                                  **self._admission.get_stats()}
+        return stats
+
+# Формат записи сегмента: crc32, длина ключа, длина значения, срок истечения
+_RECORD_HEADER = struct.Struct("<IHId")
+_TOMBSTONE = 0xFFFFFFFF
+_SEGMENT_SUFFIX = ".seg"
+
 
-# Заглушки для FileCache и RedisCache (для MVP)
 class FileCache:
-    """Заглушка для файлового кэша"""
-    
+    """Персистентный файловый кэш
+
+    Записи дописываются в журнал сегментов (append-only), в памяти хранится
+    только хеш-индекс ``key -> (сегмент, смещение, длина, срок)``. Значения
+    читаются через mmap. Каждая запись защищена CRC32: при старте журнал
+    проигрывается заново, а оборванный хвост после сбоя отбрасывается.
+    Когда доля мертвых байт превышает порог, живые записи переписываются
+    в новый сегмент с атомарной заменой, истекшие записи при этом удаляются.
+
+    Индекс живет в памяти одного процесса, поэтому каталог занимается
+    эксклюзивной блокировкой: второй процесс получает ``CacheError``.
+
+    Изменения сериализуются ``asyncio.Lock``. Блокирующие операции (fsync,
+    открытие нового сегмента, копирование при компактификации) идут через
+    ``asyncio.to_thread``; индекс меняется только в потоке цикла событий.
+    """
+
+    def __init__(self, path: Optional[str] = None,
+                 segment_size: Optional[int] = None,
+                 compaction_ratio: Optional[float] = None,
+                 fsync: Optional[bool] = None,
+                 default_ttl: Optional[int] = None,
+                 clock: Callable[[], float] = time.time):
+        cache_config = app_config.cache
+        self._path = Path(path or cache_config.file_cache_path)
+        self._segment_size = segment_size or cache_config.file_segment_size
+        self._compaction_ratio = (compaction_ratio if compaction_ratio is not None
+                                  else cache_config.file_compaction_ratio)
+        self._fsync = cache_config.file_fsync if fsync is None else fsync
+        self._default_ttl = default_ttl if default_ttl is not None else cache_config.default_ttl
+        self._clock = clock
+
+        # key -> (segment_id, value_offset, value_len, expires_at)
+        self._index: Dict[str, Tuple[int, int, int, float]] = {}
+        self._maps: Dict[int, mmap.mmap] = {}
+        self._segment_sizes: Dict[int, int] = {}
+        self._dead_bytes = 0
+        self._active_id = 0
+        self._active_file = None
+        self._lock_file = None
+        self._write_lock = asyncio.Lock()
+
+        self._path.mkdir(parents=True, exist_ok=True)
+        self._acquire_lock()
+        self._load()
+
+    def _acquire_lock(self) -> None:
+        """Занять каталог кэша, чтобы журнал не писали два процесса"""
+        if fcntl is None:
+            return
+        self._lock_file = open(self._path / "LOCK", "a+b")
+        try:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._lock_file.close()
+            self._lock_file = None
+            raise CacheError(f"Каталог {self._path} занят другим процессом", operation="open")
+
+    # === Журнал сегментов ===
+
+    def _segment_path(self, segment_id: int) -> Path:
+        return self._path / f"{segment_id:08d}{_SEGMENT_SUFFIX}"
+
+    def _list_segments(self) -> List[int]:
+        segments = []
+        for item in self._path.iterdir():
+            if item.suffix == _SEGMENT_SUFFIX and item.stem.isdigit():
+                segments.append(int(item.stem))
+            elif item.suffix == ".tmp" and item.stem.isdigit():
+                # Незавершенная компактификация - файл неполный (чужие .tmp не трогаем)
+                item.unlink()
+        return sorted(segments)
+
+    @staticmethod
+    def _record_size(key_len: int, value_len: int) -> int:
+        return _RECORD_HEADER.size + key_len + (0 if value_len == _TOMBSTONE else value_len)
+
+    def _load(self) -> None:
+        """Восстановление индекса проигрыванием журнала"""
+        now = self._clock()
+        for segment_id in self._list_segments():
+            segment_path = self._segment_path(segment_id)
+            with open(segment_path, "rb") as f:
+                data = f.read()
+
+            offset = 0
+            while offset + _RECORD_HEADER.size <= len(data):
+                crc, key_len, value_len, expires_at = _RECORD_HEADER.unpack_from(data, offset)
+                body_start = offset + _RECORD_HEADER.size
+                end = body_start + key_len + (0 if value_len == _TOMBSTONE else value_len)
+                if end > len(data):
+                    break
+                if zlib.crc32(data[offset + 4:end]) != crc:
+                    break
+
+                key = data[body_start:body_start + key_len].decode("utf-8")
+                self._discard(key)
+                record_size = end - offset
+                if value_len == _TOMBSTONE or (expires_at and expires_at <= now):
+                    self._dead_bytes += record_size
+                else:
+                    self._index[key] = (segment_id, body_start + key_len, value_len, expires_at)
+                offset = end
+
+            if offset < len(data):
+                logger.warning(f"FileCache: поврежденный хвост сегмента {segment_path.name}, "
+                               f"отброшено {len(data) - offset} байт")
+                with open(segment_path, "r+b") as f:
+                    f.truncate(offset)
+            self._segment_sizes[segment_id] = offset
+            self._active_id = segment_id
+
+        if not self._segment_sizes:
+            self._active_id = 1
+        self._open_active()
+
+    def _open_segment(self, segment_id: int):
+        return open(self._segment_path(segment_id), "ab", buffering=0)
+
+    def _open_active(self) -> None:
+        self._active_file = self._open_segment(self._active_id)
+        self._segment_sizes.setdefault(self._active_id, 0)
+
+    async def _rotate(self) -> None:
+        old_file = self._active_file
+        self._active_file = await asyncio.to_thread(self._open_segment, self._active_id + 1)
+        self._active_id += 1
+        self._segment_sizes.setdefault(self._active_id, 0)
+        await asyncio.to_thread(old_file.close)
+
+    @staticmethod
+    def _write_synced(file, record: bytes) -> None:
+        file.write(record)
+        os.fsync(file.fileno())
+
+    async def _append(self, key: bytes, value: Optional[bytes], expires_at: float) -> Tuple[int, int]:
+        """Дописать запись в активный сегмент, вернуть (сегмент, смещение значения)"""
+        if self._segment_sizes[self._active_id] >= self._segment_size:
+            await self._rotate()
+
+        value_len = _TOMBSTONE if value is None else len(value)
+        body = (_RECORD_HEADER.pack(0, len(key), value_len, expires_at)[4:]
+                + key + (value or b""))
+        record = struct.pack("<I", zlib.crc32(body)) + body
+
+        # Одна запись - один write(), CRC отсекает частично записанный хвост
+        if self._fsync:
+            await asyncio.to_thread(self._write_synced, self._active_file, record)
+        else:
+            self._active_file.write(record)
+
+        offset = self._segment_sizes[self._active_id]
+        self._segment_sizes[self._active_id] = offset + len(record)
+        return self._active_id, offset + _RECORD_HEADER.size + len(key)
+
+    def _read(self, segment_id: int, offset: int, length: int) -> bytes:
+        view = self._maps.get(segment_id)
+        if view is None or len(view) < offset + length:
+            if view is not None:
+                view.close()
+            with open(self._segment_path(segment_id), "rb") as f:
+                view = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[segment_id] = view
+        return view[offset:offset + length]
+
+    def _discard(self, key: str) -> None:
+        """Пометить текущую запись ключа как мертвую"""
+        entry = self._index.pop(key, None)
+        if entry is not None:
+            self._dead_bytes += self._record_size(len(key.encode("utf-8")), entry[2])
+
+    # === Публичный интерфейс ===
+
     async def get(self, key: str) -> Optional[Any]:
-        return None
-        
+        """Получение значения из кэша"""
+        found = await self.get_with_ttl(key)
+        return found[0] if found is not None else None
+
+    async def get_with_ttl(self, key: str) -> Optional[Tuple[Any, Optional[float]]]:
+        """Значение и остаток TTL в секундах (None - без срока)"""
+        entry = self._index.get(key)
+        if entry is None:
+            return None
+
+        segment_id, offset, length, expires_at = entry
+        now = self._clock()
+        if expires_at and now >= expires_at:
+            self._discard(key)
+            return None
+
+        try:
+            value = pickle.loads(self._read(segment_id, offset, length))
+        except Exception as e:
+            logger.warning(f"FileCache: не удалось прочитать ключ {key}: {e}")
+            self._discard(key)
+            return None
+        return value, (expires_at - now if expires_at else None)
+
     async def set(self, key: str, value: Any, ttl_seconds: int = None) -> None:
-        pass
+        """Установка значения в кэш"""
+        if ttl_seconds is None:
+            ttl_seconds = self._default_ttl
+
+        expires_at = self._clock() + ttl_seconds if ttl_seconds and ttl_seconds > 0 else 0.0
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+        async with self._write_lock:
+            segment_id, offset = await self._append(key.encode("utf-8"), payload, expires_at)
+            self._discard(key)
+            self._index[key] = (segment_id, offset, len(payload), expires_at)
+            await self._maybe_compact()
+
+    async def delete(self, key: str) -> None:
+        """Удаление значения из кэша"""
+        async with self._write_lock:
+            if key not in self._index:
+                return
+            self._discard(key)
+            # Tombstone, чтобы ключ не воскрес после перезапуска
+            key_bytes = key.encode("utf-8")
+            await self._append(key_bytes, None, 0.0)
+            self._dead_bytes += self._record_size(len(key_bytes), _TOMBSTONE)
+            await self._maybe_compact()
+
+    async def delete_prefix(self, prefix: str) -> int:
+        """Удаление всех ключей с префиксом, вернуть их число"""
+        keys = [key for key in self._index if key.startswith(prefix)]
+        for key in keys:
+            await self.delete(key)
+        return len(keys)
+
+    async def clear(self) -> None:
+        """Очистка всего кэша"""
+        async with self._write_lock:
+            self._close_files()
+            self._index.clear()
+            # Старые сегменты удаляются до открытия нового: после сбоя
+            # между шагами журнал не проиграет очищенные записи
+            await asyncio.to_thread(self._remove_segments, list(self._segment_sizes))
+            self._segment_sizes.clear()
+            self._dead_bytes = 0
+            self._active_id += 1
+            self._open_active()
+
+    async def cleanup_expired(self) -> None:
+        """Очистка истекших элементов (с компактификацией при необходимости)"""
+        async with self._write_lock:
+            now = self._clock()
+            expired = [key for key, entry in self._index.items() if entry[3] and entry[3] <= now]
+            for key in expired:
+                self._discard(key)
+            await self._maybe_compact()
+
+    async def compact(self) -> None:
+        """Принудительная компактификация журнала"""
+        async with self._write_lock:
+            await self._compact()
+
+    async def get_stats(self) -> Dict[str, int]:
+        """Получить статистику кэша"""
+        return {
+            "total_items": len(self._index),
+            "segments": len(self._segment_sizes),
+            "total_bytes": sum(self._segment_sizes.values()),
+            "dead_bytes": self._dead_bytes
+        }
+
+    def close(self) -> None:
+        """Закрыть файлы сегментов и освободить каталог"""
+        self._close_files()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def _close_files(self) -> None:
+        for view in self._maps.values():
+            view.close()
+        self._maps.clear()
+        if self._active_file is not None:
+            self._active_file.close()
+            self._active_file = None
+
+    # === Компактификация ===
+
+    async def _maybe_compact(self) -> None:
+        total = sum(self._segment_sizes.values())
+        if total >= self._segment_size and self._dead_bytes > total * self._compaction_ratio:
+            await self._compact()
+
+    async def _compact(self) -> None:
+        """Переписать живые записи в новый сегмент и удалить старые
+
+        Вызывается под ``_write_lock``: копирование идет в отдельном потоке
+        по снимку индекса, подмена сегментов - в потоке цикла событий.
+        """
+        now = self._clock()
+        old_segments = list(self._segment_sizes)
+        compacted_id = self._active_id + 1
+        live = {key: entry for key, entry in self._index.items()
+                if not (entry[3] and entry[3] <= now)}
+        tmp_path, new_index, size = await asyncio.to_thread(self._write_compacted, compacted_id, live)
+
+        self._close_files()
+        # Атомарная замена: сегмент появляется либо целиком, либо никак
+        os.replace(tmp_path, self._segment_path(compacted_id))
+        # Ключи, удаленные чтением во время копирования, не возвращаем
+        self._index = {key: entry for key, entry in new_index.items() if key in self._index}
+        self._segment_sizes = {compacted_id: size}
+        self._dead_bytes = 0
+        self._active_id = compacted_id + 1
+        self._open_active()
+        await asyncio.to_thread(self._remove_segments, old_segments)
+        logger.info(f"FileCache: компактификация завершена, живых записей {len(self._index)}")
+
+    def _write_compacted(self, compacted_id: int, live: Dict[str, Tuple[int, int, int, float]]
+                         ) -> Tuple[Path, Dict[str, Tuple[int, int, int, float]], int]:
+        """Записать живые записи во временный сегмент (блокирующий вызов)
+
+        Сегменты читаются через собственные mmap: ``self._maps`` принадлежит
+        потоку цикла событий.
+        """
+        tmp_path = self._path / f"{compacted_id:08d}.tmp"
+        new_index: Dict[str, Tuple[int, int, int, float]] = {}
+        views: Dict[int, mmap.mmap] = {}
+        offset = 0
+        try:
+            with open(tmp_path, "wb") as f:
+                for key, (segment_id, value_offset, length, expires_at) in live.items():
+                    view = views.get(segment_id)
+                    if view is None:
+                        with open(self._segment_path(segment_id), "rb") as segment:
+                            view = views[segment_id] = mmap.mmap(segment.fileno(), 0,
+                                                                 access=mmap.ACCESS_READ)
+                    key_bytes = key.encode("utf-8")
+                    value = view[value_offset:value_offset + length]
+                    body = (_RECORD_HEADER.pack(0, len(key_bytes), length, expires_at)[4:]
+                            + key_bytes + value)
+                    f.write(struct.pack("<I", zlib.crc32(body)) + body)
+                    new_index[key] = (compacted_id, offset + _RECORD_HEADER.size + len(key_bytes),
+                                      length, expires_at)
+                    offset += 4 + len(body)
+                f.flush()
+                os.fsync(f.fileno())
+        finally:
+            for view in views.values():
+                view.close()
+        return tmp_path, new_index, offset
+
+    def _remove_segments(self, segment_ids: List[int]) -> None:
+        for segment_id in segment_ids:
+            self._segment_path(segment_id).unlink(missing_ok=True)
+
+# Длина подписи HMAC-SHA256 перед значением в Redis
+_SIGNATURE_SIZE = hashlib.sha256().digest_size
+
 
 class RedisCache:
-    """Заглушка для Redis кэша"""
-    
+    """Redis кэш, общий для нескольких процессов бота
+
+    Подключения берутся из пула размером ``RedisConfig.pool_size``,
+    значения сериализуются pickle, TTL передается как EX. Пакетные
+    ``get_many``/``set_many`` выполняются одним MGET/конвейером. Ошибки
+    Redis не пробрасываются: кэш деградирует до промаха.
+
+    Redis общий, поэтому каждое значение подписано HMAC-SHA256 с ключом
+    ``RedisConfig.secret``: pickle распаковывается только после проверки
+    подписи, чужие или поврежденные значения считаются промахом.
+    """
+
+    def __init__(self, redis_config: Optional[RedisConfig] = None,
+                 client: Any = None,
+                 prefix: str = "ofbot:",
+                 default_ttl: Optional[int] = None,
+                 secret: Optional[str] = None):
+        self._prefix = prefix
+        self._default_ttl = default_ttl if default_ttl is not None else app_config.cache.default_ttl
+        self._pool = None
+
+        redis_config = redis_config or app_config.redis
+        if secret is None and redis_config is not None:
+            secret = redis_config.secret
+        if not secret:
+            raise CacheError("REDIS_CACHE_SECRET не задан: значения кэша нечем подписать",
+                             operation="connect")
+        self._secret = secret.encode("utf-8")
+
+        if client is not None:
+            self._client = client
+            return
+
+        if not REDIS_AVAILABLE:
+            raise CacheError("Пакет redis не установлен", operation="connect")
+
+        if redis_config is None or not redis_config.url:
+            raise CacheError("REDIS_URL не задан", operation="connect")
+
+        self._pool = aioredis.ConnectionPool.from_url(
+            redis_config.url,
+            max_connections=redis_config.pool_size,
+            socket_timeout=redis_config.timeout,
+            socket_connect_timeout=redis_config.timeout
+        )
+        self._client = aioredis.Redis(connection_pool=self._pool)
+
+    def _key(self, key: str) -> str:
+        return f"{self._prefix}{key}"
+
+    def _ttl(self, ttl_seconds: Optional[int]) -> Optional[int]:
+        if ttl_seconds is None:
+            ttl_seconds = self._default_ttl
+        return int(ttl_seconds) if ttl_seconds and ttl_seconds > 0 else None
+
+    def _sign(self, payload: bytes) -> bytes:
+        return hmac.new(self._secret, payload, hashlib.sha256).digest()
+
+    def _dumps(self, value: Any) -> bytes:
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        return self._sign(payload) + payload
+
+    def _loads(self, raw: Optional[bytes]) -> Optional[Any]:
+        if raw is None:
+            return None
+        signature, payload = raw[:_SIGNATURE_SIZE], raw[_SIGNATURE_SIZE:]
+        if not hmac.compare_digest(signature, self._sign(payload)):
+            logger.warning("RedisCache: неверная подпись значения, значение пропущено")
+            return None
+        try:
+            return pickle.loads(payload)
+        except Exception as e:
+            logger.warning(f"RedisCache: не удалось десериализовать значение: {e}")
+            return None
+
     async def get(self, key: str) -> Optional[Any]:
-        return None
-        
+        """Получение значения из кэша"""
+        try:
+            return self._loads(await self._client.get(self._key(key)))
+        except Exception as e:
+            logger.warning(f"RedisCache: ошибка GET {key}: {e}")
+            return None
+
+    async def get_with_ttl(self, key: str) -> Optional[Tuple[Any, Optional[float]]]:
+        """Значение и остаток TTL в секундах по PTTL (None - без срока)"""
+        redis_key = self._key(key)
+        try:
+            async with self._client.pipeline(transaction=False) as pipe:
+                pipe.get(redis_key)
+                pipe.pttl(redis_key)
+                raw, pttl = await pipe.execute()
+        except Exception as e:
+            logger.warning(f"RedisCache: ошибка GET {key}: {e}")
+            return None
+        value = self._loads(raw)
+        if value is None:
+            return None
+        return value, (pttl / 1000 if pttl and pttl > 0 else None)
+
     async def set(self, key: str, value: Any, ttl_seconds: int = None) -> None:
-        pass 
\ No newline at end of file
+        """Установка значения в кэш"""
+        try:
+            await self._client.set(
+                self._key(key),
+                self._dumps(value),
+                ex=self._ttl(ttl_seconds)
+            )
+        except Exception as e:
+            logger.warning(f"RedisCache: ошибка SET {key}: {e}")
+
+    async def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        """Пакетное получение значений (один MGET)"""
+        if not keys:
+            return {}
+        try:
+            raw_values = await self._client.mget([self._key(key) for key in keys])
+        except Exception as e:
+            logger.warning(f"RedisCache: ошибка MGET: {e}")
+            return {}
+
+        result = {}
+        for key, raw in zip(keys, raw_values):
+            value = self._loads(raw)
+            if value is not None:
+                result[key] = value
+        return result
+
+    async def set_many(self, items: Dict[str, Any], ttl_seconds: int = None) -> None:
+        """Пакетная установка значений одним конвейером"""
+        if not items:
+            return
+        ttl = self._ttl(ttl_seconds)
+        try:
+            async with self._client.pipeline(transaction=False) as pipe:
+                for key, value in items.items():
+                    pipe.set(
+                        self._key(key),
+                        self._dumps(value),
+                        ex=ttl
+                    )
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"RedisCache: ошибка конвейерной записи: {e}")
+
+    async def delete(self, key: str) -> None:
+        """Удаление значения из кэша"""
+        try:
+            await self._client.delete(self._key(key))
+        except Exception as e:
+            logger.warning(f"RedisCache: ошибка DEL {key}: {e}")
+
+    async def delete_prefix(self, prefix: str) -> int:
+        """Удаление всех ключей кэша, начинающихся с ``prefix`` (SCAN + DEL пачками)"""
+        deleted = 0
+        try:
+            batch = []
+            async for key in self._client.scan_iter(match=f"{self._prefix}{prefix}*", count=500):
+                batch.append(key)
+                if len(batch) >= 500:
+                    deleted += await self._client.delete(*batch)
+                    batch.clear()
+            if batch:
+                deleted += await self._client.delete(*batch)
+        except Exception as e:
+            logger.warning(f"RedisCache: ошибка очистки {prefix}*: {e}")
+        return deleted
+
+    async def clear(self) -> None:
+        """Удаление всех ключей с префиксом кэша"""
+        await self.delete_prefix("")
+
+    async def close(self) -> None:
+        """Закрытие подключений пула"""
+        await self._client.aclose()
+        if self._pool is not None:
+            await self._pool.disconnect()
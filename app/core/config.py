@@ -4,13 +4,62 @@
 
 import os
 from pathlib import Path
-from typing import Dict, Any, Optional
-from dataclasses import dataclass
+from typing import Dict, Any, List, Optional
+from dataclasses import dataclass, field
 from dotenv import load_dotenv
 
 # Загрузка переменных окружения
 load_dotenv()
 
+# TTL пространств имен кэша по умолчанию (секунды) - жесткий срок жизни
+DEFAULT_NAMESPACE_TTLS = {
+    "reply": 7200,
+    "ppv": 7200,
+    "hot": 7200,
+    "ai_response": 300,
+    "deepseek_reply": 7200,
+    "quick": 300,
+    "long_term": 3600,
+    "api": 900
+}
+
+# Мягкие TTL (stale-while-revalidate): после них значение еще отдается,
+# но в фоне запускается обновление; жесткий срок - DEFAULT_NAMESPACE_TTLS
+DEFAULT_NAMESPACE_SOFT_TTLS = {
+    "reply": 3600,
+    "ppv": 3600,
+    "hot": 3600,
+    "deepseek_reply": 3600
+}
+
+# Веса пространств имен в общем бюджете памяти L1
+DEFAULT_NAMESPACE_WEIGHTS = {
+    "reply": 4.0,
+    "ppv": 1.0,
+    "hot": 1.0,
+    "ai_response": 2.0,
+    "deepseek_reply": 4.0,
+    "quick": 1.0,
+    "long_term": 2.0,
+    "api": 2.0
+}
+
+# Пространства имен с фильтром допуска W-TinyLFU (много разовых ключей)
+DEFAULT_ADMISSION_NAMESPACES = ["reply", "deepseek_reply", "ai_response"]
+
+
+def _parse_mapping(value: Optional[str], defaults: Dict[str, Any], cast=int) -> Dict[str, Any]:
+    """Разбор строки вида 'reply=3600,ppv=1800' поверх значений по умолчанию"""
+    result = dict(defaults)
+    if not value:
+        return result
+    for item in value.split(","):
+        if "=" not in item:
+            continue
+        name, raw = item.split("=", 1)
+        result[name.strip()] = cast(raw.strip())
+    return result
+
 @dataclass
 class DatabaseConfig:
     """Конфигурация базы данных"""
@@ -25,6 +74,7 @@ class RedisConfig:
     url: str
     pool_size: int = 10
     timeout: int = 5
+    secret: str = ""  # ключ HMAC для значений RedisCache, без него кэш не подключается
 
 @dataclass
 class MonitoringConfig:
@@ -40,6 +90,28 @@ class CacheConfig:
     redis_enabled: bool = True
     file_cache_path: str = "cache"
     default_ttl: int = 3600
+    file_segment_size: int = 4 * 1024 * 1024
+    file_compaction_ratio: float = 0.5
+    file_fsync: bool = False
+    file_enabled: bool = False  # L2 на диске: каталог занимает один процесс
+    write_back_interval: float = 1.0
+    namespace_ttls: Dict[str, int] = field(default_factory=lambda: dict(DEFAULT_NAMESPACE_TTLS))
+    namespace_soft_ttls: Dict[str, int] = field(default_factory=lambda: dict(DEFAULT_NAMESPACE_SOFT_TTLS))
+    memory_budget_bytes: int = 64 * 1024 * 1024
+    namespace_weights: Dict[str, float] = field(default_factory=lambda: dict(DEFAULT_NAMESPACE_WEIGHTS))
+    key_normalization: bool = True
+    key_stop_words: List[str] = field(default_factory=list)
+    similarity_enabled: bool = True
+    similarity_threshold: float = 0.8
+    similarity_max_entries: int = 100_000
+    negative_ttl: float = 5.0
+    negative_max_ttl: float = 300.0
+    negative_provider_threshold: int = 5
+    negative_max_entries: int = 10_000
+    admission_enabled: bool = True
+    admission_namespaces: List[str] = field(default_factory=lambda: list(DEFAULT_ADMISSION_NAMESPACES))
+    admission_window_ratio: float = 0.01
+    admission_sketch_width: int = 1 << 15
 
 @dataclass
 class QueueConfig:
@@ -48,6 +120,47 @@ class QueueConfig:
     max_queue_size: int = 1000
     retry_delay: float = 1.0
     max_retries: int = 3
+    # Автомасштабирование пула воркеров между min_workers и max_workers
+    min_workers: int = 2
+    scale_interval: float = 1.0
+    scale_down_delay: float = 30.0
+    target_wait: float = 0.5
+
+@dataclass
+class SpeculationConfig:
+    """Конфигурация упреждающей генерации вариантов после /reply"""
+    enabled: bool = True
+    max_concurrent: int = 4
+    global_top: int = 2
+    default_styles: List[str] = field(default_factory=lambda: ["friendly", "flirty"])
+    max_tracked: int = 1000
+
+@dataclass
+class SweeperConfig:
+    """Конфигурация фонового удаления истекших записей"""
+    interval: float = 1.0
+    max_items: int = 5000
+    time_slice: float = 0.005
+
+@dataclass
+class SnapshotConfig:
+    """Конфигурация снимка горячего кэша и состояний для перезапуска"""
+    enabled: bool = True
+    path: str = "data/snapshot.bin"  # не в каталоге FileCache: он владеет своими файлами
+    interval: float = 300.0
+    max_entries_per_namespace: int = 5000
+
+@dataclass
+class StateConfig:
+    """Конфигурация хранилища StateManager"""
+    backend: str = "memory"  # memory | sqlite | shared (общий файл для процессов одной машины)
+    sqlite_path: str = "data/state.db"
+    flush_interval: float = 0.5
+    batch_size: int = 500
+    max_users: int = 0  # 0 - без ограничения
+    max_messages: int = 0  # лимит состояний сообщений в памяти, 0 - без ограничения
+    host_id: str = ""  # владелец общего файла, пусто - имя машины
+    sync_interval: float = 0.05  # как часто опрашивать чужие изменения (shared)
 
 @dataclass
 class LoggingConfig:
@@ -69,6 +182,10 @@ class Config:
     cache: CacheConfig
     queue: QueueConfig
     logging: LoggingConfig
+    speculation: SpeculationConfig = field(default_factory=SpeculationConfig)
+    snapshot: SnapshotConfig = field(default_factory=SnapshotConfig)
+    sweeper: SweeperConfig = field(default_factory=SweeperConfig)
+    state: StateConfig = field(default_factory=StateConfig)
     
     @classmethod
     def from_env(cls) -> 'Config':
@@ -89,7 +206,8 @@ class Config:
         redis = RedisConfig(
             url=redis_url,
             pool_size=int(os.getenv("REDIS_POOL_SIZE", "10")),
-            timeout=int(os.getenv("REDIS_TIMEOUT", "5"))
+            timeout=int(os.getenv("REDIS_TIMEOUT", "5")),
+            secret=os.getenv("REDIS_CACHE_SECRET", "")
         ) if redis_url else None
         
         # Мониторинг
@@ -104,7 +222,34 @@ class Config:
             memory_size=int(os.getenv("CACHE_MEMORY_SIZE", "1000")),
             redis_enabled=bool(int(os.getenv("CACHE_REDIS_ENABLED", "1"))),
             file_cache_path=os.getenv("CACHE_FILE_PATH", "cache"),
-            default_ttl=int(os.getenv("CACHE_DEFAULT_TTL", "3600"))
+            default_ttl=int(os.getenv("CACHE_DEFAULT_TTL", "3600")),
+            file_segment_size=int(os.getenv("CACHE_FILE_SEGMENT_SIZE", str(4 * 1024 * 1024))),
+            file_compaction_ratio=float(os.getenv("CACHE_FILE_COMPACTION_RATIO", "0.5")),
+            file_fsync=bool(int(os.getenv("CACHE_FILE_FSYNC", "0"))),
+            file_enabled=bool(int(os.getenv("CACHE_FILE_ENABLED", "0"))),
+            write_back_interval=float(os.getenv("CACHE_WRITE_BACK_INTERVAL", "1.0")),
+            namespace_ttls=_parse_mapping(os.getenv("CACHE_NAMESPACE_TTLS"), DEFAULT_NAMESPACE_TTLS),
+            namespace_soft_ttls=_parse_mapping(os.getenv("CACHE_NAMESPACE_SOFT_TTLS"),
+                                               DEFAULT_NAMESPACE_SOFT_TTLS),
+            memory_budget_bytes=int(os.getenv("CACHE_MEMORY_BUDGET", str(64 * 1024 * 1024))),
+            namespace_weights=_parse_mapping(os.getenv("CACHE_NAMESPACE_WEIGHTS"),
+                                             DEFAULT_NAMESPACE_WEIGHTS, cast=float),
+            key_normalization=bool(int(os.getenv("CACHE_KEY_NORMALIZATION", "1"))),
+            key_stop_words=[word.strip() for word in os.getenv("CACHE_KEY_STOP_WORDS", "").split(",")
+                            if word.strip()],
+            similarity_enabled=bool(int(os.getenv("CACHE_SIMILARITY_ENABLED", "1"))),
+            similarity_threshold=float(os.getenv("CACHE_SIMILARITY_THRESHOLD", "0.8")),
+            similarity_max_entries=int(os.getenv("CACHE_SIMILARITY_MAX_ENTRIES", "100000")),
+            negative_ttl=float(os.getenv("CACHE_NEGATIVE_TTL", "5")),
+            negative_max_ttl=float(os.getenv("CACHE_NEGATIVE_MAX_TTL", "300")),
+            negative_provider_threshold=int(os.getenv("CACHE_NEGATIVE_PROVIDER_THRESHOLD", "5")),
+            negative_max_entries=int(os.getenv("CACHE_NEGATIVE_MAX_ENTRIES", "10000")),
+            admission_enabled=bool(int(os.getenv("CACHE_ADMISSION_ENABLED", "1"))),
+            admission_namespaces=[name.strip() for name in os.getenv(
+                "CACHE_ADMISSION_NAMESPACES", ",".join(DEFAULT_ADMISSION_NAMESPACES)).split(",")
+                if name.strip()],
+            admission_window_ratio=float(os.getenv("CACHE_ADMISSION_WINDOW_RATIO", "0.01")),
+            admission_sketch_width=int(os.getenv("CACHE_ADMISSION_SKETCH_WIDTH", str(1 << 15)))
         )
         
         # Очереди
@@ -112,7 +257,51 @@ class Config:
             max_workers=int(os.getenv("QUEUE_MAX_WORKERS", "10")),
             max_queue_size=int(os.getenv("QUEUE_MAX_SIZE", "1000")),
             retry_delay=float(os.getenv("QUEUE_RETRY_DELAY", "1.0")),
-            max_retries=int(os.getenv("QUEUE_MAX_RETRIES", "3"))
+            max_retries=int(os.getenv("QUEUE_MAX_RETRIES", "3")),
+            min_workers=int(os.getenv("QUEUE_MIN_WORKERS", "2")),
+            scale_interval=float(os.getenv("QUEUE_SCALE_INTERVAL", "1.0")),
+            scale_down_delay=float(os.getenv("QUEUE_SCALE_DOWN_DELAY", "30.0")),
+            target_wait=float(os.getenv("QUEUE_TARGET_WAIT", "0.5"))
+        )
+        
+        # Упреждающая генерация
+        speculation = SpeculationConfig(
+            enabled=bool(int(os.getenv("SPECULATION_ENABLED", "1"))),
+            max_concurrent=int(os.getenv("SPECULATION_MAX_CONCURRENT", "4")),
+            global_top=int(os.getenv("SPECULATION_GLOBAL_TOP", "2")),
+            default_styles=[style.strip() for style in
+                            os.getenv("SPECULATION_DEFAULT_STYLES", "friendly,flirty").split(",")
+                            if style.strip()],
+            max_tracked=int(os.getenv("SPECULATION_MAX_TRACKED", "1000"))
+        )
+        
+        # Фоновое удаление истекших записей
+        sweeper = SweeperConfig(
+            interval=float(os.getenv("SWEEPER_INTERVAL", "1.0")),
+            max_items=int(os.getenv("SWEEPER_MAX_ITEMS", "5000")),
+            time_slice=float(os.getenv("SWEEPER_TIME_SLICE", "0.005"))
+        )
+        
+        # Снимок кэша и состояний
+        snapshot = SnapshotConfig(
+            enabled=bool(int(os.getenv("SNAPSHOT_ENABLED", "1"))),
+            path=os.getenv("SNAPSHOT_PATH", "data/snapshot.bin"),
+            interval=float(os.getenv("SNAPSHOT_INTERVAL", "300")),
+            max_entries_per_namespace=int(os.getenv("SNAPSHOT_MAX_ENTRIES", "5000"))
+        )
+        
+        # Хранилище состояний
+        state_backend = os.getenv("STATE_BACKEND", "memory").lower()
+        state = StateConfig(
+            backend=state_backend,
+            sqlite_path=os.getenv("STATE_SQLITE_PATH", "data/state.db"),
+            # Другие процессы должны увидеть изменения сразу, а не через полсекунды
+            flush_interval=float(os.getenv("STATE_FLUSH_INTERVAL", "0" if state_backend == "shared" else "0.5")),
+            batch_size=int(os.getenv("STATE_BATCH_SIZE", "500")),
+            max_users=int(os.getenv("STATE_MAX_USERS", "0")),
+            max_messages=int(os.getenv("STATE_MAX_MESSAGES", "0")),
+            host_id=os.getenv("STATE_HOST_ID", ""),
+            sync_interval=float(os.getenv("STATE_SYNC_INTERVAL", "0.05"))
         )
         
         # Логирование
@@ -132,7 +321,11 @@ class Config:
             monitoring=monitoring,
             cache=cache,
             queue=queue,
-            logging=logging
+            logging=logging,
+            speculation=speculation,
+            snapshot=snapshot,
+            sweeper=sweeper,
+            state=state
         )
 
 # Создание конфигурации
@@ -0,0 +1,83 @@
+"""
+Нормализация текста для ключей кэша
+"Привет!", "привет" и "Привет  !" должны давать один и тот же ключ
+"""
+
+import unicodedata
+from typing import Callable, Iterable, Optional
+from utils import clean_text
+from .config import config as app_config
+
+# Модификаторы, которые входят в эмодзи-последовательности, но не являются символами
+_EMOJI_MODIFIERS = frozenset("\ufe0e\ufe0f\u20e3")
+_EMOJI_CATEGORIES = frozenset(("So", "Sk", "Cf", "Cs", "Co"))
+
+
+class TextNormalizer:
+    """Нормализатор текста на основе ``utils.clean_text``
+
+    Этапы: очистка пробелов, Unicode NFKC, приведение регистра (casefold),
+    схлопывание пунктуации и эмодзи в пробелы, удаление стоп-слов.
+    """
+
+    def __init__(self, stop_words: Iterable[str] = (), casefold: bool = True,
+                 strip_punctuation: bool = True, strip_emoji: bool = True):
+        self.casefold = casefold
+        self.strip_punctuation = strip_punctuation
+        self.strip_emoji = strip_emoji
+        # Стоп-слова проходят ту же нормализацию (пока список стоп-слов пуст)
+        self.stop_words: frozenset = frozenset()
+        self.stop_words = frozenset(
+            word for raw in stop_words for word in self(raw).split()
+        )
+
+    def _is_separator(self, char: str) -> bool:
+        category = unicodedata.category(char)
+        if self.strip_punctuation and category[0] == "P":
+            return True
+        if self.strip_emoji and (category in _EMOJI_CATEGORIES or char in _EMOJI_MODIFIERS):
+            return True
+        return False
+
+    def __call__(self, text: str) -> str:
+        text = unicodedata.normalize("NFKC", clean_text(text or ""))
+        if self.casefold:
+            text = text.casefold()
+        if self.strip_punctuation or self.strip_emoji:
+            text = "".join(" " if self._is_separator(char) else char for char in text)
+        words = text.split()
+        if self.stop_words:
+            words = [word for word in words if word not in self.stop_words]
+        return " ".join(words)
+
+
+def _default_normalizer() -> Optional[TextNormalizer]:
+    cache_config = app_config.cache
+    if not cache_config.key_normalization:
+        return None
+    return TextNormalizer(stop_words=cache_config.key_stop_words)
+
+
+_normalizer: Optional[Callable[[str], str]] = _default_normalizer()
+
+
+def set_key_normalizer(normalizer: Optional[Callable[[str], str]]) -> None:
+    """Заменить нормализатор ключей (None - ключи из сырого текста)"""
+    global _normalizer
+    _normalizer = normalizer
+
+
+def get_key_normalizer() -> Optional[Callable[[str], str]]:
+    return _normalizer
+
+
+def normalize_text(text: str) -> str:
+    """Нормализованная форма текста для ключа кэша
+
+    Если после нормализации ничего не осталось (например, сообщение из
+    одних эмодзи), используется очищенный исходный текст, чтобы разные
+    такие сообщения не сливались в один ключ.
+    """
+    if _normalizer is None:
+        return text
+    return _normalizer(text) or clean_text(text or "")
@@ -0,0 +1,110 @@
+"""
+Негативный кэш неудачных генераций
+Помнит недавние ошибки провайдера и ключа, чтобы не долбить деградировавший API
+"""
+
+import random
+import time
+from typing import Any, Callable, Dict, Optional
+from .cache import MemoryCache
+from .config import config as app_config, CacheConfig
+from .sweeper import sweeper
+
+
+class _Failure:
+    """Серия ошибок по ключу"""
+
+    __slots__ = ("count", "blocked_until")
+
+    def __init__(self, count: int, blocked_until: float):
+        self.count = count
+        self.blocked_until = blocked_until
+
+
+class NegativeCache:
+    """Память об ошибках одного провайдера
+
+    После ошибки ключ блокируется на ``base_ttl``, каждая следующая ошибка
+    подряд удваивает срок (до ``max_ttl``). Если подряд ошибаются
+    ``provider_threshold`` разных запросов, блокируется весь провайдер.
+    Успешный ответ сбрасывает счетчики. Пока блокировка действует,
+    вызывающий код отдает fallback без обращения к API.
+    """
+
+    def __init__(self, provider: str, cache_config: Optional[CacheConfig] = None,
+                 clock: Callable[[], float] = time.monotonic, jitter: float = 0.1):
+        cache_config = cache_config or app_config.cache
+        self.provider = provider
+        self._base_ttl = cache_config.negative_ttl
+        self._max_ttl = cache_config.negative_max_ttl
+        self._threshold = cache_config.negative_provider_threshold
+        self._clock = clock
+        self._jitter = jitter
+        # Записи живут дольше блокировки, чтобы повторная ошибка удлиняла срок
+        self._failures = MemoryCache(max_size=cache_config.negative_max_entries, clock=clock)
+        self._provider = _Failure(0, 0.0)
+        self._counters: Dict[str, int] = dict.fromkeys(("failures", "short_circuits"), 0)
+
+    def _ttl(self, count: int) -> float:
+        ttl = min(self._base_ttl * (2 ** (count - 1)), self._max_ttl)
+        if self._jitter:
+            ttl *= random.uniform(1 - self._jitter, 1 + self._jitter)
+        return ttl
+
+    def blocked_for(self, key: str) -> float:
+        """Сколько секунд ключ (или весь провайдер) еще заблокирован"""
+        now = self._clock()
+        remaining = self._provider.blocked_until - now
+        failure = self._failures.get_nowait(key)
+        if failure is not None:
+            remaining = max(remaining, failure.blocked_until - now)
+        return max(remaining, 0.0)
+
+    def is_blocked(self, key: str) -> bool:
+        """Проверка блокировки; блокировка учитывается как сэкономленный вызов"""
+        if self.blocked_for(key) > 0:
+            self._counters["short_circuits"] += 1
+            return True
+        return False
+
+    def record_failure(self, key: str) -> float:
+        """Учесть ошибку и вернуть срок блокировки ключа"""
+        now = self._clock()
+        self._counters["failures"] += 1
+        failure = self._failures.get_nowait(key)
+        count = failure.count + 1 if failure is not None else 1
+        ttl = self._ttl(count)
+        self._failures.set_nowait(key, _Failure(count, now + ttl), ttl + self._max_ttl)
+
+        self._provider.count += 1
+        if self._provider.count >= self._threshold:
+            provider_ttl = self._ttl(self._provider.count - self._threshold + 1)
+            self._provider.blocked_until = now + provider_ttl
+        return ttl
+
+    def record_success(self, key: str) -> None:
+        """Успешный ответ снимает блокировку ключа и провайдера"""
+        self._failures.delete_nowait(key)
+        self._provider = _Failure(0, 0.0)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "provider": self.provider,
+            **self._counters,
+            "tracked_keys": len(self._failures),
+            "consecutive_failures": self._provider.count,
+            "provider_blocked_for": round(max(self._provider.blocked_until - self._clock(), 0.0), 2)
+        }
+
+
+_registry: Dict[str, NegativeCache] = {}
+
+
+def get_negative_cache(provider: str) -> NegativeCache:
+    """Общий негативный кэш провайдера (один на процесс)"""
+    cache = _registry.get(provider)
+    if cache is None:
+        cache = NegativeCache(provider)
+        _registry[provider] = cache
+        sweeper.register(f"negative:{provider}", cache._failures)
+    return cache
@@ -4,21 +4,24 @@
 
 import asyncio
 import time
-from typing import Any, Dict, Optional
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Optional
 from functools import wraps
-from cachetools import TTLCache, LRUCache
 from datetime import datetime, timedelta
+from .tiered_cache import TieredCache, cache_service
+from .sweeper import sweeper
 
 class PerformanceManager:
     """Менеджер производительности с многоуровневым кэшированием"""
     
-    def __init__(self):
+    def __init__(self, cache: Optional[TieredCache] = None):
+        cache = cache or cache_service
         # Быстрый кэш для частых запросов (5 минут)
-        self.quick_cache = TTLCache(maxsize=1000, ttl=300)
+        self.quick_cache = cache.namespace('quick')
         # Долгосрочный кэш для стабильных данных (1 час)
-        self.long_term_cache = TTLCache(maxsize=10000, ttl=3600)
+        self.long_term_cache = cache.namespace('long_term')
         # Кэш для результатов API (15 минут)
-        self.api_cache = TTLCache(maxsize=5000, ttl=900)
+        self.api_cache = cache.namespace('api')
         # Метрики производительности
         self.metrics: Dict[str, list] = {
             'response_times': [],
@@ -26,15 +29,18 @@ class PerformanceManager:
             'cache_misses': [],
             'api_calls': []
         }
-        # Ограничения запросов
-        self.rate_limits: Dict[str, list] = {}
+        # Ограничения запросов: окна пользователей от давно активных к недавним
+        self.rate_limits: "OrderedDict[str, Deque[float]]" = OrderedDict()
+        self._rate_window = 0
+        # Неактивных пользователей удаляет фоновый Sweeper
+        sweeper.register(f"rate_limits:{id(self)}", self)
         
     async def get_cached_data(self, key: str, cache_type: str = 'quick') -> Optional[Any]:
         """Получение данных из кэша с учетом типа"""
         start_time = time.time()
         
         cache = getattr(self, f'{cache_type}_cache')
-        result = cache.get(key)
+        result = await cache.get(key)
         
         if result is not None:
             self.metrics['cache_hits'].append(time.time() - start_time)
@@ -46,25 +52,47 @@ class PerformanceManager:
     async def set_cached_data(self, key: str, value: Any, cache_type: str = 'quick') -> None:
         """Сохранение данных в кэш"""
         cache = getattr(self, f'{cache_type}_cache')
-        cache[key] = value
+        await cache.set(key, value)
         
     def check_rate_limit(self, user_id: str, limit: int = 60, window: int = 60) -> bool:
         """Проверка ограничения частоты запросов"""
         now = time.time()
-        if user_id not in self.rate_limits:
-            self.rate_limits[user_id] = []
+        self._rate_window = max(self._rate_window, window)
+        requests = self.rate_limits.get(user_id)
+        if requests is None:
+            requests = self.rate_limits[user_id] = deque()
+        else:
+            self.rate_limits.move_to_end(user_id)
             
-        # Очистка старых запросов
-        self.rate_limits[user_id] = [
-            req_time for req_time in self.rate_limits[user_id]
-            if now - req_time < window
-        ]
+        # Старые запросы лежат в начале окна - снимаем только их
+        while requests and now - requests[0] >= window:
+            requests.popleft()
         
-        if len(self.rate_limits[user_id]) >= limit:
+        if len(requests) >= limit:
             return False
             
-        self.rate_limits[user_id].append(now)
+        requests.append(now)
         return True
+
+    def sweep(self, limit: int) -> int:
+        """Удалить окна пользователей, не обращавшихся дольше окна (для Sweeper)"""
+        deadline = time.time() - self._rate_window
+        removed = 0
+        while self.rate_limits and removed < limit:
+            user_id, requests = next(iter(self.rate_limits.items()))
+            if requests and requests[-1] > deadline:
+                break
+            del self.rate_limits[user_id]
+            removed += 1
+        return removed
+
+    def sweep_lag(self) -> float:
+        if not self.rate_limits:
+            return 0.0
+        requests = next(iter(self.rate_limits.values()))
+        if not requests:
+            return 0.0
+        return max(time.time() - self._rate_window - requests[-1], 0.0)
         
     def track_metric(self, metric_name: str, value: float) -> None:
         """Отслеживание метрики производительности"""
@@ -113,8 +141,8 @@ class PerformanceOptimizer:
     async def _apply_optimizations(self, metric_name: str) -> None:
         """Применение оптимизаций"""
         if metric_name == 'response_times':
-            # Увеличиваем размер кэша
-            self.performance_manager.quick_cache.maxsize *= 2
+            # Увеличиваем долю кэша в общем бюджете памяти
+            self.performance_manager.quick_cache.weight *= 2
         elif metric_name == 'api_calls':
             # Увеличиваем TTL для API кэша
             self.performance_manager.api_cache.ttl *= 2 
\ No newline at end of file
@@ -3,13 +3,19 @@
 """
 
 import asyncio
+import heapq
+import itertools
+import math
+import random
 import time
 import uuid
-from typing import Any, Dict, List, Optional, Callable, Union
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Hashable, List, Optional, Callable, Tuple, Union
 from datetime import datetime, timedelta
 from dataclasses import dataclass
 from enum import Enum
 from loguru import logger
+from .config import QueueConfig
 
 class TaskStatus(Enum):
     """Статусы задачи"""
@@ -45,17 +51,171 @@ class Task:
     retry_count: int = 0
     started_at: Optional[datetime] = None
     completed_at: Optional[datetime] = None
+    fair_key: Optional[Hashable] = None
+    enqueued_at: float = 0.0  # time.monotonic() постановки в готовые
+
+@dataclass
+class TaskSummary:
+    """Итог завершенной задачи без функции и аргументов"""
+    id: str
+    priority: TaskPriority
+    status: TaskStatus
+    created_at: datetime
+    result: Any = None
+    error: Optional[Exception] = None
+    retry_count: int = 0
+    started_at: Optional[datetime] = None
+    completed_at: Optional[datetime] = None
+
+    @classmethod
+    def from_task(cls, task: Task) -> 'TaskSummary':
+        error = task.error
+        if error is not None:
+            # Трассировка держит кадры воркера со всеми локальными переменными
+            error = error.with_traceback(None)
+        return cls(
+            id=task.id,
+            priority=task.priority,
+            status=task.status,
+            created_at=task.created_at,
+            result=task.result,
+            error=error,
+            retry_count=task.retry_count,
+            started_at=task.started_at,
+            completed_at=task.completed_at
+        )
+
+def _ewma(current: float, sample: float, alpha: float = 0.2) -> float:
+    """Экспоненциальное сглаживание (первое наблюдение берется как есть)"""
+    return sample if not current else current + alpha * (sample - current)
+
+
+class _FairLevel:
+    """Готовые задачи одного приоритета с deficit round-robin по ключам
+
+    У каждого ключа (пользователь, агентство) своя FIFO-очередь, активные
+    ключи обходятся по кругу. При посещении ключ получает ``weight``
+    единиц кредита, а каждая задача стоит одну единицу, поэтому за круг
+    ключ с весом 2 получает вдвое больше задач, чем с весом 1, и поток
+    одного ключа не задерживает остальных дольше одного круга.
+    """
+
+    __slots__ = ("flows", "active", "deficits", "size")
+
+    def __init__(self):
+        self.flows: Dict[Hashable, Deque[Task]] = {}
+        self.active: Deque[Hashable] = deque()
+        self.deficits: Dict[Hashable, float] = {}
+        self.size = 0
+
+    def push(self, task: Task) -> None:
+        flow = self.flows.get(task.fair_key)
+        if flow is None:
+            flow = self.flows[task.fair_key] = deque()
+            self.active.append(task.fair_key)
+            self.deficits[task.fair_key] = 0.0
+        flow.append(task)
+        self.size += 1
+
+    def pop(self, weight: Callable[[Hashable], float]) -> Task:
+        active, deficits = self.active, self.deficits
+        while True:
+            key = active[0]
+            if deficits[key] < 1:
+                deficits[key] += weight(key)
+                if deficits[key] < 1:
+                    active.rotate(-1)
+                    continue
+            flow = self.flows[key]
+            task = flow.popleft()
+            self.size -= 1
+            deficits[key] -= 1
+            if not flow:
+                # Опустевший ключ выходит из круга без накопленного кредита
+                active.popleft()
+                del self.flows[key], deficits[key]
+            elif deficits[key] < 1:
+                active.rotate(-1)
+            return task
+
 
 class TaskQueue:
-    """Очередь задач"""
+    """Очередь задач
+
+    Готовые задачи разложены по приоритетам: задача с высшим приоритетом
+    извлекается первой. Внутри приоритета задачи ключей ``fair_key``
+    чередуются по deficit round-robin с весами ``weights`` (по умолчанию
+    ``default_weight``), поэтому поток /reply одного пользователя не
+    занимает всех воркеров; задачи одного ключа идут FIFO. Свободные
+    воркеры ждут на ``asyncio.Condition`` и будятся только при добавлении
+    задачи, без опроса по таймауту.
+
+    Повтор упавшей задачи не занимает воркер: задача кладется в кучу
+    отложенных (время готовности, номер, задача), и один таймер
+    возвращает ее в очередь, когда подойдет срок. Задержка растет
+    экспоненциально от ``retry_delay`` задачи до ``max_retry_delay`` и
+    случайно уменьшается до доли ``retry_jitter``, чтобы повторы после
+    общего сбоя не приходили одной волной.
+
+    В ``tasks`` только ожидающие, выполняемые и ждущие повтора задачи, и
+    лимит ``max_queue_size`` считается по ним. Завершенные задачи
+    заменяются ``TaskSummary`` в кольце итогов: не больше ``result_limit``
+    последних, каждый живет ``result_ttl`` секунд.
+
+    При ``min_workers`` < ``max_workers`` пул воркеров подстраивается раз в
+    ``scale_interval`` секунд. По закону Литтла нужно λ·S воркеров, где
+    λ - скорость поступления задач, S - сглаженное время выполнения
+    (задержка провайдера AI), плюс столько, чтобы разобрать накопившуюся
+    очередь за один интервал; если сглаженное ожидание в очереди больше
+    ``target_wait``, добавляется хотя бы один воркер. Рост происходит
+    сразу, сокращение - только если цель держится ниже размера пула
+    ``scale_down_delay`` секунд. Лишние воркеры выходят, когда свободны.
+    """
     
-    def __init__(self, max_workers: int = 10, max_queue_size: int = 1000):
+    def __init__(self, max_workers: int = 10, max_queue_size: int = 1000,
+                 max_retry_delay: float = 60.0, retry_jitter: float = 0.5,
+                 result_limit: int = 1000, result_ttl: float = 300.0,
+                 weights: Optional[Dict[Hashable, float]] = None, default_weight: float = 1.0,
+                 min_workers: Optional[int] = None, scale_interval: float = 1.0,
+                 scale_down_delay: float = 30.0, target_wait: float = 0.5,
+                 scale_headroom: float = 1.2):
+        if default_weight <= 0 or any(weight <= 0 for weight in (weights or {}).values()):
+            raise ValueError("Веса ключей должны быть положительными")
+        min_workers = max_workers if min_workers is None else min_workers
+        if not 1 <= min_workers <= max_workers:
+            raise ValueError("Нужно 1 <= min_workers <= max_workers")
         self.max_workers = max_workers
+        self.min_workers = min_workers
+        self.scale_interval = scale_interval
+        self.scale_down_delay = scale_down_delay
+        self.target_wait = target_wait
+        self.scale_headroom = scale_headroom
         self.max_queue_size = max_queue_size
-        self.queues: Dict[TaskPriority, asyncio.Queue] = {
-            priority: asyncio.Queue(maxsize=max_queue_size)
-            for priority in TaskPriority
+        self.result_limit = result_limit
+        self.result_ttl = result_ttl
+        self._results: "OrderedDict[str, Tuple[float, TaskSummary]]" = OrderedDict()
+        self.max_retry_delay = max_retry_delay
+        self.retry_jitter = retry_jitter
+        self.weights: Dict[Hashable, float] = dict(weights or {})
+        self.default_weight = default_weight
+        # Уровни от высшего приоритета к низшему
+        self._levels: Dict[TaskPriority, _FairLevel] = {
+            priority: _FairLevel() for priority in sorted(TaskPriority, key=lambda p: p.value, reverse=True)
         }
+        self._sequence = itertools.count()
+        self._ready_changed = asyncio.Condition()
+        self._delayed: List[Tuple[float, int, Task]] = []
+        self._delayed_changed = asyncio.Event()
+        self._timer: Optional[asyncio.Task] = None
+        # Автомасштабирование: наблюдения и состояние контроллера
+        self._autoscaler: Optional[asyncio.Task] = None
+        self._retiring = 0
+        self._arrivals = 0
+        self._arrival_rate = 0.0
+        self._service_time = 0.0
+        self._wait_time = 0.0
+        self._target_workers = min_workers
+        self._below_since: Optional[float] = None
         self.tasks: Dict[str, Task] = {}
         self.workers: List[asyncio.Task] = []
         self._monitor = None
@@ -65,26 +225,82 @@ class TaskQueue:
         """Установка монитора для отслеживания"""
         self._monitor = monitor
         
+    @classmethod
+    def from_config(cls, queue_config: QueueConfig) -> 'TaskQueue':
+        """Очередь по конфигурации QueueConfig"""
+        return cls(
+            max_workers=queue_config.max_workers,
+            max_queue_size=queue_config.max_queue_size,
+            min_workers=queue_config.min_workers,
+            scale_interval=queue_config.scale_interval,
+            scale_down_delay=queue_config.scale_down_delay,
+            target_wait=queue_config.target_wait
+        )
+
+    @property
+    def pool_size(self) -> int:
+        """Текущий размер пула без воркеров, которым велено выйти"""
+        return len(self.workers) - self._retiring
+
+    def _spawn_workers(self, count: int) -> None:
+        for _ in range(count):
+            worker = asyncio.create_task(self._worker())
+            self.workers.append(worker)
+            worker.add_done_callback(self._forget_worker)
+
+    def _forget_worker(self, worker: asyncio.Task) -> None:
+        if worker in self.workers:
+            self.workers.remove(worker)
+        
     async def start(self) -> None:
         """Запуск обработчиков задач"""
         self._stop_event.clear()
-        for _ in range(self.max_workers):
-            worker = asyncio.create_task(self._worker())
-            self.workers.append(worker)
+        self._spawn_workers(self.min_workers)
+        self._timer = asyncio.create_task(self._run_timer())
+        if self.min_workers < self.max_workers:
+            self._autoscaler = asyncio.create_task(self._run_autoscaler())
             
     async def stop(self) -> None:
         """Остановка обработчиков задач"""
         self._stop_event.set()
+        async with self._ready_changed:
+            self._ready_changed.notify_all()
+        self._delayed_changed.set()
+        if self._autoscaler is not None:
+            self._autoscaler.cancel()
+            await asyncio.gather(self._autoscaler, return_exceptions=True)
+            self._autoscaler = None
         await asyncio.gather(*self.workers, return_exceptions=True)
         self.workers.clear()
-        
+        self._retiring = 0
+        if self._timer is not None:
+            await asyncio.gather(self._timer, return_exceptions=True)
+            self._timer = None
+        # Ожидающие повтора задачи без таймера не вернутся в очередь
+        for _, _, task in self._delayed:
+            if task.status == TaskStatus.RETRYING:
+                task.status = TaskStatus.CANCELLED
+                task.completed_at = datetime.now()
+                self._finish(task)
+        self._delayed.clear()
+
+    def set_weight(self, key: Hashable, weight: float) -> None:
+        """Задать вес ключа справедливой очереди"""
+        if weight <= 0:
+            raise ValueError("Веса ключей должны быть положительными")
+        self.weights[key] = weight
+
+    def _weight(self, key: Hashable) -> float:
+        return self.weights.get(key, self.default_weight)
+
     async def add_task(self, func: Callable, *args, 
                       priority: TaskPriority = TaskPriority.NORMAL,
                       max_retries: int = 3,
                       retry_delay: float = 1.0,
                       timeout: Optional[float] = None,
+                      fair_key: Optional[Hashable] = None,
                       **kwargs) -> str:
-        """Добавление задачи в очередь"""
+        """Добавление задачи в очередь (``fair_key`` - пользователь или агентство)"""
         if len(self.tasks) >= self.max_queue_size:
             raise ValueError("Queue is full")
             
@@ -99,26 +315,158 @@ class TaskQueue:
             retry_delay=retry_delay,
             timeout=timeout,
             created_at=datetime.now(),
-            status=TaskStatus.PENDING
+            status=TaskStatus.PENDING,
+            fair_key=fair_key
         )
         
         self.tasks[task_id] = task
-        await self.queues[priority].put(task)
+        await self._enqueue(task)
         
         if self._monitor:
             await self._monitor.track_metric("queue_size", len(self.tasks))
             
         return task_id
         
-    async def get_task_status(self, task_id: str) -> Optional[Task]:
-        """Получение статуса задачи"""
-        return self.tasks.get(task_id)
+    async def _enqueue(self, task: Task) -> None:
+        """Положить задачу в готовые и разбудить один воркер"""
+        async with self._ready_changed:
+            task.enqueued_at = time.monotonic()
+            self._arrivals += 1
+            self._levels[task.priority].push(task)
+            self._ready_changed.notify()
+
+    def _ready_size(self) -> int:
+        return sum(level.size for level in self._levels.values())
+
+    async def _next_task(self) -> Optional[Task]:
+        """Дождаться задачи с наивысшим приоритетом (None при остановке или сокращении пула)"""
+        async with self._ready_changed:
+            while not self._ready_size():
+                if self._stop_event.is_set():
+                    return None
+                if self._retiring:
+                    self._retiring -= 1
+                    return None
+                await self._ready_changed.wait()
+            if self._stop_event.is_set():
+                return None
+            for level in self._levels.values():
+                if level.size:
+                    task = level.pop(self._weight)
+                    self._wait_time = _ewma(self._wait_time, time.monotonic() - task.enqueued_at)
+                    return task
+
+    def _desired_workers(self, elapsed: float) -> int:
+        """Нужный размер пула по закону Литтла, очереди и времени ожидания"""
+        self._arrival_rate = _ewma(self._arrival_rate, self._arrivals / elapsed)
+        self._arrivals = 0
+        # Пока время выполнения не измерено, считаем, что задача длится интервал
+        service_time = self._service_time or self.scale_interval
+        desired = self._arrival_rate * service_time * self.scale_headroom
+        desired += self._ready_size() * service_time / self.scale_interval
+        desired = math.ceil(desired)
+        if self._wait_time > self.target_wait and self._ready_size():
+            desired = max(desired, self.pool_size + 1)
+        return min(max(desired, self.min_workers), self.max_workers)
+
+    async def _scale(self, elapsed: float) -> None:
+        """Один шаг контроллера с гистерезисом на сокращение"""
+        now = time.monotonic()
+        desired = self._target_workers = self._desired_workers(elapsed)
+        size = self.pool_size
+        if desired > size:
+            self._below_since = None
+            # Сначала отменяем еще не выполненные сокращения
+            revived = min(self._retiring, desired - size)
+            self._retiring -= revived
+            self._spawn_workers(desired - size - revived)
+        elif desired < size:
+            if self._below_since is None:
+                self._below_since = now
+            elif now - self._below_since >= self.scale_down_delay:
+                self._below_since = None
+                async with self._ready_changed:
+                    self._retiring += size - desired
+                    self._ready_changed.notify_all()
+        else:
+            self._below_since = None
+        if self._monitor:
+            await self._monitor.track_metric("worker_pool_size", self.pool_size)
+
+    async def _run_autoscaler(self) -> None:
+        """Периодически подстраивать размер пула"""
+        last = time.monotonic()
+        while not self._stop_event.is_set():
+            await asyncio.sleep(self.scale_interval)
+            now = time.monotonic()
+            try:
+                await self._scale(max(now - last, 1e-6))
+            except Exception as e:
+                logger.error(f"Autoscaler error: {str(e)}")
+            last = now
+
+    def _retry_delay(self, task: Task) -> float:
+        """Экспоненциальная задержка повтора с джиттером"""
+        delay = min(task.retry_delay * 2 ** (task.retry_count - 1), self.max_retry_delay)
+        return delay * random.uniform(1 - self.retry_jitter, 1)
+
+    def _schedule_retry(self, task: Task) -> None:
+        """Отложить задачу до срока повтора, не занимая воркер"""
+        due = time.monotonic() + self._retry_delay(task)
+        heapq.heappush(self._delayed, (due, next(self._sequence), task))
+        if self._delayed[0][2] is task:
+            self._delayed_changed.set()
+
+    async def _run_timer(self) -> None:
+        """Возвращать отложенные задачи в очередь по сроку"""
+        while not self._stop_event.is_set():
+            self._delayed_changed.clear()
+            now = time.monotonic()
+            while self._delayed and self._delayed[0][0] <= now:
+                _, _, task = heapq.heappop(self._delayed)
+                if task.status != TaskStatus.CANCELLED:
+                    await self._enqueue(task)
+            timeout = self._delayed[0][0] - now if self._delayed else None
+            try:
+                await asyncio.wait_for(self._delayed_changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _finish(self, task: Task) -> None:
+        """Перенести завершенную задачу в кольцо итогов"""
+        self.tasks.pop(task.id, None)
+        self._results[task.id] = (time.monotonic() + self.result_ttl, TaskSummary.from_task(task))
+        self._prune_results()
+
+    def _prune_results(self) -> None:
+        """Удалить итоги сверх лимита и с истекшим сроком (самые старые - в начале)"""
+        results = self._results
+        while len(results) > self.result_limit:
+            results.popitem(last=False)
+        now = time.monotonic()
+        while results:
+            deadline, _ = next(iter(results.values()))
+            if deadline > now:
+                break
+            results.popitem(last=False)
+
+    async def get_task_status(self, task_id: str) -> Optional[Union[Task, TaskSummary]]:
+        """Получение статуса задачи (для завершенной - ее итог, пока он хранится)"""
+        task = self.tasks.get(task_id)
+        if task is not None:
+            return task
+        self._prune_results()
+        entry = self._results.get(task_id)
+        return entry[1] if entry is not None else None
         
     async def cancel_task(self, task_id: str) -> bool:
         """Отмена задачи"""
         task = self.tasks.get(task_id)
         if task and task.status in [TaskStatus.PENDING, TaskStatus.RETRYING]:
+            # Задача остается в куче и пропускается при извлечении
             task.status = TaskStatus.CANCELLED
+            task.completed_at = datetime.now()
+            self._finish(task)
             return True
         return False
         
@@ -127,27 +475,17 @@ class TaskQueue:
         while not self._stop_event.is_set():
             try:
                 # Получение задачи с наивысшим приоритетом
-                task = None
-                for priority in reversed(list(TaskPriority)):
-                    try:
-                        task = await asyncio.wait_for(
-                            self.queues[priority].get(),
-                            timeout=0.1
-                        )
-                        break
-                    except asyncio.TimeoutError:
-                        continue
-                        
+                task = await self._next_task()
                 if task is None:
-                    continue
+                    break
                     
                 if task.status == TaskStatus.CANCELLED:
-                    self.queues[task.priority].task_done()
                     continue
                     
                 # Выполнение задачи
                 task.status = TaskStatus.RUNNING
                 task.started_at = datetime.now()
+                started = time.monotonic()
                 
                 try:
                     if task.timeout:
@@ -166,19 +504,19 @@ class TaskQueue:
                     if task.retry_count < task.max_retries:
                         task.status = TaskStatus.RETRYING
                         task.retry_count += 1
-                        await asyncio.sleep(task.retry_delay * task.retry_count)
-                        await self.queues[task.priority].put(task)
+                        self._schedule_retry(task)
                     else:
                         task.status = TaskStatus.FAILED
                         logger.error(f"Task {task.id} failed: {str(e)}")
                         
                 finally:
                     task.completed_at = datetime.now()
+                    self._service_time = _ewma(self._service_time, time.monotonic() - started)
+                    if task.status != TaskStatus.RETRYING:
+                        self._finish(task)
                     if self._monitor:
                         duration = (task.completed_at - task.started_at).total_seconds()
                         await self._monitor.track_metric("task_duration", duration)
-                        
-                self.queues[task.priority].task_done()
                 
             except Exception as e:
                 logger.error(f"Worker error: {str(e)}")
@@ -186,15 +524,23 @@ class TaskQueue:
                 
     async def get_queue_stats(self) -> Dict[str, Any]:
         """Получение статистики очереди"""
+        self._prune_results()
+        summaries = [summary for _, summary in self._results.values()]
         return {
             "total_tasks": len(self.tasks),
+            "finished_tasks": len(summaries),
             "active_workers": len(self.workers),
+            "pool_size": self.pool_size,
+            "target_workers": self._target_workers,
             "queues": {
-                priority.name: queue.qsize()
-                for priority, queue in self.queues.items()
+                priority.name: level.size
+                for priority, level in self._levels.items()
             },
+            "fair_flows": sum(len(level.flows) for level in self._levels.values()),
+            "delayed": len(self._delayed),
             "status_counts": {
                 status.name: sum(1 for t in self.tasks.values() if t.status == status)
+                + sum(1 for t in summaries if t.status == status)
                 for status in TaskStatus
             }
         }
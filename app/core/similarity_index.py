@@ -0,0 +1,239 @@
+"""
+Индекс почти-дубликатов для кэша вариантов ответов
+MinHash по символьным триграммам нормализованного текста + LSH-бэндинг
+"""
+
+import hashlib
+from collections import OrderedDict, defaultdict
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+from loguru import logger
+from .config import config as app_config
+from .key_normalizer import normalize_text
+
+# One-permutation MinHash: хэш шингла выбирает корзину и дает значение
+NUM_PERM = 32
+_BIN_BITS = 5
+_VALUE_MASK = 0xFFFF
+_EMPTY = _VALUE_MASK + 1
+_LANE_BITS = 32
+# Младший бит каждой 32-битной дорожки сигнатуры
+_LANE_LOW_BITS = sum(1 << (lane * _LANE_BITS) for lane in range(NUM_PERM))
+_SHINGLE = 3
+
+
+@lru_cache(maxsize=1 << 16)
+def _shingle_hash(shingle: str) -> int:
+    return int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class NearDuplicateIndex:
+    """LSH-индекс текстов по оценке коэффициента Жаккара
+
+    Сигнатура текста - 32 корзины MinHash по триграммам. Сигнатура делится
+    на ``bands`` полос; тексты с совпадающей полосой становятся кандидатами,
+    для кандидатов сходство оценивается по доле совпавших минимумов.
+    Поиск не зависит от размера индекса: проверяется не больше
+    ``bands * bucket_size`` кандидатов.
+    """
+
+    def __init__(self, threshold: float = 0.8, bands: int = 8,
+                 max_entries: int = 100_000, bucket_size: int = 16,
+                 min_shingles: int = 4):
+        if NUM_PERM % bands:
+            raise ValueError(f"Количество полос должно делить {NUM_PERM}")
+        self.threshold = threshold
+        self._bands = bands
+        self._band_bits = NUM_PERM // bands * _LANE_BITS
+        self._band_mask = (1 << self._band_bits) - 1
+        self._max_entries = max_entries
+        self._bucket_size = bucket_size
+        self._min_shingles = min_shingles
+        # key -> сигнатура; порядок - LRU для ограничения размера
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._tables: List[Dict[int, List[str]]] = [{} for _ in range(bands)]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def signature(self, text: str) -> Optional[int]:
+        """MinHash-сигнатура текста (None для слишком коротких текстов)
+
+        Каждый шингл хэшируется один раз: младшие биты выбирают корзину,
+        старшие - значение, в корзине остается минимум. Пустые корзины
+        заполняются из ближайшей непустой справа со сдвигом на расстояние
+        (densification), поэтому сигнатуры остаются сравнимыми.
+        Корзины упакованы в одно целое по 32 бита на корзину.
+        """
+        padded = f" {normalize_text(text)} "
+        shingles = {padded[i:i + _SHINGLE] for i in range(len(padded) - _SHINGLE + 1)}
+        if len(shingles) < self._min_shingles:
+            return None
+
+        bins = [_EMPTY] * NUM_PERM
+        for shingle in shingles:
+            hashed = _shingle_hash(shingle)
+            slot = hashed & (NUM_PERM - 1)
+            value = (hashed >> _BIN_BITS) & _VALUE_MASK
+            if value < bins[slot]:
+                bins[slot] = value
+
+        signature = list(bins)
+        carry, distance = None, 0
+        # Два прохода справа налево, чтобы пустые корзины в конце взяли значение по кругу
+        for i in range(2 * NUM_PERM - 1, -1, -1):
+            slot = i % NUM_PERM
+            if bins[slot] != _EMPTY:
+                carry, distance = bins[slot], 0
+            elif carry is not None:
+                distance += 1
+                signature[slot] = carry + distance * _EMPTY
+        packed = 0
+        for value in reversed(signature):
+            packed = (packed << _LANE_BITS) | value
+        return packed
+
+    def _band_keys(self, signature: int):
+        step, mask = self._band_bits, self._band_mask
+        return ((signature >> (band * step)) & mask for band in range(self._bands))
+
+    @staticmethod
+    def similarity(first: int, second: int) -> float:
+        """Оценка коэффициента Жаккара по двум сигнатурам (доля совпавших корзин)"""
+        diff = first ^ second
+        # Сворачиваем каждую дорожку в ее младший бит: сдвиги в сумме < 32,
+        # поэтому биты соседних дорожек до младшего бита не доходят
+        for shift in (16, 8, 4, 2, 1):
+            diff |= diff >> shift
+        return (NUM_PERM - (diff & _LANE_LOW_BITS).bit_count()) / NUM_PERM
+
+    def add(self, text: str, key: str) -> bool:
+        """Проиндексировать текст под ключом кэша"""
+        signature = self.signature(text)
+        if signature is None:
+            return False
+        if key in self._entries:
+            self.remove(key)
+        while len(self._entries) >= self._max_entries:
+            self.remove(next(iter(self._entries)))
+
+        self._entries[key] = signature
+        for table, band_key in zip(self._tables, self._band_keys(signature)):
+            bucket = table.setdefault(band_key, [])
+            if len(bucket) >= self._bucket_size:
+                # Популярная полоса: храним только свежие ключи
+                bucket.pop(0)
+            bucket.append(key)
+        return True
+
+    def remove(self, key: str) -> None:
+        """Удалить ключ из индекса"""
+        signature = self._entries.pop(key, None)
+        if signature is None:
+            return
+        for table, band_key in zip(self._tables, self._band_keys(signature)):
+            bucket = table.get(band_key)
+            if bucket is None:
+                continue
+            try:
+                bucket.remove(key)
+            except ValueError:
+                continue
+            if not bucket:
+                del table[band_key]
+
+    def lookup(self, text: str, threshold: Optional[float] = None) -> Optional[Tuple[str, float]]:
+        """Найти ключ самого похожего текста со сходством не ниже порога"""
+        signature = self.signature(text)
+        if signature is None:
+            return None
+
+        best_key, best_score = None, self.threshold if threshold is None else threshold
+        seen = set()
+        for table, band_key in zip(self._tables, self._band_keys(signature)):
+            bucket = table.get(band_key)
+            if not bucket:
+                continue
+            for key in bucket:
+                if key in seen:
+                    continue
+                seen.add(key)
+                score = self.similarity(signature, self._entries[key])
+                if score >= best_score:
+                    best_key, best_score = key, score
+                    if score == 1.0:
+                        self._entries.move_to_end(key)
+                        return key, score
+        if best_key is None:
+            return None
+        self._entries.move_to_end(best_key)
+        return best_key, best_score
+
+    def clear(self) -> None:
+        self._entries.clear()
+        for table in self._tables:
+            table.clear()
+
+
+class NearDuplicateCache:
+    """Кэш вариантов с поиском по похожим сообщениям
+
+    Значения хранятся в пространстве имен общего кэша, а для каждого стиля
+    ведется свой ``NearDuplicateIndex``. Если точного ключа нет, ищется
+    достаточно похожее прежнее сообщение того же стиля.
+    """
+
+    def __init__(self, cache, threshold: Optional[float] = None,
+                 max_entries: Optional[int] = None, enabled: Optional[bool] = None):
+        cache_config = app_config.cache
+        self._cache = cache
+        self.threshold = cache_config.similarity_threshold if threshold is None else threshold
+        self._max_entries = cache_config.similarity_max_entries if max_entries is None else max_entries
+        self.enabled = cache_config.similarity_enabled if enabled is None else enabled
+        self._indexes: Dict[str, NearDuplicateIndex] = {}
+        self._counters: Dict[str, int] = defaultdict(int)
+
+    def _index(self, style: str) -> NearDuplicateIndex:
+        index = self._indexes.get(style)
+        if index is None:
+            index = NearDuplicateIndex(threshold=self.threshold, max_entries=self._max_entries)
+            self._indexes[style] = index
+        return index
+
+    def add(self, text: str, style: str, key: str) -> None:
+        """Запомнить текст, для которого значение лежит в кэше под ``key``"""
+        if self.enabled:
+            self._index(str(style)).add(text, key)
+
+    async def get(self, text: str, style: str) -> Optional[Any]:
+        """Значение для достаточно похожего сообщения того же стиля"""
+        if not self.enabled:
+            return None
+        self._counters["lookups"] += 1
+        index = self._index(str(style))
+        found = index.lookup(text, self.threshold)
+        if found is None:
+            return None
+
+        key, score = found
+        value = await self._cache.get(key)
+        if value is None:
+            # Значение уже вытеснено из кэша - ключ в индексе больше не нужен
+            index.remove(key)
+            self._counters["stale"] += 1
+            return None
+        self._counters["near_hits"] += 1
+        logger.debug(f"NearDuplicateCache: похожее сообщение найдено (сходство {score:.2f})")
+        return value
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "threshold": self.threshold,
+            "entries": {style: len(index) for style, index in self._indexes.items()},
+            "lookups": self._counters["lookups"],
+            "near_hits": self._counters["near_hits"],
+            "stale": self._counters["stale"]
+        }
@@ -0,0 +1,78 @@
+"""
+Single-flight: объединение одинаковых одновременных запросов
+Пока генерация по ключу выполняется, остальные вызовы ждут ее результат
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class _Flight:
+    """Выполняющийся вызов и количество ожидающих его результата"""
+
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Группа вызовов с объединением по ключу
+
+    Загрузчик выполняется в отдельной задаче, все вызывающие (включая
+    первого) ждут ее через ``asyncio.shield``. Отмена одного из ожидающих
+    не прерывает вызов для остальных; задача отменяется, только когда
+    не остается ни одного ожидающего. Ошибку загрузчика получают все
+    ожидающие, в кэш она не попадает.
+    """
+
+    def __init__(self):
+        self._flights: Dict[Hashable, _Flight] = {}
+        self.calls = 0
+        self.coalesced = 0
+        self.cancelled = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._flights
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    async def do(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """Выполнить ``loader`` или присоединиться к уже идущему вызову"""
+        flight = self._flights.get(key)
+        if flight is None:
+            self.calls += 1
+            flight = _Flight(asyncio.ensure_future(loader()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _, k=key, f=flight: self._finish(k, f))
+        else:
+            self.coalesced += 1
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if not flight.task.done() and flight.waiters == 1:
+                # Последний ожидающий ушел - результат больше никому не нужен
+                flight.task.cancel()
+                self.cancelled += 1
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def _finish(self, key: Hashable, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if not flight.task.cancelled():
+            # Помечаем исключение полученным, даже если ожидающих уже нет
+            flight.task.exception()
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "cancelled": self.cancelled,
+            "in_flight": len(self._flights)
+        }
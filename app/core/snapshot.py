@@ -0,0 +1,163 @@
+"""
+Снимок горячего кэша и состояний StateManager
+Перезапуск бота продолжает работу с прогретым кэшем и живыми callback'ами /reply
+"""
+
+import asyncio
+import os
+import pickle
+import struct
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+from loguru import logger
+from .config import config as app_config, SnapshotConfig
+from .state import StateManager
+from .tiered_cache import TieredCache
+
+# Заголовок файла: сигнатура, версия формата, время создания, crc32 тела
+_HEADER = struct.Struct("<8sHdI")
+_MAGIC = b"OFSNAP\x00\x01"
+_VERSION = 1
+
+
+def write_snapshot(path: str, payload: Dict[str, Any], created_at: Optional[float] = None) -> int:
+    """Атомарно записать снимок (zlib поверх pickle), вернуть размер файла"""
+    body = zlib.compress(pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL))
+    header = _HEADER.pack(_MAGIC, _VERSION, created_at or time.time(), zlib.crc32(body))
+    target = Path(path)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_name(target.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(header)
+        f.write(body)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, target)
+    return len(header) + len(body)
+
+
+def read_snapshot(path: str) -> Optional[Tuple[float, Dict[str, Any]]]:
+    """Прочитать снимок: (время создания, данные) или None, если файла нет или он поврежден"""
+    try:
+        with open(path, "rb") as f:
+            raw = f.read()
+    except FileNotFoundError:
+        return None
+
+    if len(raw) < _HEADER.size:
+        logger.warning(f"Снимок {path} обрезан - пропускаем")
+        return None
+    magic, version, created_at, crc = _HEADER.unpack_from(raw)
+    body = raw[_HEADER.size:]
+    if magic != _MAGIC or version != _VERSION or zlib.crc32(body) != crc:
+        logger.warning(f"Снимок {path} поврежден или другой версии - пропускаем")
+        return None
+    return created_at, pickle.loads(zlib.decompress(body))
+
+
+class SnapshotManager:
+    """Периодический снимок кэша и состояний с ленивым восстановлением
+
+    ``start()`` запускает восстановление в фоне: файл читается и
+    распаковывается в отдельном потоке, записи загружаются по одному
+    пространству имен, не блокируя запуск бота. Обработчики, которым нужны
+    восстановленные состояния (callback'и выбора стиля), ждут
+    ``ensure_restored()``. Периодическое сохранение начинается только после
+    восстановления, чтобы не затереть снимок пустым состоянием.
+    """
+
+    def __init__(self, cache: TieredCache, state: StateManager,
+                 snapshot_config: Optional[SnapshotConfig] = None):
+        snapshot_config = snapshot_config or app_config.snapshot
+        self._cache = cache
+        self._state = state
+        self.enabled = snapshot_config.enabled
+        self.path = snapshot_config.path
+        self._interval = snapshot_config.interval
+        self._limit = snapshot_config.max_entries_per_namespace
+        self._restore_task: Optional[asyncio.Task] = None
+        self._periodic_task: Optional[asyncio.Task] = None
+        self._counters: Dict[str, Any] = {
+            "saves": 0, "restored_entries": 0, "restored_states": 0,
+            "last_save_bytes": 0, "last_save_seconds": 0.0
+        }
+
+    def start(self) -> None:
+        """Запустить фоновое восстановление и периодическое сохранение"""
+        if not self.enabled or self._restore_task is not None:
+            return
+        self._restore_task = asyncio.ensure_future(self.restore())
+        if self._interval > 0:
+            self._periodic_task = asyncio.ensure_future(self._periodic())
+
+    async def ensure_restored(self) -> None:
+        """Дождаться загрузки снимка (мгновенно, если она завершена или не запускалась)"""
+        if self._restore_task is not None and not self._restore_task.done():
+            await asyncio.shield(self._restore_task)
+
+    async def restore(self) -> int:
+        """Загрузить снимок с диска в кэш и StateManager"""
+        try:
+            snapshot = await asyncio.to_thread(read_snapshot, self.path)
+        except Exception as e:
+            logger.warning(f"SnapshotManager: не удалось прочитать снимок {self.path}: {e}")
+            return 0
+        if snapshot is None:
+            return 0
+
+        created_at, payload = snapshot
+        elapsed = max(time.time() - created_at, 0.0)
+        restored_states = self._state.import_state(payload.get("state", {}))
+        restored_entries = 0
+        for namespace, entries in payload.get("cache", {}).items():
+            restored_entries += self._cache.import_hot(namespace, entries, elapsed)
+            await asyncio.sleep(0)
+
+        self._counters["restored_entries"] += restored_entries
+        self._counters["restored_states"] += restored_states
+        logger.info(f"SnapshotManager: восстановлено {restored_entries} записей кэша и "
+                    f"{restored_states} состояний (снимок {elapsed:.0f} с назад)")
+        return restored_entries + restored_states
+
+    async def save(self) -> int:
+        """Записать снимок горячих записей и живых состояний"""
+        start = time.perf_counter()
+        payload = {
+            "cache": self._cache.export_hot(self._limit),
+            "state": self._state.export_state()
+        }
+        size = await asyncio.to_thread(write_snapshot, self.path, payload)
+        self._counters["saves"] += 1
+        self._counters["last_save_bytes"] = size
+        self._counters["last_save_seconds"] = round(time.perf_counter() - start, 4)
+        return size
+
+    async def _periodic(self) -> None:
+        await self.ensure_restored()
+        while True:
+            await asyncio.sleep(self._interval)
+            try:
+                await self.save()
+            except Exception as e:
+                logger.warning(f"SnapshotManager: периодический снимок не записан: {e}")
+
+    async def close(self) -> None:
+        """Остановить периодическое сохранение и записать финальный снимок"""
+        if not self.enabled:
+            return
+        if self._periodic_task is not None:
+            self._periodic_task.cancel()
+            await asyncio.gather(self._periodic_task, return_exceptions=True)
+            self._periodic_task = None
+        if self._restore_task is not None:
+            await asyncio.gather(self._restore_task, return_exceptions=True)
+        try:
+            size = await self.save()
+            logger.info(f"SnapshotManager: снимок записан ({size} байт)")
+        except Exception as e:
+            logger.warning(f"SnapshotManager: финальный снимок не записан: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(self._counters)
@@ -0,0 +1,134 @@
+"""
+Упреждающая генерация вариантов ответа
+Пока пользователь выбирает стиль, вероятные стили уже генерируются в фоне
+"""
+
+import asyncio
+from collections import Counter, OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+from loguru import logger
+from .config import config as app_config, SpeculationConfig
+from .state import StateManager
+
+# Префикс пользовательской статистики выбора стилей в StateManager
+STYLE_STAT_PREFIX = "style_"
+
+
+class SpeculativeGenerator:
+    """Фоновая генерация самых вероятных стилей сразу после /reply
+
+    Для пользователя с историей выбирается его самый частый стиль, для
+    нового - ``global_top`` самых популярных стилей среди всех. Количество
+    одновременных упреждающих генераций ограничено ``max_concurrent``:
+    сверх бюджета генерация пропускается, а не ставится в очередь.
+    Результат попадает в кэш вариантов, поэтому нажатие на угаданный стиль
+    отдает готовые варианты (или присоединяется к идущей генерации).
+    """
+
+    def __init__(self, generate: Callable[[str, str], Awaitable[Any]],
+                 state: StateManager,
+                 speculation_config: Optional[SpeculationConfig] = None):
+        speculation_config = speculation_config or app_config.speculation
+        self._generate = generate
+        self._state = state
+        self.enabled = speculation_config.enabled
+        self._max_concurrent = speculation_config.max_concurrent
+        self._global_top = speculation_config.global_top
+        self._default_styles = list(speculation_config.default_styles)
+        self._max_tracked = speculation_config.max_tracked
+        self._global_styles: Counter = Counter()
+        self._in_flight: Set[asyncio.Task] = set()
+        # message_hash -> стили, сгенерированные упреждающе и еще не выбранные
+        self._pending: "OrderedDict[str, Set[str]]" = OrderedDict()
+        self._counters: Dict[str, int] = dict.fromkeys(
+            ("launched", "hits", "misses", "wasted", "skipped"), 0
+        )
+
+    async def predict(self, user_id: int) -> List[str]:
+        """Стили, которые пользователь вероятнее всего выберет"""
+        stats = await self._state.get_user_stats(user_id)
+        personal = {
+            name[len(STYLE_STAT_PREFIX):]: count
+            for name, count in stats.items() if name.startswith(STYLE_STAT_PREFIX)
+        }
+        if personal:
+            return [max(personal, key=personal.get)]
+
+        styles = [style for style, _ in self._global_styles.most_common(self._global_top)]
+        for style in self._default_styles:
+            if len(styles) >= self._global_top:
+                break
+            if style not in styles:
+                styles.append(style)
+        return styles
+
+    async def speculate(self, user_id: int, message_hash: str, user_text: str) -> List[str]:
+        """Запустить фоновую генерацию вероятных стилей"""
+        if not self.enabled:
+            return []
+
+        launched = []
+        for style in await self.predict(user_id):
+            if len(self._in_flight) >= self._max_concurrent:
+                self._counters["skipped"] += 1
+                continue
+            task = asyncio.ensure_future(self._run(user_text, style))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+            launched.append(style)
+
+        if launched:
+            self._track(message_hash, launched)
+        return launched
+
+    async def _run(self, user_text: str, style: str) -> None:
+        try:
+            await self._generate(user_text, style)
+        except Exception as e:
+            logger.debug(f"SpeculativeGenerator: упреждающая генерация {style} не удалась: {e}")
+
+    def _track(self, message_hash: str, styles: List[str]) -> None:
+        self._pending.setdefault(message_hash, set()).update(styles)
+        self._pending.move_to_end(message_hash)
+        self._counters["launched"] += len(styles)
+        while len(self._pending) > self._max_tracked:
+            # Пользователь так и не выбрал стиль - генерация потрачена зря
+            _, unused = self._pending.popitem(last=False)
+            self._counters["wasted"] += len(unused)
+
+    async def record_choice(self, user_id: int, message_hash: str, style: str) -> bool:
+        """Учесть выбор стиля: история пользователя и метрика попаданий"""
+        await self._state.increment_user_stat(user_id, f"{STYLE_STAT_PREFIX}{style}")
+        self._global_styles[style] += 1
+
+        speculated = self._pending.pop(message_hash, None)
+        if speculated is None:
+            return False
+        hit = style in speculated
+        if hit:
+            self._counters["hits"] += 1
+            speculated.discard(style)
+        else:
+            self._counters["misses"] += 1
+        self._counters["wasted"] += len(speculated)
+        return hit
+
+    async def close(self) -> None:
+        """Отменить незавершенные упреждающие генерации"""
+        for task in list(self._in_flight):
+            task.cancel()
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Метрики попаданий и потерь упреждающей генерации"""
+        counters = dict(self._counters)
+        resolved = counters["hits"] + counters["misses"]
+        return {
+            **counters,
+            "in_flight": len(self._in_flight),
+            "pending": len(self._pending),
+            "hit_rate": round(counters["hits"] / resolved * 100, 2) if resolved else 0.0,
+            "waste_rate": round(counters["wasted"] / counters["launched"] * 100, 2)
+            if counters["launched"] else 0.0
+        }
@@ -4,203 +4,1047 @@
 """
 
 import asyncio
-from typing import Dict, Any, Optional
+import heapq
+import pickle
+import time
+from array import array
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, Any, Iterable, List, Optional, Set, Tuple
 from datetime import datetime, timedelta
+from loguru import logger
+from .state_store import SQLiteStateStore
+
+# Вид записи в куче истечения
+_USER = 0
+_MESSAGE = 1
+
+# Сколько ключей, отсутствующих в персистентном хранилище, помнить
+_ABSENT_LIMIT = 10000
+
+# Ключи данных пользователя, которые хранятся в полях записи
+_REPLY_TEXT_KEY = 'last_message_text_for_reply'
+_REPLY_HASH_KEY = 'last_message_hash_for_reply'
+_VARIANTS_PREFIX = 'reply_variants_'
+_STAT_PREFIX = 'stat_'
+
+# Номера счетчиков статистики: общие для всех записей, растут с новыми именами
+_STAT_INDEX: Dict[str, int] = {}
+_STAT_MIN, _STAT_MAX = -2 ** 63, 2 ** 63 - 1
+_MISSING = object()
+
+
+def _stat_slot(name: str) -> int:
+    index = _STAT_INDEX.get(name)
+    if index is None:
+        index = _STAT_INDEX[name] = len(_STAT_INDEX)
+    return index
+
+
+class _UserRecord:
+    """Данные одного пользователя в компактной записи
+
+    Контекст /reply лежит в полях, варианты ответов - в плоском кортеже
+    (hash, варианты, hash, варианты, ...), так как сообщений с вариантами
+    у пользователя обычно одно-два, целые счетчики ``stat_*`` - в массиве int64 по
+    номеру из ``_STAT_INDEX`` (ноль означает отсутствие счетчика). Прочие
+    ключи идут в ``extra``. Пустые контейнеры не создаются, а время
+    истечения хранится прямо в записи как timestamp. Наружу запись
+    выглядит как прежний словарь {ключ: значение}; None равносилен удалению.
+    ``version`` - версия строки в общем хранилище, на которой основана запись.
+    """
+
+    __slots__ = ("expires_at", "version", "reply_text", "reply_hash", "variants", "stats", "extra")
+
+    def __init__(self, expires_at: float = 0.0):
+        self.expires_at = expires_at
+        self.version = 0
+        self.reply_text: Optional[str] = None
+        self.reply_hash: Optional[str] = None
+        self.variants: Optional[Tuple[Any, ...]] = None
+        self.stats: Optional[array] = None
+        self.extra: Optional[Dict[str, Any]] = None
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], expires_at: float) -> '_UserRecord':
+        record = cls(expires_at)
+        for key, value in data.items():
+            record.set(key, value)
+        return record
+
+    def get(self, key: str) -> Any:
+        if key == _REPLY_TEXT_KEY:
+            return self.reply_text
+        if key == _REPLY_HASH_KEY:
+            return self.reply_hash
+        if key.startswith(_STAT_PREFIX):
+            index = _STAT_INDEX.get(key[5:])
+            stats = self.stats
+            if index is not None and stats is not None and index < len(stats) and stats[index]:
+                return stats[index]
+        elif key.startswith(_VARIANTS_PREFIX):
+            variants = self.variants
+            if variants:
+                message_hash = key[15:]
+                for i in range(0, len(variants), 2):
+                    if variants[i] == message_hash:
+                        return variants[i + 1]
+            return None
+        return self.extra.get(key) if self.extra else None
+
+    def set(self, key: str, value: Any) -> int:
+        """Записать значение, вернуть изменение количества ключей"""
+        if key == _REPLY_TEXT_KEY:
+            delta = (value is not None) - (self.reply_text is not None)
+            self.reply_text = value
+            return delta
+        if key == _REPLY_HASH_KEY:
+            delta = (value is not None) - (self.reply_hash is not None)
+            self.reply_hash = value
+            return delta
+
+        delta = self.delete(key)
+        if value is None:
+            return delta
+        if key.startswith(_STAT_PREFIX) and type(value) is int and _STAT_MIN <= value <= _STAT_MAX:
+            if value:
+                index = _stat_slot(key[5:])
+                stats = self.stats
+                if stats is None:
+                    stats = self.stats = array('q')
+                if index >= len(stats):
+                    stats.extend([0] * (index + 1 - len(stats)))
+                stats[index] = value
+                delta += 1
+            return delta
+        if key.startswith(_VARIANTS_PREFIX):
+            message_hash = key[15:]
+            if message_hash == self.reply_hash:
+                message_hash = self.reply_hash  # одна строка на запись вместо двух
+            self.variants = (self.variants or ()) + (message_hash, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+        return delta + 1
+
+    def delete(self, key: str) -> int:
+        """Удалить ключ, вернуть изменение количества ключей (0 или -1)"""
+        if key == _REPLY_TEXT_KEY or key == _REPLY_HASH_KEY:
+            return self.set(key, None)
+        if key.startswith(_STAT_PREFIX):
+            index = _STAT_INDEX.get(key[5:])
+            stats = self.stats
+            if index is not None and stats is not None and index < len(stats) and stats[index]:
+                stats[index] = 0
+                return -1
+        elif key.startswith(_VARIANTS_PREFIX):
+            variants = self.variants
+            if variants:
+                message_hash = key[15:]
+                for i in range(0, len(variants), 2):
+                    if variants[i] == message_hash:
+                        self.variants = variants[:i] + variants[i + 2:] or None
+                        return -1
+            return 0
+        extra = self.extra
+        if extra and extra.pop(key, _MISSING) is not _MISSING:
+            if not extra:
+                self.extra = None
+            return -1
+        return 0
+
+    def _vector_stats(self):
+        values = self.stats
+        if values is not None:
+            for name, index in _STAT_INDEX.items():
+                if index < len(values) and values[index]:
+                    yield name, values[index]
+
+    def stat_items(self) -> Dict[str, Any]:
+        """Счетчики статистики без префикса ``stat_``"""
+        stats = dict(self._vector_stats())
+        if self.extra:
+            stats.update((key[5:], value) for key, value in self.extra.items()
+                         if key.startswith(_STAT_PREFIX))
+        return stats
+
+    def to_dict(self) -> Dict[str, Any]:
+        data: Dict[str, Any] = {}
+        if self.reply_text is not None:
+            data[_REPLY_TEXT_KEY] = self.reply_text
+        if self.reply_hash is not None:
+            data[_REPLY_HASH_KEY] = self.reply_hash
+        if self.variants:
+            pairs = iter(self.variants)
+            data.update((_VARIANTS_PREFIX + message_hash, variants) for message_hash, variants in zip(pairs, pairs))
+        data.update((_STAT_PREFIX + name, value) for name, value in self._vector_stats())
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def __len__(self) -> int:
+        size = (self.reply_text is not None) + (self.reply_hash is not None)
+        if self.variants:
+            size += len(self.variants) // 2
+        if self.stats is not None:
+            size += len(self.stats) - self.stats.count(0)
+        if self.extra:
+            size += len(self.extra)
+        return size
+
+
+class UserTransaction:
+    """Изменения данных одного пользователя, применяемые разом
+
+    Чтение видит собственные изменения поверх записи, проверенной по TTL
+    при открытии. Изменения копятся в ``changes`` и при выходе из блока
+    ``StateManager.transaction`` применяются одной записью с одним
+    продлением TTL; при исключении отбрасываются. Приращения счетчиков
+    дополнительно копятся в ``deltas`` для слияния в общем хранилище.
+    """
+
+    __slots__ = ("_record", "changes", "deltas")
+
+    def __init__(self, record: Optional[_UserRecord]):
+        self._record = record
+        self.changes: Dict[str, Any] = {}
+        self.deltas: Dict[str, int] = {}
+
+    def get(self, key: str) -> Any:
+        if key in self.changes:
+            return self.changes[key]
+        return self._record.get(key) if self._record is not None else None
+
+    def set(self, key: str, value: Any) -> None:
+        self.changes[key] = value
+        self.deltas.pop(key, None)
+
+    def delete(self, key: str) -> None:
+        self.changes[key] = None
+        self.deltas.pop(key, None)
+
+    def increment(self, key: str, amount: int = 1) -> int:
+        if key not in self.changes or key in self.deltas:
+            # После явного set значение абсолютное, приращение не нужно
+            self.deltas[key] = self.deltas.get(key, 0) + amount
+        value = (self.get(key) or 0) + amount
+        self.changes[key] = value
+        return value
+
+
+class _Shard:
+    """Часть состояний: записи пользователей, состояния сообщений и куча истечения
+
+    Куча хранит (время истечения, вид, ключ). Продление
+    TTL добавляет новую запись, а устаревшие записи пропускаются при
+    извлечении, поэтому каждая операция с TTL стоит O(log n). Когда
+    устаревших записей становится больше живых, куча перестраивается.
+    При ограничении числа пользователей ``users`` - ``OrderedDict`` в
+    LRU-порядке, иначе обычный словарь; так же ``states`` при
+    ограничении числа состояний сообщений.
+    """
+
+    __slots__ = ("states", "users", "user_keys", "heap")
+
+    def __init__(self, ordered: bool = False, ordered_states: bool = False):
+        self.states: Dict[str, Dict[str, Any]] = OrderedDict() if ordered_states else {}
+        self.users: Dict[int, _UserRecord] = OrderedDict() if ordered else {}
+        self.user_keys = 0  # Количество ключей всех пользователей шарда
+        self.heap: List[Tuple[float, int, Any]] = []
+
+    def drop_user(self, user_id: int) -> None:
+        record = self.users.pop(user_id, None)
+        if record is not None:
+            self.user_keys -= len(record)
+
+    def expire(self, now: datetime, limit: Optional[int] = None) -> int:
+        """Снять с вершины кучи истекшие записи (не больше ``limit``), вернуть их число"""
+        heap = self.heap
+        deadline = now.timestamp()
+        popped = 0
+        while heap and heap[0][0] <= deadline and (limit is None or popped < limit):
+            _, kind, key = heapq.heappop(heap)
+            popped += 1
+            if kind == _USER:
+                record = self.users.get(key)
+                if record is not None and record.expires_at <= deadline:
+                    self.drop_user(key)
+            else:
+                state = self.states.get(key)
+                if state is not None and state['expires_at'] <= now:
+                    del self.states[key]
+        return popped
+
+    def compact(self) -> None:
+        """Перестроить кучу только из живых записей"""
+        heap = [(record.expires_at, _USER, user_id) for user_id, record in self.users.items()]
+        heap.extend((state['expires_at'].timestamp(), _MESSAGE, message_hash)
+                    for message_hash, state in self.states.items())
+        heapq.heapify(heap)
+        self.heap = heap
+
 
 class StateManager:
-    """Простой менеджер состояний для временного хранения данных"""
-    
-    def __init__(self, ttl_minutes: int = 30):
-        self._states: Dict[str, Dict[str, Any]] = {}
-        self._user_data: Dict[int, Dict[str, Any]] = {}  # {user_id: {key: value}}
-        self._user_data_ttl: Dict[int, datetime] = {}  # TTL для данных пользователей
+    """Простой менеджер состояний для временного хранения данных
+
+    Данные разбиты на ``shards`` шардов: пользователи по ``user_id``,
+    состояния сообщений по ``message_hash``. Истечение отслеживается
+    кучей в каждом шарде, счетчики для статистики поддерживаются при
+    изменениях, поэтому ни очистка, ни статистика не обходят все записи.
+    Данные пользователя хранятся в компактной записи ``_UserRecord``.
+
+    С ``store`` шарды работают как фронт в памяти перед SQLite: промах
+    читается из хранилища и остается в памяти, а изменения копятся в
+    буфере и записываются пакетом через ``flush_interval`` секунд или
+    сразу при ``batch_size`` измененных ключах. Асинхронный API тот же.
+
+    ``max_users`` и ``max_messages`` ограничивают число пользователей и
+    состояний сообщений в памяти: каждый шард держит не больше своей доли
+    и вытесняет давно не использованные. Незаписанные данные вытесненной
+    записи уходят в хранилище со следующим пакетом, без хранилища они
+    теряются, как при истечении TTL.
+
+    С общим хранилищем (``store.shared``) память служит локальным кэшем
+    нескольких процессов: перед чтением ключи, измененные другими
+    процессами, сбрасываются из памяти, а запись проверяет версию строки.
+    При конфликте измененные здесь ключи накладываются на свежую строку
+    и уходят следующим пакетом, а для счетчиков вместо значения
+    повторяются накопленные приращения, поэтому одновременные
+    ``increment`` разных процессов не теряются. Журнал чужих изменений
+    опрашивается не чаще раза в ``sync_interval`` секунд: чтение может
+    отставать от других процессов на этот интервал, запись защищена версией. Пустая запись в этом режиме не удаляется
+    до истечения TTL, чтобы не стереть чужие ключи.
+    """
+
+    def __init__(self, ttl_minutes: int = 30, shards: int = 16,
+                 clock: Callable[[], datetime] = datetime.now,
+                 store: Optional[SQLiteStateStore] = None,
+                 flush_interval: float = 0.5, batch_size: int = 500,
+                 max_users: int = 0, sync_interval: float = 0.05,
+                 max_messages: int = 0):
+        if shards < 1:
+            raise ValueError("Количество шардов должно быть положительным")
+        if max_users < 0:
+            raise ValueError("Лимит пользователей не может быть отрицательным")
+        if max_messages < 0:
+            raise ValueError("Лимит состояний сообщений не может быть отрицательным")
+        self._shards = [_Shard(ordered=max_users > 0, ordered_states=max_messages > 0)
+                        for _ in range(shards)]
+        # Лимит на шард: 0 - без ограничения
+        self._max_users = max_users
+        self._shard_capacity = -(-max_users // shards)
+        self._evictions = 0
+        self._spilled = 0
+        self._max_messages = max_messages
+        self._shard_message_capacity = -(-max_messages // shards)
+        self._message_evictions = 0
+        self._spilled_messages = 0
         self._ttl_minutes = ttl_minutes
-        
+        self._ttl = timedelta(minutes=ttl_minutes)
+        self._clock = clock
+        self._message_count = 0
+        self._user_count = 0
+        self._sweep_cursor = 0
+        # Буфер отложенной записи в хранилище
+        self._store = store
+        self._shared = store is not None and store.shared
+        self._flush_interval = flush_interval
+        self._batch_size = batch_size
+        self._dirty_users: Set[int] = set()
+        self._dirty_messages: Set[str] = set()
+        # Вытесненные из памяти пользователи, ожидающие записи в хранилище
+        self._spill: Dict[int, _UserRecord] = {}
+        self._flushing_spill: Dict[int, _UserRecord] = {}
+        self._message_spill: Dict[str, Dict[str, Any]] = {}
+        self._flushing_message_spill: Dict[str, Dict[str, Any]] = {}
+        self._flushing_users: Set[int] = set()
+        self._flushing_messages: Set[str] = set()
+        # Общее хранилище: измененные ключи пользователей для слияния при
+        # конфликте и пользователи, измененные другими процессами во время записи
+        self._dirty_keys: Dict[int, Set[str]] = {}
+        # Незаписанные приращения счетчиков: повторяются поверх чужой строки
+        self._dirty_deltas: Dict[int, Dict[str, int]] = {}
+        self._stale_users: Set[int] = set()
+        self._sync_interval = sync_interval
+        self._next_sync = 0.0
+        self._absent: Set[Any] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._batch_full: Optional[asyncio.Event] = None
+        self._flush_lock = asyncio.Lock()
+        self._store_loads = 0
+
+    def _shard(self, key: Any) -> _Shard:
+        return self._shards[hash(key) % len(self._shards)]
+
+    def _schedule(self, shard: _Shard, expires_at: float, kind: int, key: Any) -> None:
+        heapq.heappush(shard.heap, (expires_at, kind, key))
+        live = len(shard.users) + len(shard.states)
+        if len(shard.heap) > 2 * live + 64:
+            shard.compact()
+
+    def _expire_shard(self, shard: _Shard, now: datetime, limit: Optional[int] = None) -> int:
+        users, messages = len(shard.users), len(shard.states)
+        popped = shard.expire(now, limit)
+        if popped:
+            self._user_count -= users - len(shard.users)
+            self._message_count -= messages - len(shard.states)
+        return popped
+
+    def _drop_user(self, shard: _Shard, user_id: int) -> None:
+        if user_id in shard.users:
+            self._user_count -= 1
+        shard.drop_user(user_id)
+
+    def _live_user(self, user_id: int) -> Optional[_UserRecord]:
+        """Запись пользователя с проверкой TTL (истекшие удаляются сразу)"""
+        if self._shared:
+            self._sync()
+        shard = self._shard(user_id)
+        record = shard.users.get(user_id)
+        if record is None:
+            return self._load_user(shard, user_id)
+        if self._clock().timestamp() > record.expires_at:
+            self._drop_user(shard, user_id)
+            return None
+        if self._max_users:
+            shard.users.move_to_end(user_id)
+        return record
+
+    def _writable_user(self, user_id: int) -> Tuple[_Shard, _UserRecord]:
+        """Живая запись пользователя для изменения (создается при отсутствии)"""
+        shard = self._shard(user_id)
+        record = self._live_user(user_id)
+        if record is None:
+            record = shard.users[user_id] = _UserRecord()
+            self._user_count += 1
+            self._evict(shard)
+        return shard, record
+
+    def _evict(self, shard: _Shard) -> None:
+        """Вытеснить LRU-пользователей шарда сверх лимита"""
+        if not self._max_users:
+            return
+        deadline = self._clock().timestamp()
+        while len(shard.users) > self._shard_capacity:
+            user_id, record = shard.users.popitem(last=False)
+            self._user_count -= 1
+            shard.user_keys -= len(record)
+            self._evictions += 1
+            if self._store is None or record.expires_at <= deadline:
+                continue
+            if user_id in self._dirty_users or user_id in self._flushing_users:
+                # Последняя версия еще не в хранилище: пишем ее следующим пакетом
+                self._dirty_users.discard(user_id)
+                self._spill[user_id] = record
+                self._spilled += 1
+                self._schedule_flush()
+
+    def _evict_messages(self, shard: _Shard) -> None:
+        """Вытеснить LRU-состояния сообщений шарда сверх лимита"""
+        if not self._max_messages:
+            return
+        now = self._clock()
+        while len(shard.states) > self._shard_message_capacity:
+            message_hash, state = shard.states.popitem(last=False)
+            self._message_count -= 1
+            self._message_evictions += 1
+            if self._store is None or state['expires_at'] <= now:
+                continue
+            if message_hash in self._dirty_messages or message_hash in self._flushing_messages:
+                # Иначе пакет принял бы отсутствие в памяти за удаление
+                self._dirty_messages.discard(message_hash)
+                self._message_spill[message_hash] = state
+                self._spilled_messages += 1
+                self._schedule_flush()
+
+    def _touch(self, shard: _Shard, user_id: int, record: _UserRecord, keys: Iterable[str],
+               deltas: Optional[Dict[str, int]] = None) -> None:
+        """Продлить TTL записи после изменения и поставить ее в очередь записи"""
+        record.expires_at = (self._clock() + self._ttl).timestamp()
+        self._schedule(shard, record.expires_at, _USER, user_id)
+        self._mark_user(user_id, keys, deltas)
+
+    def _mark_user(self, user_id: int, keys: Iterable[str] = (),
+                   deltas: Optional[Dict[str, int]] = None) -> None:
+        """Поставить пользователя в очередь записи, запомнив измененные ключи
+
+        ``deltas`` - приращения счетчиков среди ``keys``; остальные ключи
+        записаны целиком и сбрасывают накопленные для них приращения.
+        """
+        if self._shared:
+            self._dirty_keys.setdefault(user_id, set()).update(keys)
+            pending = self._dirty_deltas.get(user_id)
+            for key in keys:
+                if deltas and key in deltas:
+                    pending = self._dirty_deltas.setdefault(user_id, {})
+                    pending[key] = pending.get(key, 0) + deltas[key]
+                elif pending:
+                    pending.pop(key, None)
+        self._mark(self._dirty_users, user_id)
+
+    # === ПЕРСИСТЕНТНОЕ ХРАНИЛИЩЕ ===
+
+    def _stored_key(self, key: Any, dirty: Set[Any], flushing: Set[Any]) -> bool:
+        """Стоит ли искать ключ в хранилище: для измененных ключей память главнее"""
+        return (self._store is not None and key not in self._absent
+                and key not in dirty and key not in flushing)
+
+    def _remember_absent(self, key: Any) -> None:
+        if len(self._absent) >= _ABSENT_LIMIT:
+            self._absent.clear()
+        self._absent.add(key)
+
+    def _load_user(self, shard: _Shard, user_id: int) -> Optional[_UserRecord]:
+        """Прочитать пользователя из хранилища (или буфера вытесненных) в память"""
+        record = self._spill.pop(user_id, None)
+        if record is not None:
+            # Запись не дошла до хранилища и снова в памяти
+            self._dirty_users.add(user_id)
+        else:
+            record = self._flushing_spill.get(user_id)
+        if record is None:
+            if not self._stored_key(user_id, self._dirty_users, self._flushing_users):
+                return None
+            self._store_loads += 1
+            row = self._store.load_user(user_id, self._clock().timestamp())
+            if row is None:
+                self._remember_absent(user_id)
+                return None
+            record = _UserRecord.from_dict(row[0], row[1])
+            if self._shared:
+                record.version = row[2]
+        elif record.expires_at < self._clock().timestamp():
+            return None
+        shard.users[user_id] = record
+        shard.user_keys += len(record)
+        self._user_count += 1
+        self._schedule(shard, record.expires_at, _USER, user_id)
+        self._evict(shard)
+        return record
+
+    def _load_message(self, shard: _Shard, message_hash: str) -> Optional[Dict[str, Any]]:
+        """Прочитать состояние сообщения из хранилища (или буфера вытесненных) в память"""
+        state = self._message_spill.pop(message_hash, None)
+        if state is not None:
+            self._dirty_messages.add(message_hash)
+        else:
+            state = self._flushing_message_spill.get(message_hash)
+        if state is None:
+            if not self._stored_key(message_hash, self._dirty_messages, self._flushing_messages):
+                return None
+            self._store_loads += 1
+            row = self._store.load_message(message_hash, self._clock().timestamp())
+            if row is None:
+                self._remember_absent(message_hash)
+                return None
+            state = row[0]
+        elif state['expires_at'] < self._clock():
+            return None
+        shard.states[message_hash] = state
+        self._message_count += 1
+        self._schedule(shard, state['expires_at'].timestamp(), _MESSAGE, message_hash)
+        self._evict_messages(shard)
+        return state
+
+    def _sync(self) -> None:
+        """Сбросить из памяти пользователей и сообщения, измененные другими процессами
+
+        Опрос идет в потоке цикла событий, поэтому не чаще ``sync_interval``.
+        """
+        now = time.monotonic()
+        if now < self._next_sync:
+            return
+        self._next_sync = now + self._sync_interval
+        changed = self._store.poll_changes()
+        if changed is None:
+            self._absent.clear()
+            users = [user_id for shard in self._shards for user_id in shard.users]
+            messages = [message_hash for shard in self._shards for message_hash in shard.states]
+        else:
+            users, messages = changed
+        for user_id in users:
+            self._absent.discard(user_id)
+            if user_id in self._flushing_users:
+                # Чужая запись могла пройти после нашей: решим после пакета
+                self._stale_users.add(user_id)
+            elif user_id not in self._dirty_users and user_id not in self._spill:
+                # Свои несохраненные изменения сольются с чужими при записи
+                self._drop_user(self._shard(user_id), user_id)
+        for message_hash in messages:
+            self._absent.discard(message_hash)
+            if message_hash not in self._dirty_messages and message_hash not in self._flushing_messages:
+                if self._shard(message_hash).states.pop(message_hash, None) is not None:
+                    self._message_count -= 1
+
+    def _restore_deltas(self, user_id: int, deltas: Dict[str, int]) -> None:
+        """Вернуть в буфер приращения неудавшегося пакета
+
+        Ключ, записанный целиком после начала пакета, остается абсолютным.
+        """
+        overwritten = self._dirty_keys.get(user_id, ())
+        pending = self._dirty_deltas.get(user_id, {})
+        for key, amount in deltas.items():
+            if key in overwritten and key not in pending:
+                continue
+            pending[key] = pending.get(key, 0) + amount
+        if pending:
+            self._dirty_deltas[user_id] = pending
+
+    def _merge_conflicts(self, conflicts: Dict[int, Tuple[Dict[str, Any], float, int]],
+                         spilled: Dict[int, _UserRecord], keys: Dict[int, Set[str]],
+                         deltas: Dict[int, Dict[str, int]]) -> None:
+        """Наложить свои изменения на строки, записанные другими процессами
+
+        Обычные ключи берутся из локальной записи, счетчики получают свежее
+        значение плюс еще не записанные приращения этого процесса.
+        """
+        for user_id, (data, expires_at, version) in conflicts.items():
+            shard = self._shard(user_id)
+            local = shard.users.get(user_id)
+            if local is None:
+                local = self._spill.get(user_id, spilled.get(user_id))
+            if local is None:
+                self._dirty_deltas.pop(user_id, None)
+                continue  # удален здесь, удаление уйдет следующим пакетом
+            self._restore_deltas(user_id, deltas.get(user_id, {}))
+            pending = self._dirty_deltas.get(user_id, {})
+            # Ключи пакета и ключи, измененные во время записи
+            changed = keys.get(user_id, set()) | self._dirty_keys.get(user_id, set())
+            merged = _UserRecord.from_dict(data, expires_at)
+            merged.version = version
+            for key in changed:
+                if key in pending:
+                    merged.set(key, (merged.get(key) or 0) + pending[key])
+                else:
+                    merged.set(key, local.get(key))
+            merged.expires_at = max(merged.expires_at, local.expires_at)
+            self._dirty_keys.setdefault(user_id, set()).update(changed)
+            if user_id in shard.users:
+                shard.user_keys += len(merged) - len(local)
+                shard.users[user_id] = merged
+                self._schedule(shard, merged.expires_at, _USER, user_id)
+                self._mark(self._dirty_users, user_id)
+            else:
+                self._spill[user_id] = merged
+                self._schedule_flush()
+
+    def _mark(self, dirty: Set[Any], key: Any) -> None:
+        """Поставить ключ в очередь отложенной записи"""
+        if self._store is None:
+            return
+        dirty.add(key)
+        self._absent.discard(key)
+        self._schedule_flush()
+
+    def _pending_writes(self) -> int:
+        return (len(self._dirty_users) + len(self._dirty_messages)
+                + len(self._spill) + len(self._message_spill))
+
+    def _schedule_flush(self) -> None:
+        pending = self._pending_writes()
+        if self._flush_task is not None and not self._flush_task.done():
+            if pending >= self._batch_size and self._batch_full is not None:
+                self._batch_full.set()
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._batch_full = asyncio.Event()
+        if pending >= self._batch_size:
+            self._batch_full.set()
+        self._flush_task = loop.create_task(self._delayed_flush(self._batch_full))
+
+    async def _delayed_flush(self, batch_full: asyncio.Event) -> None:
+        try:
+            await asyncio.wait_for(batch_full.wait(), self._flush_interval)
+        except asyncio.TimeoutError:
+            pass
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.warning(f"StateManager: ошибка записи в хранилище: {e}")
+        self._flush_task = None
+        if self._pending_writes():
+            self._schedule_flush()
+
+    async def flush(self) -> int:
+        """Записать накопленные изменения одним пакетом, вернуть число ключей"""
+        if self._store is None:
+            return 0
+        async with self._flush_lock:
+            users, self._dirty_users = self._dirty_users, set()
+            messages, self._dirty_messages = self._dirty_messages, set()
+            spilled, self._spill = self._spill, {}
+            spilled_messages, self._message_spill = self._message_spill, {}
+            if not users and not messages and not spilled and not spilled_messages:
+                return 0
+            keys = {user_id: self._dirty_keys.pop(user_id) for user_id in users | spilled.keys()
+                    if user_id in self._dirty_keys}
+            deltas = {user_id: self._dirty_deltas.pop(user_id) for user_id in keys
+                      if user_id in self._dirty_deltas}
+            # Значения сериализуются в потоке цикла, чтобы пакет был согласованным
+            upserted_users, deleted_users = [], []
+            pending = [(user_id, self._shard(user_id).users.get(user_id)) for user_id in users]
+            pending.extend(spilled.items())
+            for user_id, record in pending:
+                if record is None:
+                    deleted_users.append((user_id,))
+                else:
+                    row = (user_id, pickle.dumps(record.to_dict(), pickle.HIGHEST_PROTOCOL), record.expires_at)
+                    upserted_users.append(row + (record.version,) if self._shared else row)
+            upserted_messages, deleted_messages = [], []
+            for message_hash in messages:
+                state = self._shard(message_hash).states.get(message_hash)
+                if state is None:
+                    deleted_messages.append((message_hash,))
+                else:
+                    upserted_messages.append((message_hash, pickle.dumps(state, pickle.HIGHEST_PROTOCOL),
+                                              state['expires_at'].timestamp()))
+            for message_hash, state in spilled_messages.items():
+                upserted_messages.append((message_hash, pickle.dumps(state, pickle.HIGHEST_PROTOCOL),
+                                          state['expires_at'].timestamp()))
+
+            self._flushing_users, self._flushing_messages = users, messages
+            self._flushing_spill = spilled
+            self._flushing_message_spill = spilled_messages
+            try:
+                result = await asyncio.to_thread(self._store.write_batch, upserted_users, deleted_users,
+                                                 upserted_messages, deleted_messages, self._clock().timestamp())
+            except BaseException:
+                # Неудачный пакет возвращается в буфер и уйдет со следующим
+                self._dirty_users |= users
+                self._dirty_messages |= messages
+                for user_id, record in spilled.items():
+                    if user_id not in self._shard(user_id).users:
+                        self._spill.setdefault(user_id, record)
+                for message_hash, state in spilled_messages.items():
+                    if message_hash not in self._shard(message_hash).states:
+                        self._message_spill.setdefault(message_hash, state)
+                for user_id, pending in deltas.items():
+                    self._restore_deltas(user_id, pending)
+                for user_id, changed in keys.items():
+                    self._dirty_keys.setdefault(user_id, set()).update(changed)
+                raise
+            finally:
+                self._flushing_users, self._flushing_messages = set(), set()
+                self._flushing_spill = {}
+                self._flushing_message_spill = {}
+                stale, self._stale_users = self._stale_users, set()
+            if self._shared:
+                versions, conflicts = result
+                for user_id, version in versions.items():
+                    record = self._shard(user_id).users.get(user_id)
+                    if record is None:
+                        record = self._spill.get(user_id)
+                    if record is not None:
+                        record.version = version
+                self._merge_conflicts(conflicts, spilled, keys, deltas)
+                for user_id in stale - conflicts.keys():
+                    if user_id not in self._dirty_users and user_id not in self._spill:
+                        self._drop_user(self._shard(user_id), user_id)
+            return len(users) + len(messages) + len(spilled) + len(spilled_messages)
+
+    async def close(self) -> None:
+        """Дописать буфер и закрыть хранилище"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        if self._store is not None:
+            await self.flush()
+            self._store.close()
+            self._store = None
+
     # === НОВЫЕ МЕТОДЫ ДЛЯ РАБОТЫ С ПОЛЬЗОВАТЕЛЬСКИМИ ДАННЫМИ ===
-    
+
     async def set_user_data(self, user_id: int, key: str, value: Any) -> None:
         """Установить данные пользователя"""
-        if user_id not in self._user_data:
-            self._user_data[user_id] = {}
-        
-        self._user_data[user_id][key] = value
+        shard, record = self._writable_user(user_id)
+        shard.user_keys += record.set(key, value)
         # Обновляем TTL для пользователя
-        self._user_data_ttl[user_id] = datetime.now() + timedelta(minutes=self._ttl_minutes)
-        
+        self._touch(shard, user_id, record, (key,))
+
     async def get_user_data(self, user_id: int, key: str) -> Optional[Any]:
         """Получить данные пользователя"""
-        # Проверяем не истек ли срок хранения
-        if user_id in self._user_data_ttl:
-            if datetime.now() > self._user_data_ttl[user_id]:
-                # Удаляем истекшие данные
-                self._user_data.pop(user_id, None)
-                self._user_data_ttl.pop(user_id, None)
-                return None
-        
-        if user_id not in self._user_data:
+        record = self._live_user(user_id)
+        if record is None:
             return None
-            
-        return self._user_data[user_id].get(key)
-    
+
+        return record.get(key)
+
     async def delete_user_data(self, user_id: int, key: Optional[str] = None) -> None:
         """Удалить данные пользователя"""
-        if user_id not in self._user_data:
+        record = self._live_user(user_id)
+        if record is None:
             return
-            
+
+        shard = self._shard(user_id)
         if key is None:
             # Удаляем все данные пользователя
-            self._user_data.pop(user_id, None)
-            self._user_data_ttl.pop(user_id, None)
+            self._dirty_keys.pop(user_id, None)
+            self._dirty_deltas.pop(user_id, None)
+            self._mark(self._dirty_users, user_id)
+            self._drop_user(shard, user_id)
         else:
             # Удаляем конкретный ключ
-            self._user_data[user_id].pop(key, None)
+            self._mark_user(user_id, (key,))
+            shard.user_keys += record.delete(key)
             # Если данных не осталось, удаляем пользователя полностью
-            if not self._user_data[user_id]:
-                self._user_data.pop(user_id, None)
-                self._user_data_ttl.pop(user_id, None)
-    
+            if not len(record) and not self._shared:
+                self._drop_user(shard, user_id)
+
     async def get_all_user_data(self, user_id: int) -> Optional[Dict[str, Any]]:
         """Получить все данные пользователя"""
-        # Проверяем TTL
-        if user_id in self._user_data_ttl:
-            if datetime.now() > self._user_data_ttl[user_id]:
-                self._user_data.pop(user_id, None)
-                self._user_data_ttl.pop(user_id, None)
-                return None
-        
-        return self._user_data.get(user_id, {}).copy()
-    
+        known = user_id in self._shard(user_id).users
+        record = self._live_user(user_id)
+        if record is None:
+            return None if known else {}
+
+        return record.to_dict()
+
+    async def get_many(self, user_id: int, keys: Iterable[str]) -> Dict[str, Any]:
+        """Получить несколько ключей пользователя за одну проверку TTL"""
+        record = self._live_user(user_id)
+        if record is None:
+            return {key: None for key in keys}
+        return {key: record.get(key) for key in keys}
+
+    async def set_many(self, user_id: int, data: Dict[str, Any]) -> None:
+        """Установить несколько ключей пользователя одной записью (None удаляет ключ)"""
+        if data:
+            self._apply(user_id, data)
+
+    @asynccontextmanager
+    async def transaction(self, user_id: int) -> AsyncIterator[UserTransaction]:
+        """Транзакция над данными пользователя: одна проверка TTL и одна запись"""
+        transaction = UserTransaction(self._live_user(user_id))
+        yield transaction
+        if transaction.changes:
+            self._apply(user_id, transaction.changes, transaction.deltas)
+
+    def _apply(self, user_id: int, changes: Dict[str, Any],
+               deltas: Optional[Dict[str, int]] = None) -> None:
+        shard, record = self._writable_user(user_id)
+        for key, value in changes.items():
+            shard.user_keys += record.set(key, value)
+        if len(record) or self._shared:
+            self._touch(shard, user_id, record, changes, deltas)
+        else:
+            # Как и в delete_user_data, пустая запись удаляется полностью
+            self._mark(self._dirty_users, user_id)
+            self._drop_user(shard, user_id)
+
     async def has_user_data(self, user_id: int, key: str) -> bool:
         """Проверить наличие данных пользователя"""
         value = await self.get_user_data(user_id, key)
         return value is not None
-    
+
     # === СПЕЦИАЛИЗИРОВАННЫЕ МЕТОДЫ ДЛЯ /reply КОМАНДЫ ===
-    
+
     async def set_last_message_for_reply(self, user_id: int, message_text: str, message_hash: str) -> None:
         """Сохранить последнее сообщение для команды /reply"""
-        await self.set_user_data(user_id, 'last_message_text_for_reply', message_text)
-        await self.set_user_data(user_id, 'last_message_hash_for_reply', message_hash)
-    
+        await self.set_many(user_id, {
+            _REPLY_TEXT_KEY: message_text,
+            _REPLY_HASH_KEY: message_hash
+        })
+
     async def get_last_message_for_reply(self, user_id: int) -> Optional[Dict[str, str]]:
         """Получить последнее сообщение для команды /reply"""
-        message_text = await self.get_user_data(user_id, 'last_message_text_for_reply')
-        message_hash = await self.get_user_data(user_id, 'last_message_hash_for_reply')
-        
+        data = await self.get_many(user_id, (_REPLY_TEXT_KEY, _REPLY_HASH_KEY))
+        message_text, message_hash = data[_REPLY_TEXT_KEY], data[_REPLY_HASH_KEY]
+
         if message_text and message_hash:
             return {
                 'text': message_text,
                 'hash': message_hash
             }
         return None
-    
+
     async def clear_last_message_for_reply(self, user_id: int) -> None:
         """Очистить последнее сообщение для команды /reply"""
-        await self.delete_user_data(user_id, 'last_message_text_for_reply')
-        await self.delete_user_data(user_id, 'last_message_hash_for_reply')
-    
+        await self.set_many(user_id, {_REPLY_TEXT_KEY: None, _REPLY_HASH_KEY: None})
+
     async def set_reply_variants(self, user_id: int, message_hash: str, variants: list) -> None:
         """Сохранить варианты ответов"""
         await self.set_user_data(user_id, f'reply_variants_{message_hash}', variants)
-    
+
     async def get_reply_variants(self, user_id: int, message_hash: str) -> Optional[list]:
         """Получить варианты ответов"""
         return await self.get_user_data(user_id, f'reply_variants_{message_hash}')
-    
+
     async def clear_reply_variants(self, user_id: int, message_hash: str) -> None:
         """Очистить варианты ответов"""
         await self.delete_user_data(user_id, f'reply_variants_{message_hash}')
-    
+
     # === МЕТОДЫ ДЛЯ СТАТИСТИКИ ПОЛЬЗОВАТЕЛЕЙ ===
-    
+
     async def increment_user_stat(self, user_id: int, stat_name: str) -> int:
         """Увеличить счетчик статистики пользователя"""
-        current_value = await self.get_user_data(user_id, f'stat_{stat_name}') or 0
-        new_value = current_value + 1
-        await self.set_user_data(user_id, f'stat_{stat_name}', new_value)
+        key = f'stat_{stat_name}'
+        shard, record = self._writable_user(user_id)
+        new_value = (record.get(key) or 0) + 1
+        shard.user_keys += record.set(key, new_value)
+        self._touch(shard, user_id, record, (key,), {key: 1})
         return new_value
-    
+
     async def get_user_stat(self, user_id: int, stat_name: str) -> int:
         """Получить значение статистики пользователя"""
         return await self.get_user_data(user_id, f'stat_{stat_name}') or 0
-    
+
     async def get_user_stats(self, user_id: int) -> Dict[str, int]:
         """Получить все статистики пользователя"""
-        all_data = await self.get_all_user_data(user_id) or {}
-        stats = {}
-        for key, value in all_data.items():
-            if key.startswith('stat_'):
-                stat_name = key[5:]  # Убираем префикс 'stat_'
-                stats[stat_name] = value
-        return stats
-        
+        record = self._live_user(user_id)
+        return record.stat_items() if record is not None else {}
+
     # === СУЩЕСТВУЮЩИЕ МЕТОДЫ ДЛЯ СОВМЕСТИМОСТИ ===
-        
+
     async def set_user_message(self, message_hash: str, user_id: int, message: str, additional_data: Dict = None) -> None:
         """Сохранить сообщение пользователя"""
-        expires_at = datetime.now() + timedelta(minutes=self._ttl_minutes)
-        
-        self._states[message_hash] = {
+        now = self._clock()
+        expires_at = now + self._ttl
+
+        shard = self._shard(message_hash)
+        if message_hash not in shard.states:
+            self._message_count += 1
+        shard.states[message_hash] = {
             'user_id': user_id,
             'message': message,
-            'created_at': datetime.now(),
+            'created_at': now,
             'expires_at': expires_at,
             'additional_data': additional_data or {}
         }
-        
+        self._schedule(shard, expires_at.timestamp(), _MESSAGE, message_hash)
+        self._message_spill.pop(message_hash, None)
+        self._mark(self._dirty_messages, message_hash)
+        if self._max_messages:
+            shard.states.move_to_end(message_hash)
+            self._evict_messages(shard)
+
     async def get_user_message(self, message_hash: str) -> Optional[Dict[str, Any]]:
         """Получить сообщение пользователя"""
-        if message_hash not in self._states:
+        if self._shared:
+            self._sync()
+        shard = self._shard(message_hash)
+        state = shard.states.get(message_hash)
+        if state is None:
+            state = self._load_message(shard, message_hash)
+        if state is None:
             return None
-            
-        state = self._states[message_hash]
-        
+
         # Проверяем не истек ли срок
-        if datetime.now() > state['expires_at']:
-            del self._states[message_hash]
+        if self._clock() > state['expires_at']:
+            del shard.states[message_hash]
+            self._message_count -= 1
             return None
-            
+
+        if self._max_messages:
+            shard.states.move_to_end(message_hash)
         return state
-        
+
     async def delete_user_message(self, message_hash: str) -> None:
         """Удалить сообщение пользователя"""
-        self._states.pop(message_hash, None)
-        
+        if self._shard(message_hash).states.pop(message_hash, None) is not None:
+            self._message_count -= 1
+        self._message_spill.pop(message_hash, None)
+        self._mark(self._dirty_messages, message_hash)
+
     async def cleanup_expired(self) -> None:
-        """Очистка истекших состояний"""
-        now = datetime.now()
-        
-        # Очистка старых состояний сообщений
-        expired_message_keys = [
-            key for key, state in self._states.items()
-            if now > state['expires_at']
-        ]
-        
-        for key in expired_message_keys:
-            del self._states[key]
-        
-        # Очистка истекших пользовательских данных
-        expired_user_ids = [
-            user_id for user_id, ttl in self._user_data_ttl.items()
-            if now > ttl
-        ]
-        
-        for user_id in expired_user_ids:
-            self._user_data.pop(user_id, None)
-            self._user_data_ttl.pop(user_id, None)
-            
-    async def get_stats(self) -> Dict[str, int]:
-        """Получить статистику состояний"""
-        await self.cleanup_expired()
-        
-        total_user_data_keys = sum(len(data) for data in self._user_data.values())
-        
-        return {
-            'total_message_states': len(self._states),
-            'total_users_with_data': len(self._user_data),
-            'total_user_data_keys': total_user_data_keys,
-            'ttl_minutes': self._ttl_minutes
+        """Очистка истекших состояний (только записи с вершин куч, O(log n) на запись)"""
+        now = self._clock()
+        for shard in self._shards:
+            self._expire_shard(shard, now)
+
+    def sweep(self, limit: int) -> int:
+        """Порция фонового удаления истекших записей по шардам по кругу (для Sweeper)"""
+        now = self._clock()
+        done = 0
+        for _ in range(len(self._shards)):
+            shard = self._shards[self._sweep_cursor]
+            done += self._expire_shard(shard, now, limit - done)
+            if done >= limit:
+                break
+            self._sweep_cursor = (self._sweep_cursor + 1) % len(self._shards)
+        return done
+
+    def sweep_lag(self) -> float:
+        deadline = self._clock().timestamp()
+        oldest = min((shard.heap[0][0] for shard in self._shards if shard.heap), default=deadline)
+        return max(deadline - oldest, 0.0)
+
+    # === СНИМОК ДЛЯ ПЕРЕЗАПУСКА ===
+
+    def export_state(self) -> Dict[str, Any]:
+        """Живые состояния сообщений и данные пользователей для снимка"""
+        now = self._clock()
+        deadline = now.timestamp()
+        states: Dict[str, Dict[str, Any]] = {}
+        user_data: Dict[int, Tuple[Dict[str, Any], datetime]] = {}
+        for shard in self._shards:
+            states.update(
+                (message_hash, state) for message_hash, state in shard.states.items()
+                if state['expires_at'] > now
+            )
+            user_data.update(
+                (user_id, (record.to_dict(), datetime.fromtimestamp(record.expires_at)))
+                for user_id, record in shard.users.items()
+                if record.expires_at > deadline
+            )
+        return {'states': states, 'user_data': user_data}
+
+    def import_state(self, snapshot: Dict[str, Any]) -> int:
+        """Восстановить состояния из снимка, не перезаписывая более свежие"""
+        now = self._clock()
+        restored = 0
+        for message_hash, state in snapshot.get('states', {}).items():
+            shard = self._shard(message_hash)
+            if state['expires_at'] > now and message_hash not in shard.states \
+                    and self._load_message(shard, message_hash) is None:
+                shard.states[message_hash] = state
+                self._message_count += 1
+                self._schedule(shard, state['expires_at'].timestamp(), _MESSAGE, message_hash)
+                self._mark(self._dirty_messages, message_hash)
+                self._evict_messages(shard)
+                restored += 1
+        for user_id, (data, expires_at) in snapshot.get('user_data', {}).items():
+            if expires_at <= now:
+                continue
+            shard, record = self._writable_user(user_id)
+            restored_keys = [key for key in data if record.get(key) is None]
+            for key in restored_keys:
+                shard.user_keys += record.set(key, data[key])
+            record.expires_at = max(record.expires_at, expires_at.timestamp())
+            self._schedule(shard, record.expires_at, _USER, user_id)
+            self._mark_user(user_id, restored_keys)
+            restored += 1
+        return restored
+
+    async def get_stats(self) -> Dict[str, Any]:
+        """Получить статистику состояний (из поддерживаемых счетчиков)
+
+        Истекшие записи удаляет Sweeper, поэтому до его прохода они еще
+        учитываются в счетчиках. Счетчики описывают фронт в памяти.
+        """
+        stats = {
+            'total_message_states': self._message_count,
+            'total_users_with_data': self._user_count,
+            'total_user_data_keys': sum(shard.user_keys for shard in self._shards),
+            'ttl_minutes': self._ttl_minutes,
+            'shards': len(self._shards),
+            'backend': ('shared' if self._shared else 'sqlite') if self._store is not None else 'memory',
+            'max_users': self._max_users,
+            'evictions': self._evictions,
+            'spilled_users': self._spilled,
+            'max_messages': self._max_messages,
+            'message_evictions': self._message_evictions,
+            'spilled_messages': self._spilled_messages
         }
+        if self._store is not None:
+            stats['pending_writes'] = self._pending_writes()
+            stats['store_loads'] = self._store_loads
+            stats['store'] = self._store.get_stats()
+        return stats
 
 # Глобальный экземпляр для использования в боте
-state_manager = StateManager() 
\ No newline at end of file
+state_manager = StateManager()
@@ -0,0 +1,344 @@
+"""
+Персистентное хранилище StateManager на SQLite
+Режим WAL, запись пакетами через executemany
+"""
+
+import pickle
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from loguru import logger
+from .config import config as app_config, StateConfig
+from .error_handler import ConfigurationError
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    data BLOB NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    message_hash TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS users_expires_at ON users (expires_at);
+CREATE INDEX IF NOT EXISTS messages_expires_at ON messages (expires_at);
+"""
+
+_SHARED_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    data BLOB NOT NULL,
+    expires_at REAL NOT NULL,
+    version INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    message_hash TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    expires_at REAL NOT NULL,
+    version INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    origin TEXT NOT NULL,
+    changed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS users_expires_at ON users (expires_at);
+CREATE INDEX IF NOT EXISTS messages_expires_at ON messages (expires_at);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS changes_changed_at ON changes (changed_at);
+"""
+
+# Вид ключа в журнале изменений
+_CHANGE_USER = 0
+_CHANGE_MESSAGE = 1
+
+
+class SQLiteStateStore:
+    """Таблицы пользователей и состояний сообщений в одном файле SQLite
+
+    Значения сериализуются pickle, время истечения хранится как unix
+    timestamp. Чтение идет через отдельное соединение в потоке цикла
+    событий (в WAL читатели не блокируются писателем), запись - пакетом
+    в одной транзакции, ее вызывают через ``asyncio.to_thread``.
+    Истекшие строки удаляются не чаще раза в ``purge_interval`` секунд.
+    """
+
+    shared = False
+    schema = _SCHEMA
+
+    def __init__(self, path: str, purge_interval: float = 60.0):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.purge_interval = purge_interval
+        self._lock = threading.Lock()
+        self._writer = self._connect()
+        self._writer.executescript(self.schema)
+        self._reader = self._connect()
+        self._last_purge = time.time()
+        self._stats: Dict[str, int] = {
+            "reads": 0, "read_hits": 0, "batches": 0,
+            "rows_written": 0, "rows_deleted": 0, "rows_purged": 0
+        }
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _load(self, query: str, key: Any, now: float) -> Optional[Tuple[Any, float]]:
+        self._stats["reads"] += 1
+        row = self._reader.execute(query, (key, now)).fetchone()
+        if row is None:
+            return None
+        self._stats["read_hits"] += 1
+        return (pickle.loads(row[0]),) + tuple(row[1:])
+
+    def load_user(self, user_id: int, now: float) -> Optional[Tuple[Dict[str, Any], float]]:
+        """Данные пользователя и время истечения, если строка еще жива"""
+        return self._load("SELECT data, expires_at FROM users WHERE user_id = ? AND expires_at > ?",
+                          user_id, now)
+
+    def load_message(self, message_hash: str, now: float) -> Optional[Tuple[Dict[str, Any], float]]:
+        """Состояние сообщения и время истечения, если строка еще жива"""
+        return self._load("SELECT data, expires_at FROM messages WHERE message_hash = ? AND expires_at > ?",
+                          message_hash, now)
+
+    def write_batch(self,
+                    users: Iterable[Tuple[int, bytes, float]] = (),
+                    deleted_users: Iterable[Tuple[int]] = (),
+                    messages: Iterable[Tuple[str, bytes, float]] = (),
+                    deleted_messages: Iterable[Tuple[str]] = (),
+                    now: Optional[float] = None) -> None:
+        """Записать пакет изменений одной транзакцией (блокирующий вызов)
+
+        ``now`` - текущее время по часам владельца, по нему удаляются истекшие строки.
+        """
+        users, deleted_users = list(users), list(deleted_users)
+        messages, deleted_messages = list(messages), list(deleted_messages)
+        with self._lock:
+            conn = self._writer
+            conn.execute("BEGIN")
+            try:
+                conn.executemany("INSERT OR REPLACE INTO users VALUES (?, ?, ?)", users)
+                conn.executemany("DELETE FROM users WHERE user_id = ?", deleted_users)
+                conn.executemany("INSERT OR REPLACE INTO messages VALUES (?, ?, ?)", messages)
+                conn.executemany("DELETE FROM messages WHERE message_hash = ?", deleted_messages)
+                purged = self._purge_expired(conn, time.time() if now is None else now)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        self._stats["batches"] += 1
+        self._stats["rows_written"] += len(users) + len(messages)
+        self._stats["rows_deleted"] += len(deleted_users) + len(deleted_messages)
+        self._stats["rows_purged"] += purged
+
+    def _purge_expired(self, conn: sqlite3.Connection, now: float) -> int:
+        if time.time() - self._last_purge < self.purge_interval:
+            return 0
+        self._last_purge = time.time()
+        return self._purge_rows(conn, now)
+
+    def _purge_rows(self, conn: sqlite3.Connection, now: float) -> int:
+        purged = conn.execute("DELETE FROM users WHERE expires_at <= ?", (now,)).rowcount
+        purged += conn.execute("DELETE FROM messages WHERE expires_at <= ?", (now,)).rowcount
+        return purged
+
+    def close(self) -> None:
+        with self._lock:
+            self._writer.close()
+        self._reader.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"path": self.path, **self._stats}
+
+
+class SharedStateStore(SQLiteStateStore):
+    """Общее хранилище нескольких процессов бота на одной машине (SQLite WAL)
+
+    Строки версионированы: запись пользователя проходит, только если
+    версия в базе совпадает с прочитанной процессом (или строка истекла),
+    иначе ``write_batch`` возвращает конфликт с текущей строкой, и
+    StateManager сливает свои измененные ключи поверх нее. Состояния
+    сообщений пишутся без проверки: их создает один обработчик.
+
+    Каждая запись попадает в журнал ``changes`` с меткой процесса.
+    ``poll_changes`` по ``PRAGMA data_version`` дешево узнает о чужих
+    коммитах и возвращает ключи, которые нужно сбросить из памяти.
+    Журнал хранится ``change_retention`` секунд.
+
+    WAL опирается на общую память (файл ``-shm``) и блокировки ядра,
+    поэтому через сетевые ФС (NFS, SMB) не работает. Файл закрепляется
+    за ``host_id`` первого открывшего его процесса (по умолчанию имя
+    машины), открытие с другим ``host_id`` завершается ошибкой.
+    Контейнеры одной машины с общим томом задают одинаковый ``host_id``.
+    """
+
+    shared = True
+    schema = _SHARED_SCHEMA
+
+    def __init__(self, path: str, purge_interval: float = 60.0, change_retention: float = 600.0,
+                 busy_timeout: float = 5.0, host_id: Optional[str] = None):
+        self.change_retention = change_retention
+        self.busy_timeout = busy_timeout
+        self.origin = uuid.uuid4().hex
+        self.host_id = host_id or socket.gethostname()
+        super().__init__(path, purge_interval)
+        self._claim_host()
+        self._data_version = self._reader.execute("PRAGMA data_version").fetchone()[0]
+        self._last_seq = self._reader.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+        self._stats.update(conflicts=0, invalidations=0, resets=0)
+
+    def _claim_host(self) -> None:
+        """Закрепить файл за машиной или убедиться, что он принадлежит ей"""
+        with self._lock:
+            self._writer.execute("INSERT OR IGNORE INTO meta VALUES ('host', ?)", (self.host_id,))
+            owner = self._writer.execute("SELECT value FROM meta WHERE key = 'host'").fetchone()[0]
+        if owner != self.host_id:
+            self.close()
+            raise ConfigurationError(
+                f"Хранилище состояний {self.path} принадлежит машине {owner}: "
+                f"SQLite WAL нельзя делить между машинами",
+                config_key="STATE_HOST_ID", expected_value=owner
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False,
+                               timeout=self.busy_timeout)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def load_user(self, user_id: int, now: float) -> Optional[Tuple[Dict[str, Any], float, int]]:
+        """Данные пользователя, время истечения и версия, если строка еще жива"""
+        return self._load("SELECT data, expires_at, version FROM users WHERE user_id = ? AND expires_at > ?",
+                          user_id, now)
+
+    def load_message(self, message_hash: str, now: float) -> Optional[Tuple[Dict[str, Any], float, int]]:
+        """Состояние сообщения, время истечения и версия, если строка еще жива"""
+        return self._load("SELECT data, expires_at, version FROM messages WHERE message_hash = ? AND expires_at > ?",
+                          message_hash, now)
+
+    def write_batch(self,
+                    users: Iterable[Tuple[int, bytes, float, int]] = (),
+                    deleted_users: Iterable[Tuple[int]] = (),
+                    messages: Iterable[Tuple[str, bytes, float]] = (),
+                    deleted_messages: Iterable[Tuple[str]] = (),
+                    now: Optional[float] = None
+                    ) -> Tuple[Dict[int, int], Dict[int, Tuple[Dict[str, Any], float, int]]]:
+        """Записать пакет с проверкой версий (блокирующий вызов)
+
+        ``users`` - (user_id, данные, время истечения, прочитанная версия).
+        Возвращает новые версии записанных пользователей и конфликты
+        {user_id: (данные, время истечения, версия)} по текущим строкам.
+        """
+        now = time.time() if now is None else now
+        deleted_users, deleted_messages = list(deleted_users), list(deleted_messages)
+        versions: Dict[int, int] = {}
+        conflicts: Dict[int, Tuple[Dict[str, Any], float, int]] = {}
+        written = 0
+        with self._lock:
+            conn = self._writer
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                changes: List[Tuple[int, str, str, float]] = []
+                for user_id, data, expires_at, version in users:
+                    updated = conn.execute(
+                        "UPDATE users SET data = ?, expires_at = ?, version = version + 1 "
+                        "WHERE user_id = ? AND (version = ? OR expires_at <= ?)",
+                        (data, expires_at, user_id, version, now)
+                    ).rowcount or conn.execute(
+                        "INSERT OR IGNORE INTO users VALUES (?, ?, ?, 1)", (user_id, data, expires_at)
+                    ).rowcount
+                    row = conn.execute("SELECT data, expires_at, version FROM users WHERE user_id = ?",
+                                       (user_id,)).fetchone()
+                    if updated:
+                        versions[user_id] = row[2]
+                        changes.append((_CHANGE_USER, str(user_id), self.origin, now))
+                    else:
+                        conflicts[user_id] = (pickle.loads(row[0]), row[1], row[2])
+                conn.executemany("DELETE FROM users WHERE user_id = ?", deleted_users)
+                changes.extend((_CHANGE_USER, str(user_id), self.origin, now) for user_id, in deleted_users)
+                for message_hash, data, expires_at in messages:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO messages VALUES (?, ?, ?, "
+                        "COALESCE((SELECT version FROM messages WHERE message_hash = ?), 0) + 1)",
+                        (message_hash, data, expires_at, message_hash)
+                    )
+                    changes.append((_CHANGE_MESSAGE, message_hash, self.origin, now))
+                    written += 1
+                conn.executemany("DELETE FROM messages WHERE message_hash = ?", deleted_messages)
+                changes.extend((_CHANGE_MESSAGE, message_hash, self.origin, now)
+                               for message_hash, in deleted_messages)
+                conn.executemany("INSERT INTO changes (kind, key, origin, changed_at) VALUES (?, ?, ?, ?)",
+                                 changes)
+                purged = self._purge_expired(conn, now)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        self._stats["batches"] += 1
+        self._stats["rows_written"] += len(versions) + written
+        self._stats["rows_deleted"] += len(deleted_users) + len(deleted_messages)
+        self._stats["rows_purged"] += purged
+        self._stats["conflicts"] += len(conflicts)
+        return versions, conflicts
+
+    def _purge_rows(self, conn: sqlite3.Connection, now: float) -> int:
+        conn.execute("DELETE FROM changes WHERE changed_at <= ?", (now - self.change_retention,))
+        return super()._purge_rows(conn, now)
+
+    def poll_changes(self) -> Optional[Tuple[List[int], List[str]]]:
+        """Пользователи и сообщения, измененные другими процессами с прошлого опроса
+
+        None означает, что часть журнала уже удалена и сбросить нужно всё.
+        """
+        data_version = self._reader.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return [], []
+        self._data_version = data_version
+        first = self._reader.execute("SELECT MIN(seq) FROM changes").fetchone()[0]
+        rows = self._reader.execute("SELECT seq, kind, key, origin FROM changes WHERE seq > ? ORDER BY seq",
+                                    (self._last_seq,)).fetchall()
+        lost = first is not None and first > self._last_seq + 1
+        if rows:
+            self._last_seq = rows[-1][0]
+        if lost:
+            self._stats["resets"] += 1
+            return None
+        users: List[int] = []
+        messages: List[str] = []
+        for _, kind, key, origin in rows:
+            if origin == self.origin:
+                continue
+            if kind == _CHANGE_USER:
+                users.append(int(key))
+            else:
+                messages.append(key)
+        self._stats["invalidations"] += len(users) + len(messages)
+        return users, messages
+
+
+def create_state_store(state_config: Optional[StateConfig] = None) -> Optional[SQLiteStateStore]:
+    """Хранилище по конфигурации: None для backend=memory"""
+    state_config = state_config or app_config.state
+    if state_config.backend == "memory":
+        return None
+    if state_config.backend == "sqlite":
+        return SQLiteStateStore(state_config.sqlite_path)
+    if state_config.backend == "shared":
+        return SharedStateStore(state_config.sqlite_path, host_id=state_config.host_id or None)
+    logger.warning(f"Неизвестный STATE_BACKEND={state_config.backend}, состояния хранятся в памяти")
+    return None
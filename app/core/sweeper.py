@@ -0,0 +1,130 @@
+"""
+Фоновый инкрементальный sweeper для структур с TTL
+Истекшие записи удаляются небольшими порциями вне обработки запросов
+"""
+
+import asyncio
+import time
+import weakref
+from typing import Any, Dict, Optional
+from loguru import logger
+from .config import config as app_config, SweeperConfig
+
+# Размер порции, после которой проверяется бюджет времени тика
+_CHUNK = 128
+
+
+class Sweeper:
+    """Один фоновый обходчик всех зарегистрированных структур с TTL
+
+    Структура регистрируется под именем и должна реализовать
+    ``sweep(limit) -> int`` (удалить не больше ``limit`` истекших записей и
+    вернуть количество) и ``sweep_lag() -> float`` (на сколько секунд
+    просрочена самая старая неудаленная запись). За тик обрабатывается не
+    больше ``max_items`` записей и не дольше ``time_slice`` секунд;
+    недоделанная работа переходит на следующий тик. Структуры хранятся по
+    слабым ссылкам и не продлевают себе жизнь регистрацией.
+    """
+
+    def __init__(self, sweeper_config: Optional[SweeperConfig] = None):
+        sweeper_config = sweeper_config or app_config.sweeper
+        self.interval = sweeper_config.interval
+        self.max_items = sweeper_config.max_items
+        self.time_slice = sweeper_config.time_slice
+        self._targets: Dict[str, "weakref.ref"] = {}
+        self._swept: Dict[str, int] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._counters: Dict[str, Any] = {
+            "ticks": 0, "swept": 0, "budget_exhausted": 0,
+            "last_tick_ms": 0.0, "max_tick_ms": 0.0,
+            "loop_lag_ms": 0.0, "max_loop_lag_ms": 0.0
+        }
+
+    def register(self, name: str, target: Any) -> None:
+        """Подключить структуру к обходу"""
+        self._targets[name] = weakref.ref(target)
+        self._swept.setdefault(name, 0)
+
+    def unregister(self, name: str) -> None:
+        self._targets.pop(name, None)
+        self._swept.pop(name, None)
+
+    def _live_targets(self):
+        for name, ref in list(self._targets.items()):
+            target = ref()
+            if target is None:
+                self.unregister(name)
+            else:
+                yield name, target
+
+    def tick(self) -> int:
+        """Один проход с ограничением по количеству записей и времени"""
+        start = time.perf_counter()
+        deadline = start + self.time_slice
+        remaining = self.max_items
+        pending = list(self._live_targets())
+        while pending and remaining > 0:
+            still_pending = []
+            for name, target in pending:
+                removed = target.sweep(min(_CHUNK, remaining))
+                self._swept[name] += removed
+                remaining -= removed
+                if removed:
+                    still_pending.append((name, target))
+                if remaining <= 0 or time.perf_counter() >= deadline:
+                    break
+            else:
+                pending = still_pending
+                continue
+            self._counters["budget_exhausted"] += 1
+            break
+
+        swept = self.max_items - remaining
+        elapsed_ms = (time.perf_counter() - start) * 1e3
+        self._counters["ticks"] += 1
+        self._counters["swept"] += swept
+        self._counters["last_tick_ms"] = round(elapsed_ms, 3)
+        self._counters["max_tick_ms"] = round(max(self._counters["max_tick_ms"], elapsed_ms), 3)
+        return swept
+
+    def start(self) -> None:
+        """Запустить фоновый обход (идемпотентно, нужен работающий цикл событий)"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            planned = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            # Насколько цикл событий опоздал разбудить sweeper
+            lag_ms = max(loop.time() - planned, 0.0) * 1e3
+            self._counters["loop_lag_ms"] = round(lag_ms, 3)
+            self._counters["max_loop_lag_ms"] = round(max(self._counters["max_loop_lag_ms"], lag_ms), 3)
+            try:
+                self.tick()
+            except Exception as e:
+                logger.warning(f"Sweeper: ошибка прохода: {e}")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Метрики sweeper: объем работы, длительность тиков и отставание истечения"""
+        targets = {
+            name: {"swept": self._swept[name], "lag_seconds": round(target.sweep_lag(), 3)}
+            for name, target in self._live_targets()
+        }
+        return {
+            **self._counters,
+            "running": self._task is not None and not self._task.done(),
+            "max_lag_seconds": max((t["lag_seconds"] for t in targets.values()), default=0.0),
+            "targets": targets
+        }
+
+
+# Глобальный экземпляр для использования в боте
+sweeper = Sweeper()
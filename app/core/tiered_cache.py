@@ -0,0 +1,552 @@
+"""
+Многоуровневый кэш: L1 память -> L2 файл -> L3 Redis (опционально)
+Единая точка кэширования для всех модулей бота
+"""
+
+import asyncio
+import hashlib
+import math
+import time
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from loguru import logger
+from .cache import MemoryCache, MemoryBudget, FileCache, RedisCache, REDIS_AVAILABLE
+from .config import config as app_config, CacheConfig
+from .key_normalizer import normalize_text
+from .single_flight import SingleFlight
+from .tinylfu import TinyLFU
+
+_COUNTERS = ("l1_hits", "l2_hits", "l3_hits", "misses", "sets", "loads", "coalesced",
+             "stale_hits", "refreshes")
+
+
+def make_cache_key(*parts: Any) -> str:
+    """Единая схема ключей: md5 от частей, соединенных через ':'"""
+    content = ":".join("" if part is None else str(part) for part in parts)
+    return hashlib.md5(content.encode("utf-8")).hexdigest()
+
+
+def make_text_key(text: str, *parts: Any) -> str:
+    """Ключ для пользовательского текста: текст проходит нормализацию"""
+    return make_cache_key(normalize_text(text), *parts)
+
+
+class _SoftEntry:
+    """Значение с мягким сроком свежести (stale-while-revalidate)"""
+
+    __slots__ = ("value", "fresh_until")
+
+    def __init__(self, value: Any, fresh_until: float):
+        self.value = value
+        self.fresh_until = fresh_until
+
+
+class CacheNamespace:
+    """Представление одного пространства имен общего кэша"""
+
+    def __init__(self, service: "TieredCache", name: str):
+        self._service = service
+        self.name = name
+
+    @property
+    def ttl(self) -> int:
+        return self._service.get_ttl(self.name)
+
+    @ttl.setter
+    def ttl(self, value: int) -> None:
+        self._service.set_ttl(self.name, value)
+
+    @property
+    def soft_ttl(self) -> Optional[int]:
+        return self._service.get_soft_ttl(self.name)
+
+    @soft_ttl.setter
+    def soft_ttl(self, value: Optional[int]) -> None:
+        self._service.set_soft_ttl(self.name, value)
+
+    @property
+    def weight(self) -> float:
+        return self._service.get_weight(self.name)
+
+    @weight.setter
+    def weight(self, value: float) -> None:
+        self._service.set_weight(self.name, value)
+
+    @property
+    def bytes_used(self) -> int:
+        return self._service._l1(self.name).bytes_used
+
+    async def get(self, key: str,
+                  refresh: Optional[Callable[[], Awaitable[Any]]] = None) -> Optional[Any]:
+        return await self._service.get(self.name, key, refresh)
+
+    async def set(self, key: str, value: Any, ttl_seconds: Optional[int] = None) -> None:
+        await self._service.set(self.name, key, value, ttl_seconds)
+
+    async def delete(self, key: str) -> None:
+        await self._service.delete(self.name, key)
+
+    async def get_or_set(self, key: str, loader: Callable[[], Awaitable[Any]],
+                         ttl_seconds: Optional[int] = None) -> Any:
+        return await self._service.get_or_set(self.name, key, loader, ttl_seconds)
+
+    async def coalesce(self, key: str, loader: Callable[[], Awaitable[Any]]) -> Any:
+        return await self._service.coalesce(self.name, key, loader)
+
+    async def clear(self) -> None:
+        await self._service.clear(self.name)
+
+    def get_nowait(self, key: str) -> Optional[Any]:
+        return self._service.get_nowait(self.name, key)
+
+    def set_nowait(self, key: str, value: Any, ttl_seconds: Optional[int] = None) -> None:
+        self._service.set_nowait(self.name, key, value, ttl_seconds)
+
+    def __len__(self) -> int:
+        return len(self._service._l1(self.name))
+
+
+class TieredCache:
+    """Многоуровневый кэш с read-through и write-back
+
+    Чтение идет по уровням L1 -> L2 -> L3, найденное значение поднимается
+    в L1. Запись сразу попадает в L1, а в L2/L3 выгружается пачкой раз в
+    ``write_back_interval`` секунд (при 0 - сразу, write-through).
+    TTL задаются для каждого пространства имен, счетчики попаданий общие.
+    Если для пространства имен задан мягкий TTL, устаревшее значение
+    отдается сразу, а обновление запускается в фоне (stale-while-revalidate);
+    жесткий TTL по-прежнему удаляет значение со всех уровней.
+    L1 всех пространств имен делит один бюджет памяти в байтах, доли
+    определяются весами из ``namespace_weights``.
+    """
+
+    def __init__(self, cache_config: Optional[CacheConfig] = None,
+                 file_cache: Optional[FileCache] = None,
+                 redis_cache: Optional[RedisCache] = None,
+                 clock: Callable[[], float] = time.time):
+        self._config = cache_config or app_config.cache
+        self._clock = clock
+        self._memory: Dict[str, MemoryCache] = {}
+        self._ttls: Dict[str, int] = dict(self._config.namespace_ttls)
+        self._soft_ttls: Dict[str, int] = dict(self._config.namespace_soft_ttls)
+        self._budget = MemoryBudget(self._config.memory_budget_bytes)
+        self._file_cache = file_cache
+        self._redis_cache = redis_cache
+        # Уровни, созданные по конфигурации, поднимаются лениво при первом обращении
+        self._file_checked = file_cache is not None
+        self._redis_checked = redis_cache is not None
+        # composite_key -> (value, expires_at по часам self._clock)
+        self._dirty: Dict[str, Tuple[Any, Optional[float]]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._counters: Dict[str, Dict[str, int]] = defaultdict(lambda: dict.fromkeys(_COUNTERS, 0))
+        self._flights = SingleFlight()
+        # composite_key -> задача фонового обновления
+        self._refresh_tasks: Dict[str, asyncio.Task] = {}
+
+    def namespace(self, name: str) -> CacheNamespace:
+        """Получить представление пространства имен"""
+        return CacheNamespace(self, name)
+
+    def get_ttl(self, namespace: str) -> int:
+        return self._ttls.get(namespace, self._config.default_ttl)
+
+    def set_ttl(self, namespace: str, ttl_seconds: int) -> None:
+        self._ttls[namespace] = ttl_seconds
+
+    def get_soft_ttl(self, namespace: str) -> Optional[int]:
+        return self._soft_ttls.get(namespace)
+
+    def set_soft_ttl(self, namespace: str, ttl_seconds: Optional[int]) -> None:
+        if ttl_seconds is None:
+            self._soft_ttls.pop(namespace, None)
+        else:
+            self._soft_ttls[namespace] = ttl_seconds
+
+    def get_weight(self, namespace: str) -> float:
+        self._l1(namespace)
+        return self._budget.get_weight(namespace)
+
+    def set_weight(self, namespace: str, weight: float) -> None:
+        self._l1(namespace)
+        self._budget.set_weight(namespace, weight)
+
+    # === Уровни ===
+
+    def _l1(self, namespace: str) -> MemoryCache:
+        cache = self._memory.get(namespace)
+        if cache is None:
+            cache = MemoryCache(max_size=None, default_ttl=self.get_ttl(namespace),
+                                clock=self._clock, budget=self._budget, name=namespace,
+                                weight=self._config.namespace_weights.get(namespace, 1.0),
+                                admission=self._admission_policy(namespace))
+            self._memory[namespace] = cache
+        return cache
+
+    def _admission_policy(self, namespace: str) -> Optional[TinyLFU]:
+        """W-TinyLFU для пространств имен с большим потоком разовых ключей"""
+        if not self._config.admission_enabled or namespace not in self._config.admission_namespaces:
+            return None
+        return TinyLFU(sketch_width=self._config.admission_sketch_width,
+                       window_ratio=self._config.admission_window_ratio)
+
+    def _l2(self) -> Optional[FileCache]:
+        if not self._file_checked:
+            self._file_checked = True
+            if self._config.file_enabled:
+                try:
+                    self._file_cache = FileCache(
+                        path=self._config.file_cache_path,
+                        default_ttl=self._config.default_ttl
+                    )
+                except Exception as e:
+                    logger.warning(f"TieredCache: файловый кэш недоступен: {e}")
+        return self._file_cache
+
+    def _l3(self) -> Optional[RedisCache]:
+        if not self._redis_checked:
+            self._redis_checked = True
+            if self._config.redis_enabled and REDIS_AVAILABLE and app_config.redis:
+                try:
+                    self._redis_cache = RedisCache(app_config.redis,
+                                                   default_ttl=self._config.default_ttl)
+                except Exception as e:
+                    logger.warning(f"TieredCache: Redis кэш недоступен: {e}")
+        return self._redis_cache
+
+    @staticmethod
+    def _composite(namespace: str, key: str) -> str:
+        return f"{namespace}:{key}"
+
+    # === Чтение ===
+
+    def _wrap(self, namespace: str, value: Any, ttl_seconds: int) -> Any:
+        soft_ttl = self.get_soft_ttl(namespace)
+        if not soft_ttl or (ttl_seconds and 0 < ttl_seconds <= soft_ttl):
+            return value
+        return _SoftEntry(value, self._clock() + soft_ttl)
+
+    def _unwrap(self, namespace: str, key: str, raw: Any,
+                refresh: Optional[Callable[[], Awaitable[Any]]]) -> Any:
+        if not isinstance(raw, _SoftEntry):
+            return raw
+        if self._clock() >= raw.fresh_until:
+            self._counters[namespace]["stale_hits"] += 1
+            if refresh is not None:
+                self._schedule_refresh(namespace, key, refresh)
+        return raw.value
+
+    def get_nowait(self, namespace: str, key: str) -> Optional[Any]:
+        """Чтение только из L1 (без ожидания)"""
+        raw = self._l1(namespace).get_nowait(key)
+        self._counters[namespace]["l1_hits" if raw is not None else "misses"] += 1
+        return self._unwrap(namespace, key, raw, None)
+
+    async def get(self, namespace: str, key: str,
+                  refresh: Optional[Callable[[], Awaitable[Any]]] = None) -> Optional[Any]:
+        """Чтение с проходом по уровням и подъемом значения в L1
+
+        ``refresh`` - загрузчик, который в фоне обновит устаревшее значение
+        (он сам должен записать результат в кэш). Поднятое значение живет
+        в L1 столько, сколько ему осталось на нижнем уровне.
+        """
+        counters = self._counters[namespace]
+        raw = self._l1(namespace).get_nowait(key)
+        if raw is not None:
+            counters["l1_hits"] += 1
+            return self._unwrap(namespace, key, raw, refresh)
+
+        composite = self._composite(namespace, key)
+        file_cache = self._l2()
+        if file_cache is not None:
+            found = await file_cache.get_with_ttl(composite)
+            if found is not None:
+                counters["l2_hits"] += 1
+                raw, remaining = found
+                self._l1(namespace).set_nowait(key, raw, remaining or 0)
+                return self._unwrap(namespace, key, raw, refresh)
+
+        redis_cache = self._l3()
+        if redis_cache is not None:
+            found = await redis_cache.get_with_ttl(composite)
+            if found is not None:
+                counters["l3_hits"] += 1
+                raw, remaining = found
+                self._l1(namespace).set_nowait(key, raw, remaining or 0)
+                return self._unwrap(namespace, key, raw, refresh)
+
+        counters["misses"] += 1
+        return None
+
+    async def get_or_set(self, namespace: str, key: str,
+                         loader: Callable[[], Awaitable[Any]],
+                         ttl_seconds: Optional[int] = None) -> Any:
+        """Read-through: при промахе значение вычисляется loader и кэшируется
+
+        Одновременные промахи по одному ключу вызывают loader один раз.
+        """
+        async def load() -> Any:
+            self._counters[namespace]["loads"] += 1
+            loaded = await loader()
+            if loaded is not None:
+                await self.set(namespace, key, loaded, ttl_seconds)
+            return loaded
+
+        value = await self.get(namespace, key, refresh=load)
+        if value is not None:
+            return value
+        return await self.coalesce(namespace, key, load)
+
+    async def coalesce(self, namespace: str, key: str,
+                       loader: Callable[[], Awaitable[Any]]) -> Any:
+        """Объединить одинаковые одновременные вызовы loader по ключу кэша"""
+        composite = self._composite(namespace, key)
+        if composite in self._flights:
+            self._counters[namespace]["coalesced"] += 1
+        return await self._flights.do(composite, loader)
+
+    def _schedule_refresh(self, namespace: str, key: str,
+                          refresh: Callable[[], Awaitable[Any]]) -> None:
+        composite = self._composite(namespace, key)
+        if composite in self._refresh_tasks or composite in self._flights:
+            # Значение уже обновляется или генерируется
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        task = loop.create_task(self._refresh(namespace, key, refresh))
+        self._refresh_tasks[composite] = task
+        task.add_done_callback(lambda _: self._refresh_tasks.pop(composite, None))
+
+    async def _refresh(self, namespace: str, key: str,
+                       refresh: Callable[[], Awaitable[Any]]) -> None:
+        self._counters[namespace]["refreshes"] += 1
+        try:
+            await self.coalesce(namespace, key, refresh)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Устаревшее значение остается до жесткого TTL
+            logger.warning(f"TieredCache: фоновое обновление {namespace}:{key} не удалось: {e}")
+
+    # === Запись ===
+
+    def set_nowait(self, namespace: str, key: str, value: Any,
+                   ttl_seconds: Optional[int] = None) -> None:
+        """Запись в L1 с отложенной выгрузкой в нижние уровни"""
+        if ttl_seconds is None:
+            ttl_seconds = self.get_ttl(namespace)
+        value = self._wrap(namespace, value, ttl_seconds)
+        self._l1(namespace).set_nowait(key, value, ttl_seconds)
+        self._counters[namespace]["sets"] += 1
+
+        expires_at = self._clock() + ttl_seconds if ttl_seconds and ttl_seconds > 0 else None
+        self._dirty[self._composite(namespace, key)] = (value, expires_at)
+        self._schedule_flush()
+
+    async def set(self, namespace: str, key: str, value: Any,
+                  ttl_seconds: Optional[int] = None) -> None:
+        """Запись значения (write-back или write-through по конфигурации)"""
+        self.set_nowait(namespace, key, value, ttl_seconds)
+        if self._config.write_back_interval <= 0:
+            await self.flush()
+
+    async def delete(self, namespace: str, key: str) -> None:
+        """Удаление значения со всех уровней"""
+        composite = self._composite(namespace, key)
+        self._l1(namespace).delete_nowait(key)
+        self._dirty.pop(composite, None)
+        if self._l2() is not None:
+            await self._file_cache.delete(composite)
+        if self._l3() is not None:
+            await self._redis_cache.delete(composite)
+
+    async def clear(self, namespace: Optional[str] = None) -> None:
+        """Очистка одного пространства имен или всего кэша на всех уровнях
+
+        Иначе значения снова поднялись бы в L1 из L2/L3 при следующем чтении.
+        """
+        if namespace is None:
+            for cache in self._memory.values():
+                await cache.clear()
+            self._dirty.clear()
+            if self._l2() is not None:
+                await self._file_cache.clear()
+            if self._l3() is not None:
+                await self._redis_cache.clear()
+            return
+
+        if namespace in self._memory:
+            await self._memory[namespace].clear()
+        prefix = self._composite(namespace, "")
+        for composite in [k for k in self._dirty if k.startswith(prefix)]:
+            del self._dirty[composite]
+        if self._l2() is not None:
+            await self._file_cache.delete_prefix(prefix)
+        if self._l3() is not None:
+            await self._redis_cache.delete_prefix(prefix)
+
+    # === Write-back ===
+
+    def _schedule_flush(self) -> None:
+        if self._flush_task is not None and not self._flush_task.done():
+            return
+        if self._config.write_back_interval <= 0:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Нет цикла событий: данные выгрузятся при следующем flush()
+            return
+        self._flush_task = loop.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self) -> None:
+        await asyncio.sleep(self._config.write_back_interval)
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"TieredCache: ошибка выгрузки кэша: {e}")
+
+    async def flush(self) -> None:
+        """Выгрузить накопленные записи в L2/L3
+
+        Если выгрузку прервали (отмена при ``close``), недописанные записи
+        возвращаются в буфер, не перетирая более свежие.
+        """
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        pending = dict(dirty)
+        try:
+            await self._write_lower_tiers(dirty, pending)
+        except BaseException:
+            for composite, entry in pending.items():
+                self._dirty.setdefault(composite, entry)
+            raise
+
+    async def _write_lower_tiers(self, dirty: Dict[str, Tuple[Any, Optional[float]]],
+                                 pending: Dict[str, Tuple[Any, Optional[float]]]) -> None:
+        """Записать пакет в L2/L3, убирая из ``pending`` записанное полностью"""
+        now = self._clock()
+        file_cache = self._l2()
+        redis_cache = self._l3()
+
+        # Redis принимает один TTL на конвейер - группируем по оставшемуся TTL
+        redis_batches: Dict[int, Dict[str, Any]] = defaultdict(dict)
+        for composite, (value, expires_at) in dirty.items():
+            if expires_at is None:
+                ttl = 0
+            else:
+                remaining = expires_at - now
+                if remaining <= 0:
+                    del pending[composite]
+                    continue
+                ttl = math.ceil(remaining)
+
+            if file_cache is not None:
+                try:
+                    await file_cache.set(composite, value, ttl)
+                except Exception as e:
+                    logger.warning(f"TieredCache: не удалось записать {composite} в L2: {e}")
+            if redis_cache is not None:
+                redis_batches[ttl][composite] = value
+            else:
+                del pending[composite]
+
+        for ttl, items in redis_batches.items():
+            try:
+                await redis_cache.set_many(items, ttl)
+            except Exception as e:
+                logger.warning(f"TieredCache: не удалось записать {len(items)} значений в L3: {e}")
+            for composite in items:
+                del pending[composite]
+
+    async def close(self) -> None:
+        """Выгрузить данные и закрыть нижние уровни"""
+        for task in list(self._refresh_tasks.values()):
+            task.cancel()
+        if self._flush_task is not None and not self._flush_task.done():
+            # Прерванная выгрузка вернет недописанное в буфер
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        await self.flush()
+        if self._file_cache is not None:
+            self._file_cache.close()
+        if self._redis_cache is not None:
+            await self._redis_cache.close()
+
+    # === Фоновое удаление истекших записей ===
+
+    def sweep(self, limit: int) -> int:
+        """Порция удаления истекших записей L1 всех пространств имен (для Sweeper)"""
+        done = 0
+        for cache in list(self._memory.values()):
+            done += cache.sweep(limit - done)
+            if done >= limit:
+                break
+        return done
+
+    def sweep_lag(self) -> float:
+        return max((cache.sweep_lag() for cache in self._memory.values()), default=0.0)
+
+    # === Снимок ===
+
+    def export_hot(self, limit: Optional[int] = None) -> Dict[str, List[Tuple[str, Any, Optional[float]]]]:
+        """Самые свежие записи L1 по пространствам имен для снимка"""
+        return {name: cache.export_entries(limit) for name, cache in self._memory.items() if len(cache)}
+
+    def import_hot(self, namespace: str, entries: List[Tuple[str, Any, Optional[float]]],
+                   elapsed: float = 0.0) -> int:
+        """Загрузить записи снимка в L1, не перезаписывая более свежие"""
+        cache = self._l1(namespace)
+        restored = 0
+        for key, value, remaining in entries:
+            if remaining is not None:
+                remaining -= elapsed
+                if remaining <= 0:
+                    continue
+            if key in cache:
+                continue
+            cache.set_nowait(key, value, remaining or 0)
+            restored += 1
+        return restored
+
+    # === Статистика ===
+
+    async def get_stats(self) -> Dict[str, Any]:
+        """Единая статистика попаданий, промахов и занятой памяти"""
+        totals = dict.fromkeys(_COUNTERS, 0)
+        namespaces = {}
+        for name in set(self._counters) | set(self._memory):
+            counters = self._counters[name]
+            for counter, value in counters.items():
+                totals[counter] += value
+            memory = self._memory.get(name)
+            namespaces[name] = {
+                **counters,
+                "items": len(memory) if memory is not None else 0,
+                "bytes": memory.bytes_used if memory is not None else 0,
+                "weight": self._budget.get_weight(name),
+                "evictions": memory.evictions if memory is not None else 0,
+                "ttl": self.get_ttl(name),
+                "soft_ttl": self.get_soft_ttl(name)
+            }
+
+        hits = totals["l1_hits"] + totals["l2_hits"] + totals["l3_hits"]
+        lookups = hits + totals["misses"]
+        return {
+            "totals": totals,
+            "hit_rate": round(hits / lookups * 100, 2) if lookups else 0.0,
+            "pending_write_back": len(self._dirty),
+            "single_flight": self._flights.get_stats(),
+            "memory": {
+                "used_bytes": self._budget.used_bytes,
+                "budget_bytes": self._budget.max_bytes,
+                "evictions": self._budget.evictions
+            },
+            "namespaces": namespaces
+        }
+
+
+# Глобальный экземпляр для использования в боте
+cache_service = TieredCache()
@@ -0,0 +1,144 @@
+"""
+Иерархическое колесо таймеров для истечения TTL
+Планирование и отмена за O(1), истечение - амортизированно
+"""
+
+import time
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+
+class TimingWheel:
+    """Иерархическое колесо таймеров (Varghese & Lauck)
+
+    Уровень 0 хранит ключи с точностью до одного тика, каждый следующий
+    уровень покрывает в ``slots`` раз больший интервал. При обороте младшего
+    уровня слот старшего уровня "каскадируется" вниз, поэтому каждый ключ
+    перекладывается не более ``levels`` раз за всё время жизни.
+    """
+
+    def __init__(self, tick: float = 1.0, slots: int = 64, levels: int = 4,
+                 clock: Callable[[], float] = time.monotonic):
+        if slots & (slots - 1):
+            raise ValueError("Количество слотов должно быть степенью двойки")
+        self._tick = tick
+        self._slots = slots
+        self._bits = slots.bit_length() - 1
+        self._mask = slots - 1
+        self._levels = levels
+        self._clock = clock
+        self._wheel: List[List[Dict[Hashable, float]]] = [
+            [{} for _ in range(slots)] for _ in range(levels)
+        ]
+        # key -> (level, slot) для отмены за O(1)
+        self._positions: Dict[Hashable, Tuple[int, int]] = {}
+        self._current_tick = self._to_tick(clock())
+        # Слот текущего тика обработан не целиком (advance уперся в limit)
+        self._draining = False
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._positions
+
+    def lag(self, now: Optional[float] = None) -> float:
+        """На сколько секунд колесо отстает от ``now`` (0, если таймеров нет)"""
+        if not self._positions:
+            return 0.0
+        if now is None:
+            now = self._clock()
+        done_tick = self._current_tick if self._draining else self._current_tick + 1
+        return max(now - done_tick * self._tick, 0.0)
+
+    def _to_tick(self, timestamp: float) -> int:
+        return int(timestamp / self._tick)
+
+    def schedule(self, key: Hashable, expires_at: float) -> None:
+        """Запланировать истечение ключа (перепланирует, если ключ уже есть)"""
+        if key in self._positions:
+            self.cancel(key)
+        self._place(key, expires_at, self._current_tick + 1)
+
+    def _place(self, key: Hashable, expires_at: float, min_tick: int) -> None:
+        # Округляем вверх: ключ из слота тика T гарантированно истек к T * tick
+        expire_tick = max(-int(-expires_at // self._tick), min_tick)
+        delta = expire_tick - self._current_tick
+        level = 0
+        while level < self._levels - 1 and delta >= (1 << (self._bits * (level + 1))):
+            level += 1
+        horizon = 1 << (self._bits * (level + 1))
+        if delta >= horizon:
+            # За пределами горизонта: паркуемся в самом дальнем слоте,
+            # при каскадировании ключ будет переложен по реальному сроку
+            expire_tick = self._current_tick + horizon - 1
+        slot = (expire_tick >> (self._bits * level)) & self._mask
+        self._wheel[level][slot][key] = expires_at
+        self._positions[key] = (level, slot)
+
+    def cancel(self, key: Hashable) -> None:
+        """Отменить истечение ключа"""
+        position = self._positions.pop(key, None)
+        if position is not None:
+            level, slot = position
+            self._wheel[level][slot].pop(key, None)
+
+    def clear(self) -> None:
+        """Удалить все таймеры"""
+        for level in self._wheel:
+            for bucket in level:
+                bucket.clear()
+        self._positions.clear()
+        self._draining = False
+
+    def advance(self, now: Optional[float] = None, limit: Optional[int] = None) -> List[Hashable]:
+        """Продвинуть колесо до ``now`` и вернуть истекшие ключи
+
+        ``limit`` - жесткое ограничение количества возвращаемых ключей:
+        если слот не уместился целиком, следующий вызов продолжит с его
+        середины, оставшиеся истекшие ключи вернутся следующими вызовами.
+        """
+        if now is None:
+            now = self._clock()
+        target_tick = self._to_tick(now)
+        expired: List[Hashable] = []
+
+        if not self._positions:
+            self._current_tick = max(self._current_tick, target_tick)
+            self._draining = False
+            return expired
+
+        while True:
+            if self._draining:
+                bucket = self._wheel[0][self._current_tick & self._mask]
+                while bucket:
+                    if limit is not None and len(expired) >= limit:
+                        return expired
+                    key, expires_at = bucket.popitem()
+                    del self._positions[key]
+                    if expires_at <= now:
+                        expired.append(key)
+                    else:
+                        self._place(key, expires_at, self._current_tick + 1)
+                self._draining = False
+            if not self._positions:
+                self._current_tick = max(self._current_tick, target_tick)
+                return expired
+            if self._current_tick >= target_tick or (limit is not None and len(expired) >= limit):
+                return expired
+            self._current_tick += 1
+            self._cascade()
+            self._draining = True
+
+    def _cascade(self) -> None:
+        """Переложить ключи старших уровней, чей интервал наступил"""
+        for level in range(1, self._levels):
+            if (self._current_tick >> (self._bits * (level - 1))) & self._mask:
+                break
+            slot = (self._current_tick >> (self._bits * level)) & self._mask
+            bucket = self._wheel[level][slot]
+            if not bucket:
+                continue
+            self._wheel[level][slot] = {}
+            for key, expires_at in bucket.items():
+                del self._positions[key]
+                self._place(key, expires_at, self._current_tick)
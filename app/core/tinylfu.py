@@ -0,0 +1,113 @@
+"""
+W-TinyLFU: фильтр допуска в кэш по оценке частоты обращений
+Разовые ключи не вытесняют часто запрашиваемые
+"""
+
+from typing import Dict, Hashable, Tuple
+
+_MASK64 = (1 << 64) - 1
+# Нечетный множитель (золотое сечение) для перемешивания хеша ключа
+_MIX = 0x9E3779B97F4A7C15
+_MAX_WIDTH = 1 << 16
+_MAX_COUNT = 15
+
+
+class CountMinSketch:
+    """Count-min скетч глубины 4 с насыщающимися счетчиками и старением
+
+    Четыре строки по ``width`` однобайтовых счетчиков лежат в одном
+    ``bytearray``; индексы строк - разные 16-битные срезы одного
+    перемешанного 64-битного хеша (поэтому ``width`` не больше 2**16).
+    Счетчики ограничены 15 (как 4-битные в TinyLFU). После
+    ``sample_size`` увеличений все счетчики делятся пополам, поэтому давняя
+    популярность со временем забывается.
+    """
+
+    def __init__(self, width: int, sample_size: int = None):
+        self.width = min(1 << max(width - 1, 1).bit_length(), _MAX_WIDTH)
+        self._mask = self.width - 1
+        self._table = bytearray(4 * self.width)
+        self.sample_size = sample_size or 10 * self.width
+        self.additions = 0
+        self.resets = 0
+
+    def _indexes(self, key: Hashable) -> Tuple[int, int, int, int]:
+        h = (hash(key) * _MIX) & _MASK64
+        h ^= h >> 32
+        mask, width = self._mask, self.width
+        return (h & mask,
+                width + ((h >> 16) & mask),
+                2 * width + ((h >> 32) & mask),
+                3 * width + ((h >> 48) & mask))
+
+    def estimate(self, key: Hashable) -> int:
+        """Оценка частоты ключа (сверху)"""
+        a, b, c, d = self._indexes(key)
+        table = self._table
+        return min(table[a], table[b], table[c], table[d])
+
+    def add(self, key: Hashable) -> None:
+        """Учесть обращение (консервативное увеличение)"""
+        table = self._table
+        indexes = self._indexes(key)
+        a, b, c, d = indexes
+        current = min(table[a], table[b], table[c], table[d])
+        if current >= _MAX_COUNT:
+            return
+        for i in indexes:
+            if table[i] == current:
+                table[i] = current + 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self._reset()
+
+    def _reset(self) -> None:
+        self._table = bytearray(self._table.translate(_HALVE))
+        self.additions //= 2
+        self.resets += 1
+
+
+# Таблица перекодировки байта в половину его значения для старения
+_HALVE = bytes(value >> 1 for value in range(256))
+
+
+class TinyLFU:
+    """Политика допуска W-TinyLFU для MemoryCache
+
+    Новые записи попадают в небольшое окно LRU (``window_ratio`` от
+    емкости), вытесненный из окна кандидат сравнивается с LRU-жертвой
+    основной области: кандидат остается, только если встречался чаще.
+    Окно позволяет всплескам новых ключей закрепиться, а скетч не дает
+    разовым запросам вымыть популярные ключи.
+    """
+
+    def __init__(self, sketch_width: int = 1 << 15, window_ratio: float = 0.01):
+        if not 0 < window_ratio < 1:
+            raise ValueError("Доля окна должна быть в интервале (0, 1)")
+        self.sketch = CountMinSketch(sketch_width)
+        self.window_ratio = window_ratio
+        self.admitted = 0
+        self.rejected = 0
+
+    def record(self, key: Hashable) -> None:
+        """Учесть обращение к ключу (попадание или промах)"""
+        self.sketch.add(key)
+
+    def admit(self, candidate: Hashable, victim: Hashable) -> bool:
+        """Допустить кандидата ценой вытеснения жертвы?"""
+        if self.sketch.estimate(candidate) > self.sketch.estimate(victim):
+            self.admitted += 1
+            return True
+        self.rejected += 1
+        return False
+
+    def window_size(self, capacity: int) -> int:
+        return max(1, int(capacity * self.window_ratio))
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "sketch_width": self.sketch.width,
+            "sketch_resets": self.sketch.resets
+        }
@@ -0,0 +1,82 @@
+"""
+Симуляция справедливой очереди TaskQueue: один тяжелый и 1000 легких пользователей.
+
+Тяжелый пользователь (агентство) сразу ставит HEAVY_TASKS запросов /reply,
+легкие пользователи присылают по одному запросу равномерно за
+ARRIVAL_SECONDS. Каждая задача имитирует вызов AI за SERVICE_SECONDS.
+Сравнивается задержка легких пользователей от add_task до завершения
+при общей FIFO-очереди (без fair_key) и при deficit round-robin по
+пользователям.
+
+Запуск: python benchmarks/bench_fair_queue.py [задач тяжелого пользователя]
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+# Добавляем корневую директорию проекта в PYTHONPATH
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.queue import TaskQueue
+
+WORKERS = 10
+HEAVY_TASKS = 5_000
+LIGHT_USERS = 1_000
+ARRIVAL_SECONDS = 0.5
+SERVICE_SECONDS = 0.002
+
+
+def percentile(values: list, share: float) -> float:
+    return values[min(int(len(values) * share), len(values) - 1)]
+
+
+async def simulate(fair: bool, heavy_tasks: int) -> dict:
+    queue = TaskQueue(max_workers=WORKERS, max_queue_size=heavy_tasks + LIGHT_USERS + 10)
+    await queue.start()
+    light, heavy = [], []
+    done = asyncio.Event()
+    total = heavy_tasks + LIGHT_USERS
+
+    async def reply(latencies: list, enqueued_at: float):
+        await asyncio.sleep(SERVICE_SECONDS)
+        latencies.append(time.perf_counter() - enqueued_at)
+        if len(light) + len(heavy) == total:
+            done.set()
+
+    for _ in range(heavy_tasks):
+        await queue.add_task(reply, heavy, time.perf_counter(), fair_key="agency" if fair else None)
+    start = time.perf_counter()
+    for user_id in range(LIGHT_USERS):
+        delay = start + ARRIVAL_SECONDS * user_id / LIGHT_USERS - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await queue.add_task(reply, light, time.perf_counter(), fair_key=user_id if fair else None)
+    await done.wait()
+    await queue.stop()
+
+    light.sort()
+    return {
+        "light_p50_ms": percentile(light, 0.5) * 1e3,
+        "light_p99_ms": percentile(light, 0.99) * 1e3,
+        "light_max_ms": light[-1] * 1e3,
+        "heavy_max_s": max(heavy),
+    }
+
+
+async def main() -> None:
+    heavy_tasks = int(sys.argv[1]) if len(sys.argv) > 1 else HEAVY_TASKS
+    print(f"workers: {WORKERS}, heavy tasks: {heavy_tasks}, light users: {LIGHT_USERS}, "
+          f"service: {SERVICE_SECONDS * 1e3:.0f} ms")
+    print(f"{'scheduler':>10} | {'light p50, ms':>13} | {'light p99, ms':>13} | "
+          f"{'light max, ms':>13} | {'heavy done, s':>13}")
+    print("-" * 74)
+    for name, fair in (("fifo", False), ("drr", True)):
+        result = await simulate(fair, heavy_tasks)
+        print(f"{name:>10} | {result['light_p50_ms']:>13.1f} | {result['light_p99_ms']:>13.1f} | "
+              f"{result['light_max_ms']:>13.1f} | {result['heavy_max_s']:>13.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,78 @@
+"""
+Бенчмарк нормализации ключей: прирост hit rate кэша вариантов ответов
+при воспроизведении архива диалогов.
+
+Сообщения пользователей воспроизводятся в порядке времени. Для каждого
+сообщения ключ считается двумя способами: из сырого текста и из
+нормализованного. Обращения проходят через LRU заданной емкости.
+
+Запуск: python benchmarks/bench_key_normalization.py [путь_к_архиву] [емкость]
+"""
+
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+from typing import List
+
+# Добавляем корневую директорию проекта в PYTHONPATH
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.tiered_cache import make_cache_key, make_text_key
+
+ARCHIVE = os.path.join("data", "learning", "conversations_archive.json")
+STYLE = "friendly"
+
+
+def load_messages(path: str) -> List[str]:
+    """Сообщения пользователей из архива в порядке времени"""
+    with open(path, "r", encoding="utf-8") as f:
+        archive = json.load(f)
+    messages = []
+    for conversation in archive.values():
+        for message in conversation.get("messages", []):
+            if message.get("role") == "user" and message.get("content"):
+                messages.append((message.get("timestamp", 0), message["content"]))
+    messages.sort(key=lambda item: item[0])
+    return [text for _, text in messages]
+
+
+def replay(keys: List[str], capacity: int) -> float:
+    """Hit rate LRU-кэша на последовательности ключей"""
+    cache: "OrderedDict[str, None]" = OrderedDict()
+    hits = 0
+    for key in keys:
+        if key in cache:
+            hits += 1
+            cache.move_to_end(key)
+        else:
+            cache[key] = None
+            if len(cache) > capacity:
+                cache.popitem(last=False)
+    return hits / len(keys) if keys else 0.0
+
+
+def main() -> None:
+    path = sys.argv[1] if len(sys.argv) > 1 else ARCHIVE
+    capacity = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    messages = load_messages(path)
+
+    raw_keys = [make_cache_key(text, STYLE) for text in messages]
+    start = time.perf_counter()
+    normalized_keys = [make_text_key(text, STYLE) for text in messages]
+    key_us = (time.perf_counter() - start) / max(len(messages), 1) * 1e6
+
+    raw_rate = replay(raw_keys, capacity)
+    normalized_rate = replay(normalized_keys, capacity)
+
+    print(f"Архив: {path}")
+    print(f"Сообщений: {len(messages)}, емкость LRU: {capacity}")
+    print(f"Уникальных ключей: сырые {len(set(raw_keys))}, нормализованные {len(set(normalized_keys))}")
+    print(f"Hit rate: сырые {raw_rate:.2%}, нормализованные {normalized_rate:.2%} "
+          f"(прирост {normalized_rate - raw_rate:+.2%})")
+    print(f"Нормализация + ключ: {key_us:.1f} мкс/сообщение")
+
+
+if __name__ == "__main__":
+    main()
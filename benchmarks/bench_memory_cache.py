@@ -0,0 +1,50 @@
+"""
+Бенчмарк MemoryCache: задержка get/set/вытеснения от 1k до 1M элементов.
+
+Запуск: python benchmarks/bench_memory_cache.py
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+# Добавляем корневую директорию проекта в PYTHONPATH
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.cache import MemoryCache
+
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+OPS = 100_000
+
+
+async def bench(size: int) -> dict:
+    """Замер среднего времени операции на заполненном кэше"""
+    cache = MemoryCache(max_size=size)
+    for i in range(size):
+        await cache.set(f"warm:{i}", i, ttl_seconds=60 + i % 3600)
+
+    # set в полный кэш - каждая вставка вытесняет элемент
+    start = time.perf_counter()
+    for i in range(OPS):
+        await cache.set(f"new:{i}", i, ttl_seconds=60 + i % 3600)
+    set_ns = (time.perf_counter() - start) / OPS * 1e9
+
+    start = time.perf_counter()
+    for i in range(OPS):
+        await cache.get(f"new:{i}")
+    get_ns = (time.perf_counter() - start) / OPS * 1e9
+
+    return {"size": size, "set_ns": set_ns, "get_ns": get_ns}
+
+
+async def main() -> None:
+    print(f"{'entries':>10} | {'set+evict, ns/op':>16} | {'get, ns/op':>10}")
+    print("-" * 44)
+    for size in SIZES:
+        result = await bench(size)
+        print(f"{result['size']:>10} | {result['set_ns']:>16.0f} | {result['get_ns']:>10.0f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
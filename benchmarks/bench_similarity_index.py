@@ -0,0 +1,83 @@
+"""
+Бенчмарк NearDuplicateIndex: задержка поиска похожих сообщений от 10k до 1M записей.
+
+Тексты синтетические (4-9 слов из словаря 2000 псевдослов). Запросы
+"похожие" - сохраненный текст с измененной пунктуацией/регистром и одним
+добавленным словом, "новые" - случайные тексты.
+
+Запуск: python benchmarks/bench_similarity_index.py [макс_размер]
+"""
+
+import os
+import random
+import sys
+import time
+
+# Добавляем корневую директорию проекта в PYTHONPATH
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.similarity_index import NearDuplicateIndex
+
+SIZES = [10_000, 100_000, 1_000_000]
+QUERIES = 2_000
+SYLLABLES = ["при", "вет", "ка", "ко", "де", "ла", "фо", "то", "ви", "део", "сто", "ит",
+             "ми", "ла", "я", "хо", "чу", "те", "бя", "но", "во", "ма", "ша", "ре"]
+
+
+def make_vocabulary(rng: random.Random, size: int = 2000) -> list:
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def make_text(rng: random.Random, words: list) -> str:
+    return " ".join(rng.choice(words) for _ in range(rng.randint(4, 9)))
+
+
+def paraphrase(rng: random.Random, text: str, words: list) -> str:
+    return f"{text.capitalize()}, {rng.choice(words)}!!"
+
+
+def bench(size: int, rng: random.Random, words: list) -> dict:
+    index = NearDuplicateIndex(threshold=0.7, max_entries=size)
+    texts = [make_text(rng, words) for _ in range(size)]
+
+    start = time.perf_counter()
+    for i, text in enumerate(texts):
+        index.add(text, f"key:{i}")
+    add_us = (time.perf_counter() - start) / size * 1e6
+
+    similar = [paraphrase(rng, rng.choice(texts), words) for _ in range(QUERIES)]
+    start = time.perf_counter()
+    found = sum(index.lookup(text) is not None for text in similar)
+    similar_us = (time.perf_counter() - start) / QUERIES * 1e6
+
+    fresh = [make_text(rng, words) for _ in range(QUERIES)]
+    start = time.perf_counter()
+    false_hits = sum(index.lookup(text) is not None for text in fresh)
+    fresh_us = (time.perf_counter() - start) / QUERIES * 1e6
+
+    return {
+        "size": size, "add_us": add_us, "similar_us": similar_us, "fresh_us": fresh_us,
+        "recall": found / QUERIES, "false_hits": false_hits / QUERIES
+    }
+
+
+def main() -> None:
+    limit = int(sys.argv[1]) if len(sys.argv) > 1 else SIZES[-1]
+    rng = random.Random(42)
+    words = make_vocabulary(rng)
+    print(f"{'entries':>10} | {'add, us':>8} | {'lookup similar, us':>18} | "
+          f"{'lookup new, us':>14} | {'recall':>6} | {'false':>6}")
+    print("-" * 80)
+    for size in SIZES:
+        if size > limit:
+            break
+        r = bench(size, rng, words)
+        print(f"{r['size']:>10} | {r['add_us']:>8.1f} | {r['similar_us']:>18.1f} | "
+              f"{r['fresh_us']:>14.1f} | {r['recall']:>6.1%} | {r['false_hits']:>6.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Бенчмарк StateManager: задержка cleanup_expired и get_stats при большом числе пользователей.
+
+У каждого пользователя контекст /reply и состояние сообщения; между
+замерами истекает 1% записей. Полный обход стоил бы O(всех записей),
+куча истечения - O(истекших * log n).
+
+Запуск: python benchmarks/bench_state_manager.py [пользователей]
+"""
+
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+# Добавляем корневую директорию проекта в PYTHONPATH
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.state import StateManager
+
+SIZES = [10_000, 100_000, 300_000]
+
+
+class SimClock:
+    def __init__(self):
+        self.now = datetime(2024, 1, 1)
+
+    def __call__(self):
+        return self.now
+
+
+async def bench(users: int) -> dict:
+    clock = SimClock()
+    manager = StateManager(ttl_minutes=30, clock=clock)
+    step = timedelta(minutes=30) / users
+    for user_id in range(users):
+        clock.now += step
+        await manager.set_last_message_for_reply(user_id, "привет", f"h{user_id}")
+        await manager.set_user_message(f"h{user_id}", user_id, "привет")
+
+    # Истекает 1% самых старых записей
+    clock.now += timedelta(minutes=30) * 0.01
+    start = time.perf_counter()
+    await manager.cleanup_expired()
+    cleanup_ms = (time.perf_counter() - start) * 1e3
+
+    start = time.perf_counter()
+    stats = await manager.get_stats()
+    stats_ms = (time.perf_counter() - start) * 1e3
+    return {"users": users, "cleanup_ms": cleanup_ms, "stats_ms": stats_ms,
+            "live": stats["total_users_with_data"]}
+
+
+async def main() -> None:
+    limit = int(sys.argv[1]) if len(sys.argv) > 1 else SIZES[-1]
+    print(f"{'users':>8} | {'cleanup 1%, ms':>14} | {'get_stats, ms':>13} | {'live users':>10}")
+    print("-" * 56)
+    for size in SIZES:
+        if size > limit:
+            break
+        r = await bench(size)
+        print(f"{r['users']:>8} | {r['cleanup_ms']:>14.2f} | {r['stats_ms']:>13.3f} | {r['live']:>10}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,103 @@
+"""
+Бенчмарк памяти StateManager: байт на пользователя.
+
+У каждого пользователя контекст /reply, варианты ответов для одного
+сообщения и два счетчика статистики. Для сравнения та же нагрузка
+раскладывается в прежнюю схему: словарь словарей со строковыми ключами
+``reply_variants_{hash}``/``stat_*``, параллельный словарь TTL с datetime
+и запись кучи истечения на пользователя.
+
+Запуск: python benchmarks/bench_state_memory.py [пользователей]
+"""
+
+import asyncio
+import gc
+import heapq
+import itertools
+import os
+import sys
+import tracemalloc
+from datetime import datetime, timedelta
+
+# Добавляем корневую директорию проекта в PYTHONPATH
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.state import StateManager
+
+USERS = 1_000_000
+TEXT = "Привет! Как прошел твой день?"
+VARIANTS = ["Отлично, а у тебя?", "Скучала по тебе", "Расскажи подробнее"]
+STATS = ("reply_requests", "replies_selected")
+SHARDS = 16
+
+
+def user_hash(user_id: int) -> str:
+    return f"{user_id:016x}"
+
+
+def measure(build) -> int:
+    """Прирост памяти после построения структуры (сама структура удерживается)"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del result
+    return used
+
+
+def build_dicts(users: int):
+    """Прежняя раскладка: {user_id: {key: value}} + {user_id: datetime} + куча"""
+    shards = [({}, {}, []) for _ in range(SHARDS)]
+    start = datetime(2024, 1, 1) + timedelta(minutes=30)
+    sequence = itertools.count(users)
+    for user_id in range(users):
+        user_data, user_ttl, heap = shards[hash(user_id) % SHARDS]
+        expires_at = start + timedelta(microseconds=user_id)
+        message_hash = user_hash(user_id)
+        user_data[user_id] = {
+            'last_message_text_for_reply': TEXT,
+            'last_message_hash_for_reply': message_hash,
+            f'reply_variants_{message_hash}': VARIANTS,
+            # Ключи статистики собирались f-строкой, у каждого пользователя свои
+            **{f'stat_{name}': 1 for name in STATS}
+        }
+        user_ttl[user_id] = expires_at
+        heapq.heappush(heap, (expires_at.timestamp(), next(sequence), 0, user_id))
+    return shards
+
+
+def build_manager(users: int) -> StateManager:
+    """Текущий StateManager под той же нагрузкой"""
+    now = datetime(2024, 1, 1)
+    manager = StateManager(shards=SHARDS, clock=lambda: now)
+
+    async def fill():
+        for user_id in range(users):
+            message_hash = user_hash(user_id)
+            await manager.set_last_message_for_reply(user_id, TEXT, message_hash)
+            await manager.set_reply_variants(user_id, message_hash, VARIANTS)
+            for name in STATS:
+                await manager.increment_user_stat(user_id, name)
+
+    asyncio.run(fill())
+    # Куча держит по записи на продление TTL; сравниваем по одной на пользователя
+    for shard in manager._shards:
+        shard.compact()
+    return manager
+
+
+def main() -> None:
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else USERS
+    print(f"users: {users}")
+    print(f"{'layout':>16} | {'total, MB':>9} | {'bytes/user':>10}")
+    print("-" * 42)
+    for name, build in (("dict of dicts", build_dicts), ("StateManager", build_manager)):
+        used = measure(lambda: build(users))
+        print(f"{name:>16} | {used / 2**20:>9.1f} | {used / users:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Бенчмарк диспетчера TaskQueue: простой и нагрузка при 10 воркерах.
+
+Сравниваются прежний опрос четырех asyncio.Queue с таймаутом 0.1 с
+(воспроизведен подклассом) и текущая куча с asyncio.Condition:
+- CPU, потраченный простаивающими воркерами за секунду;
+- задержка от add_task до начала выполнения одиночной CRITICAL задачи
+  при пустой очереди;
+- задержка диспетчеризации (p50/p99) под потоком коротких задач.
+
+Запуск: python benchmarks/bench_task_queue.py [задач под нагрузкой]
+"""
+
+import asyncio
+import os
+import statistics
+import sys
+import time
+from typing import Optional
+
+# Добавляем корневую директорию проекта в PYTHONPATH
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.queue import Task, TaskPriority, TaskQueue
+
+WORKERS = 10
+IDLE_SECONDS = 1.0
+LOAD_TASKS = 1_000  # прежнему диспетчеру нужно ~0.2 с на задачу на воркер
+
+
+class PollingTaskQueue(TaskQueue):
+    """Прежний диспетчер: очередь на приоритет и опрос с таймаутом"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.queues = {priority: asyncio.Queue() for priority in TaskPriority}
+
+    async def _enqueue(self, task: Task) -> None:
+        await self.queues[task.priority].put(task)
+
+    async def _next_task(self) -> Optional[Task]:
+        while not self._stop_event.is_set():
+            for priority in reversed(list(TaskPriority)):
+                try:
+                    return await asyncio.wait_for(self.queues[priority].get(), timeout=0.1)
+                except asyncio.TimeoutError:
+                    continue
+        return None
+
+
+async def idle_cpu(queue: TaskQueue) -> float:
+    """CPU за IDLE_SECONDS простоя, мс"""
+    await asyncio.sleep(0.2)
+    start = time.process_time()
+    await asyncio.sleep(IDLE_SECONDS)
+    return (time.process_time() - start) * 1e3
+
+
+async def dispatch_latencies(queue: TaskQueue, count: int, priority: TaskPriority) -> list:
+    latencies = []
+    done = asyncio.Event()
+
+    async def job(enqueued_at: float):
+        latencies.append(time.perf_counter() - enqueued_at)
+        if len(latencies) == count:
+            done.set()
+
+    for i in range(count):
+        await queue.add_task(job, time.perf_counter(), priority=priority)
+        if i % 100 == 99:
+            await asyncio.sleep(0)  # поток задач, а не один пакет
+    await done.wait()
+    return latencies
+
+
+async def bench(queue_cls, load_tasks: int) -> dict:
+    queue = queue_cls(max_workers=WORKERS, max_queue_size=load_tasks + 1000)
+    await queue.start()
+    cpu_ms = await idle_cpu(queue)
+
+    critical = []
+    for _ in range(20):
+        await asyncio.sleep(0.05)
+        critical.extend(await dispatch_latencies(queue, 1, TaskPriority.CRITICAL))
+
+    queue.tasks.clear()
+    loaded = sorted(await dispatch_latencies(queue, load_tasks, TaskPriority.NORMAL))
+    await queue.stop()
+    return {
+        "idle_cpu_ms": cpu_ms,
+        "critical_ms": statistics.median(critical) * 1e3,
+        "p50_ms": loaded[len(loaded) // 2] * 1e3,
+        "p99_ms": loaded[int(len(loaded) * 0.99)] * 1e3,
+    }
+
+
+async def main() -> None:
+    load_tasks = int(sys.argv[1]) if len(sys.argv) > 1 else LOAD_TASKS
+    print(f"workers: {WORKERS}, tasks under load: {load_tasks}")
+    print(f"{'dispatcher':>12} | {'idle CPU, ms/s':>14} | {'CRITICAL, ms':>12} | {'p50, ms':>8} | {'p99, ms':>8}")
+    print("-" * 68)
+    for name, queue_cls in (("polling", PollingTaskQueue), ("condition", TaskQueue)):
+        result = await bench(queue_cls, load_tasks)
+        print(f"{name:>12} | {result['idle_cpu_ms']:>14.2f} | {result['critical_ms']:>12.3f} | "
+              f"{result['p50_ms']:>8.3f} | {result['p99_ms']:>8.3f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,81 @@
+"""
+Бенчмарк W-TinyLFU: доля попаданий MemoryCache на Zipf-нагрузке против LRU.
+
+Ключи выбираются по закону Ципфа (s=0.9) из 100k ключей; к потоку
+примешиваются разовые ключи (доля 30%), имитирующие уникальные тексты
+/reply. На каждый промах значение записывается в кэш (cache-aside).
+Вариант "LRU+TTL" - тот же LRU с TTL 5 минут при 20 запросах в секунду.
+
+Запуск: python benchmarks/bench_tinylfu.py [запросов]
+"""
+
+import itertools
+import os
+import random
+import sys
+import time
+
+# Добавляем корневую директорию проекта в PYTHONPATH
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.cache import MemoryCache
+from app.core.tinylfu import TinyLFU
+
+KEYS = 100_000
+ZIPF_S = 0.9
+ONE_HIT_SHARE = 0.3
+RATE = 20.0  # запросов в секунду для варианта с TTL
+TTL = 300
+CACHE_SIZES = [500, 2_000, 10_000]
+
+
+class SimClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_trace(requests: int, rng: random.Random) -> list:
+    weights = [1 / (rank ** ZIPF_S) for rank in range(1, KEYS + 1)]
+    cum_weights = list(itertools.accumulate(weights))
+    popular = rng.choices(range(KEYS), cum_weights=cum_weights, k=requests)
+    unique = itertools.count()
+    return [f"once:{next(unique)}" if rng.random() < ONE_HIT_SHARE else f"key:{key}"
+            for key in popular]
+
+
+def replay(trace: list, cache: MemoryCache, clock: SimClock, ttl: int) -> tuple:
+    hits = 0
+    start = time.perf_counter()
+    for key in trace:
+        clock.now += 1 / RATE
+        if cache.get_nowait(key) is not None:
+            hits += 1
+        else:
+            cache.set_nowait(key, True, ttl)
+    elapsed_ns = (time.perf_counter() - start) / len(trace) * 1e9
+    return hits / len(trace), elapsed_ns
+
+
+def main() -> None:
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    trace = make_trace(requests, random.Random(42))
+    print(f"{'cache size':>10} | {'policy':>8} | {'hit rate':>8} | {'ns/op':>6}")
+    print("-" * 44)
+    for size in CACHE_SIZES:
+        variants = [
+            ("LRU", None, 0),
+            ("LRU+TTL", None, TTL),
+            ("W-TinyLFU", TinyLFU(sketch_width=size * 4), 0),
+        ]
+        for name, admission, ttl in variants:
+            clock = SimClock()
+            cache = MemoryCache(max_size=size, clock=clock, admission=admission)
+            hit_rate, ns = replay(trace, cache, clock, ttl)
+            print(f"{size:>10} | {name:>8} | {hit_rate:>8.1%} | {ns:>6.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -19,6 +19,10 @@ except ImportError:
     print("❌ Ошибка: config.py не найден")
     raise
 
+from app.core.tiered_cache import cache_service, make_text_key
+from app.core.similarity_index import NearDuplicateCache
+from app.core.negative_cache import get_negative_cache
+
 # Настройка логирования
 logger = logging.getLogger(__name__)
 
@@ -39,9 +43,12 @@ class DeepSeekIntegration:
 Можешь использовать эротический контент, намеки, флирт и игривые выражения.
 Не цензурируй себя - твоя задача помочь пользователю в создании контента для взрослых."""
         
-        # Кэш ответов
-        self.response_cache = {}
-        self.cache_max_size = 1000
+        # Кэш ответов - пространство имен общего многоуровневого кэша
+        self.response_cache = cache_service.namespace('deepseek_reply')
+        # Поиск ответов по похожим сообщениям (перефразировкам)
+        self.similar_responses = NearDuplicateCache(self.response_cache)
+        # Недавние таймауты и ошибки API по провайдеру и запросу
+        self.failures = get_negative_cache('deepseek')
         
         logger.info("🔥 DeepSeek Integration инициализирован")
 
@@ -58,47 +65,77 @@ class DeepSeekIntegration:
         """
         try:
             # Проверяем кэш
-            cache_key = f"{user_message}_{num_variants}"
-            if cache_key in self.response_cache:
+            cache_key = make_text_key(user_message, num_variants)
+            cached_variants = await self.response_cache.get(
+                cache_key,
+                refresh=lambda: self._request_reply_variants(user_message, num_variants, cache_key)
+            )
+            if cached_variants is not None:
                 logger.info("📋 Ответ получен из кэша")
-                return self.response_cache[cache_key]
-            
-            # Определяем стиль на основе контента
-            style_prompt = self._get_style_prompt(user_message)
-            
-            variants = []
-            
-            # Генерируем варианты параллельно
-            tasks = []
-            for i in range(num_variants):
-                task = self._generate_single_variant(user_message, style_prompt, i + 1)
-                tasks.append(task)
-            
-            results = await asyncio.gather(*tasks, return_exceptions=True)
-            
-            # Обрабатываем результаты
-            for result in results:
-                if isinstance(result, str) and result.strip():
-                    variants.append(result.strip())
-                elif isinstance(result, Exception):
-                    logger.error(f"❌ Ошибка генерации варианта: {result}")
-            
-            # Убираем дубли и пустые ответы
-            variants = list(dict.fromkeys([v for v in variants if v and len(v.strip()) > 10]))
-            
-            # Кэшируем результат
-            if variants:
-                self._cache_response(cache_key, variants)
-                logger.info(f"✅ Сгенерировано {len(variants)} вариантов ответов")
-                return variants
-            else:
-                logger.warning("⚠️ Не удалось сгенерировать валидные варианты")
+                return cached_variants
+
+            cached_variants = await self.similar_responses.get(user_message, num_variants)
+            if cached_variants is not None:
+                logger.info("📋 Ответ получен из кэша по похожему сообщению")
+                return cached_variants
+
+            if self.failures.is_blocked(cache_key):
+                logger.warning("⏳ DeepSeek недавно не ответил на этот запрос - отдаем fallback")
                 return self._get_fallback_responses(user_message)
+            
+            # Одинаковые одновременные запросы ждут одну генерацию
+            return await self.response_cache.coalesce(
+                cache_key,
+                lambda: self._request_reply_variants(user_message, num_variants, cache_key)
+            )
                 
         except Exception as e:
             logger.error(f"❌ Ошибка в generate_reply_variants: {e}")
             return self._get_fallback_responses(user_message)
 
+    async def _request_reply_variants(self, user_message: str, num_variants: int,
+                                      cache_key: str) -> List[str]:
+        """Генерация вариантов через API и запись результата в кэш"""
+        if self.failures.blocked_for(cache_key) > 0:
+            # Фоновое обновление не обращается к API, пока действует блокировка
+            return self._get_fallback_responses(user_message)
+
+        # Определяем стиль на основе контента
+        style_prompt = self._get_style_prompt(user_message)
+        
+        variants = []
+        
+        # Генерируем варианты параллельно
+        tasks = []
+        for i in range(num_variants):
+            task = self._generate_single_variant(user_message, style_prompt, i + 1)
+            tasks.append(task)
+        
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        
+        # Обрабатываем результаты
+        for result in results:
+            if isinstance(result, str) and result.strip():
+                variants.append(result.strip())
+            elif isinstance(result, Exception):
+                logger.error(f"❌ Ошибка генерации варианта: {result}")
+        
+        # Убираем дубли и пустые ответы
+        variants = list(dict.fromkeys([v for v in variants if v and len(v.strip()) > 10]))
+        
+        # Кэшируем результат
+        if variants:
+            self.failures.record_success(cache_key)
+            await self._cache_response(cache_key, variants)
+            self.similar_responses.add(user_message, num_variants, cache_key)
+            logger.info(f"✅ Сгенерировано {len(variants)} вариантов ответов")
+            return variants
+        else:
+            ttl = self.failures.record_failure(cache_key)
+            logger.warning(f"⚠️ Не удалось сгенерировать валидные варианты, "
+                           f"повтор не раньше чем через {ttl:.0f} сек")
+            return self._get_fallback_responses(user_message)
+
     async def _generate_single_variant(self, user_message: str, style_prompt: str, variant_num: int) -> str:
         """Генерация одного варианта ответа"""
         try:
@@ -219,17 +256,11 @@ class DeepSeekIntegration:
         
         return response
 
-    def _cache_response(self, cache_key: str, variants: List[str]):
+    async def _cache_response(self, cache_key: str, variants: List[str]):
         """Кэширование ответа"""
         try:
-            # Ограничиваем размер кэша
-            if len(self.response_cache) >= self.cache_max_size:
-                # Удаляем старые записи (простая FIFO логика)
-                old_keys = list(self.response_cache.keys())[:100]
-                for key in old_keys:
-                    del self.response_cache[key]
-            
-            self.response_cache[cache_key] = variants
+            # Размер и вытеснение контролирует общий кэш
+            await self.response_cache.set(cache_key, variants)
             logger.info(f"💾 Ответ закэширован: {cache_key[:50]}...")
             
         except Exception as e:
@@ -250,7 +281,9 @@ class DeepSeekIntegration:
         """Получение статистики использования"""
         return {
             "cache_size": len(self.response_cache),
-            "cache_max_size": self.cache_max_size,
+            "cache_bytes": self.response_cache.bytes_used,
+            "similar_cache": self.similar_responses.get_stats(),
+            "failures": self.failures.get_stats(),
             "api_model": self.model,
             "base_url": self.base_url
         }
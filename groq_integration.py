@@ -13,16 +13,6 @@ try:
 except ImportError:
     GROQ_AVAILABLE = False
 
-# Fallback для cachetools если не установлен
-try:
-    from cachetools import TTLCache
-except ImportError:
-    class TTLCache(dict):
-        def __init__(self, maxsize=100, ttl=3600):
-            super().__init__()
-            self.maxsize = maxsize
-            self.ttl = ttl
-
 import json
 
 # Импорт кастомных исключений
@@ -32,6 +22,9 @@ from app.core.error_handler import (
     InputValidator,
     ErrorHandler
 )
+from app.core.tiered_cache import cache_service, make_cache_key, make_text_key
+from app.core.similarity_index import NearDuplicateCache
+from app.core.negative_cache import get_negative_cache
 
 # Импорт логгера
 try:
@@ -66,10 +59,14 @@ class GroqContentGenerator:
                     api_response=str(e)
                 )
             
-            # Кэш для ответов (TTL = 1 час)
-            self.reply_cache = TTLCache(maxsize=1000, ttl=3600)
-            self.ppv_cache = TTLCache(maxsize=500, ttl=3600)
-            self.hot_cache = TTLCache(maxsize=500, ttl=3600)
+            # Кэш для ответов - пространства имен общего многоуровневого кэша
+            self.reply_cache = cache_service.namespace('reply')
+            self.ppv_cache = cache_service.namespace('ppv')
+            self.hot_cache = cache_service.namespace('hot')
+            # Поиск вариантов по похожим сообщениям (перефразировкам)
+            self.similar_replies = NearDuplicateCache(self.reply_cache)
+            # Недавние ошибки API, чтобы не повторять заведомо неудачные вызовы
+            self.failures = get_negative_cache('groq')
             
             bot_logger.log_info("Groq Content Generator успешно инициализирован")
             
@@ -82,9 +79,7 @@ class GroqContentGenerator:
     def _get_cache_key(self, text: str, style: str = None) -> str:
         """Генерация ключа для кэша"""
         try:
-            import hashlib
-            content = f"{text}:{style}" if style else text
-            return hashlib.md5(content.encode()).hexdigest()[:16]
+            return make_text_key(text, style) if style else make_cache_key(text)
         except Exception as e:
             bot_logger.log_warning(f"Ошибка генерации ключа кэша: {e}")
             return f"{text}:{style}" if style else text
@@ -104,86 +99,26 @@ class GroqContentGenerator:
             
             # Проверяем кэш
             cache_key = self._get_cache_key(user_text, style)
-            if cache_key in self.reply_cache:
+            cached_variants = await self.reply_cache.get(
+                cache_key, refresh=lambda: self._request_reply_variants(user_text, style, cache_key)
+            )
+            if cached_variants is not None:
                 bot_logger.log_info("Использование кэшированных вариантов ответов")
-                return self.reply_cache[cache_key]
-            
-            # Генерация промптов
-            style_prompts = {
-                'friendly': "Дружелюбный и теплый тон, как подруга",
-                'flirty': "Легкий флирт, игривый и привлекательный тон",
-                'passionate': "Страстный и эмоциональный тон с намеками",
-                'romantic': "Романтичный и нежный тон",
-                'professional': "Вежливый и профессиональный тон"
-            }
-            
-            system_prompt = f"""Ты - привлекательная OnlyFans модель, которая отвечает на сообщения клиентов.
+                return cached_variants
 
-ЗАДАЧА: Создай 3 разных варианта ответа на сообщение клиента.
-
-СТИЛЬ: {style_prompts.get(style, style_prompts['friendly'])}
+            cached_variants = await self.similar_replies.get(user_text, style)
+            if cached_variants is not None:
+                bot_logger.log_info("Использование вариантов для похожего сообщения")
+                return cached_variants
 
-ТРЕБОВАНИЯ:
-- Каждый вариант должен быть уникальным
-- Используй эмодзи умеренно (1-2 на вариант)
-- Длина: 1-2 предложения
-- Будь естественной и живой
-- Поощряй дальнейшее общение
-
-ФОРМАТ ОТВЕТА:
-Вариант 1: [текст]
-Вариант 2: [текст]  
-Вариант 3: [текст]"""
-
-            user_prompt = f"Сообщение клиента: {user_text}"
+            if self.failures.is_blocked(f"reply:{cache_key}"):
+                bot_logger.log_warning("Groq API недавно вернул ошибку - используем fallback варианты")
+                return self._fallback_variants(user_text, style)
             
-            # API вызов с обработкой ошибок
-            try:
-                response = await self.client.chat.completions.create(
-                    model=self.model,
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_prompt}
-                    ],
-                    max_tokens=200,
-                    temperature=0.8
-                )
-                
-                if not response or not response.choices:
-                    raise GroqApiError(
-                        "Пустой ответ от Groq API", 
-                        api_response="Empty response"
-                    )
-                
-                content = response.choices[0].message.content.strip()
-                variants = self._parse_variants(content)
-                
-                if len(variants) < 3:
-                    bot_logger.log_warning("Парсинг не дал 3 варианта, используем fallback")
-                    variants = self._fallback_variants(user_text, style)
-                
-                # Сохраняем в кэш
-                self.reply_cache[cache_key] = variants
-                bot_logger.log_info(f"Сгенерировано {len(variants)} вариантов ответов")
-                return variants
-                
-            except Exception as api_error:
-                if "rate_limit" in str(api_error).lower():
-                    raise GroqApiError(
-                        "Превышен лимит запросов к API",
-                        api_response=str(api_error)
-                    )
-                elif "unauthorized" in str(api_error).lower():
-                    raise GroqApiError(
-                        "Неверный API ключ",
-                        status_code=401,
-                        api_response=str(api_error)
-                    )
-                else:
-                    raise GroqApiError(
-                        f"Ошибка Groq API: {str(api_error)}",
-                        api_response=str(api_error)
-                    )
+            # Одинаковые одновременные запросы ждут один вызов API
+            return await self.reply_cache.coalesce(
+                cache_key, lambda: self._request_reply_variants(user_text, style, cache_key)
+            )
                 
         except InvalidUserInputError:
             # Пробрасываем ошибки валидации как есть
@@ -204,6 +139,93 @@ class GroqContentGenerator:
             bot_logger.log_warning("Использование fallback вариантов из-за ошибки")
             return variants
     
+    async def _request_reply_variants(self, user_text: str, style: str, cache_key: str) -> List[str]:
+        """Вызов Groq API для вариантов ответа и запись результата в кэш"""
+        failure_key = f"reply:{cache_key}"
+        if self.failures.blocked_for(failure_key) > 0:
+            # Фоновое обновление не должно обращаться к API, пока действует блокировка
+            raise GroqApiError("Groq API временно не вызывается после ошибки")
+        
+        # Генерация промптов
+        style_prompts = {
+            'friendly': "Дружелюбный и теплый тон, как подруга",
+            'flirty': "Легкий флирт, игривый и привлекательный тон",
+            'passionate': "Страстный и эмоциональный тон с намеками",
+            'romantic': "Романтичный и нежный тон",
+            'professional': "Вежливый и профессиональный тон"
+        }
+        
+        system_prompt = f"""Ты - привлекательная OnlyFans модель, которая отвечает на сообщения клиентов.
+
+ЗАДАЧА: Создай 3 разных варианта ответа на сообщение клиента.
+
+СТИЛЬ: {style_prompts.get(style, style_prompts['friendly'])}
+
+ТРЕБОВАНИЯ:
+- Каждый вариант должен быть уникальным
+- Используй эмодзи умеренно (1-2 на вариант)
+- Длина: 1-2 предложения
+- Будь естественной и живой
+- Поощряй дальнейшее общение
+
+ФОРМАТ ОТВЕТА:
+Вариант 1: [текст]
+Вариант 2: [текст]  
+Вариант 3: [текст]"""
+
+        user_prompt = f"Сообщение клиента: {user_text}"
+        
+        # API вызов с обработкой ошибок
+        try:
+            response = await self.client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt}
+                ],
+                max_tokens=200,
+                temperature=0.8
+            )
+            
+            if not response or not response.choices:
+                raise GroqApiError(
+                    "Пустой ответ от Groq API", 
+                    api_response="Empty response"
+                )
+            
+            content = response.choices[0].message.content.strip()
+            variants = self._parse_variants(content)
+            
+            if len(variants) < 3:
+                bot_logger.log_warning("Парсинг не дал 3 варианта, используем fallback")
+                variants = self._fallback_variants(user_text, style)
+            
+            # Сохраняем в кэш
+            await self.reply_cache.set(cache_key, variants)
+            self.similar_replies.add(user_text, style, cache_key)
+            self.failures.record_success(failure_key)
+            bot_logger.log_info(f"Сгенерировано {len(variants)} вариантов ответов")
+            return variants
+            
+        except Exception as api_error:
+            self.failures.record_failure(failure_key)
+            if "rate_limit" in str(api_error).lower():
+                raise GroqApiError(
+                    "Превышен лимит запросов к API",
+                    api_response=str(api_error)
+                )
+            elif "unauthorized" in str(api_error).lower():
+                raise GroqApiError(
+                    "Неверный API ключ",
+                    status_code=401,
+                    api_response=str(api_error)
+                )
+            else:
+                raise GroqApiError(
+                    f"Ошибка Groq API: {str(api_error)}",
+                    api_response=str(api_error)
+                )
+    
     async def generate_ppv_description(self, price: int) -> str:
         """Генерация описания PPV контента с обработкой ошибок"""
         
@@ -227,11 +249,42 @@ class GroqContentGenerator:
             
             # Проверяем кэш
             cache_key = self._get_cache_key(str(price))
-            if cache_key in self.ppv_cache:
+            cached_description = await self.ppv_cache.get(
+                cache_key, refresh=lambda: self._request_ppv_description(price, cache_key)
+            )
+            if cached_description is not None:
                 bot_logger.log_info("Использование кэшированного PPV описания")
-                return self.ppv_cache[cache_key]
+                return cached_description
+
+            if self.failures.is_blocked(f"ppv:{cache_key}"):
+                bot_logger.log_warning("Groq API недавно вернул ошибку - используем fallback PPV описание")
+                return self._fallback_ppv_description(price)
             
-            system_prompt = f"""Ты - OnlyFans модель, создающая описание платного контента (PPV).
+            return await self.ppv_cache.coalesce(
+                cache_key, lambda: self._request_ppv_description(price, cache_key)
+            )
+                
+        except (InvalidUserInputError, GroqApiError):
+            raise
+        except Exception as e:
+            result = error_handler.handle_error(e, {
+                'function': 'generate_ppv_description',
+                'price': price
+            })
+            
+            # Возвращаем fallback описание
+            description = self._fallback_ppv_description(price)
+            bot_logger.log_warning("Использование fallback PPV описания")
+            return description
+    
+    async def _request_ppv_description(self, price: int, cache_key: str) -> str:
+        """Вызов Groq API для PPV описания и запись результата в кэш"""
+        failure_key = f"ppv:{cache_key}"
+        if self.failures.blocked_for(failure_key) > 0:
+            # Фоновое обновление не должно обращаться к API, пока действует блокировка
+            raise GroqApiError("Groq API временно не вызывается после ошибки")
+        
+        system_prompt = f"""Ты - OnlyFans модель, создающая описание платного контента (PPV).
 
 ЗАДАЧА: Создай привлекательное описание эксклюзивного контента за ${price}
 
@@ -245,42 +298,31 @@ class GroqContentGenerator:
 
 СТИЛЬ: Соблазнительный, но элегантный"""
 
-            try:
-                response = await self.client.chat.completions.create(
-                    model=self.model,
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": f"Создай описание PPV контента за ${price}"}
-                    ],
-                    max_tokens=150,
-                    temperature=0.9
-                )
-                
-                if not response or not response.choices:
-                    raise GroqApiError("Пустой ответ от Groq API для PPV")
-                
-                description = response.choices[0].message.content.strip()
-                
-                # Сохраняем в кэш
-                self.ppv_cache[cache_key] = description
-                bot_logger.log_info("PPV описание успешно сгенерировано")
-                return description
-                
-            except Exception as api_error:
-                raise GroqApiError(f"Ошибка API при генерации PPV: {str(api_error)}")
-                
-        except (InvalidUserInputError, GroqApiError):
-            raise
-        except Exception as e:
-            result = error_handler.handle_error(e, {
-                'function': 'generate_ppv_description',
-                'price': price
-            })
+        try:
+            response = await self.client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": f"Создай описание PPV контента за ${price}"}
+                ],
+                max_tokens=150,
+                temperature=0.9
+            )
             
-            # Возвращаем fallback описание
-            description = self._fallback_ppv_description(price)
-            bot_logger.log_warning("Использование fallback PPV описания")
+            if not response or not response.choices:
+                raise GroqApiError("Пустой ответ от Groq API для PPV")
+            
+            description = response.choices[0].message.content.strip()
+            
+            # Сохраняем в кэш
+            await self.ppv_cache.set(cache_key, description)
+            self.failures.record_success(failure_key)
+            bot_logger.log_info("PPV описание успешно сгенерировано")
             return description
+            
+        except Exception as api_error:
+            self.failures.record_failure(failure_key)
+            raise GroqApiError(f"Ошибка API при генерации PPV: {str(api_error)}")
     
     async def generate_hot_content(self, level: str) -> str:
         """Генерация откровенного контента с обработкой ошибок"""
@@ -299,17 +341,48 @@ class GroqContentGenerator:
             
             # Проверяем кэш
             cache_key = self._get_cache_key(level)
-            if cache_key in self.hot_cache:
+            cached_content = await self.hot_cache.get(
+                cache_key, refresh=lambda: self._request_hot_content(level, cache_key)
+            )
+            if cached_content is not None:
                 bot_logger.log_info("Использование кэшированного hot контента")
-                return self.hot_cache[cache_key]
+                return cached_content
+
+            if self.failures.is_blocked(f"hot:{cache_key}"):
+                bot_logger.log_warning("Groq API недавно вернул ошибку - используем fallback hot контент")
+                return self._fallback_hot_content(level)
             
-            level_prompts = {
-                'light': "Легкий флирт, намеки без откровенности",
-                'passionate': "Страстные намеки, эмоциональный тон",
-                'explicit': "Более откровенный контент, но в рамках приличия"
-            }
+            return await self.hot_cache.coalesce(
+                cache_key, lambda: self._request_hot_content(level, cache_key)
+            )
+                
+        except (InvalidUserInputError, GroqApiError):
+            raise
+        except Exception as e:
+            result = error_handler.handle_error(e, {
+                'function': 'generate_hot_content',
+                'level': level
+            })
             
-            system_prompt = f"""Ты - OnlyFans модель, создающая {level_prompts.get(level)} контент.
+            # Возвращаем fallback контент
+            content = self._fallback_hot_content(level)
+            bot_logger.log_warning("Использование fallback hot контента")
+            return content
+    
+    async def _request_hot_content(self, level: str, cache_key: str) -> str:
+        """Вызов Groq API для hot контента и запись результата в кэш"""
+        failure_key = f"hot:{cache_key}"
+        if self.failures.blocked_for(failure_key) > 0:
+            # Фоновое обновление не должно обращаться к API, пока действует блокировка
+            raise GroqApiError("Groq API временно не вызывается после ошибки")
+        
+        level_prompts = {
+            'light': "Легкий флирт, намеки без откровенности",
+            'passionate': "Страстные намеки, эмоциональный тон",
+            'explicit': "Более откровенный контент, но в рамках приличия"
+        }
+        
+        system_prompt = f"""Ты - OnlyFans модель, создающая {level_prompts.get(level)} контент.
 
 ЗАДАЧА: Создай привлекательное сообщение с соответствующим уровнем откровенности
 
@@ -322,42 +395,31 @@ class GroqContentGenerator:
 
 ВАЖНО: Контент должен быть привлекательным, но не вульгарным"""
 
-            try:
-                response = await self.client.chat.completions.create(
-                    model=self.model,
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": f"Создай {level} контент"}
-                    ],
-                    max_tokens=100,
-                    temperature=0.8
-                )
-                
-                if not response or not response.choices:
-                    raise GroqApiError("Пустой ответ от Groq API для hot контента")
-                
-                content = response.choices[0].message.content.strip()
-                
-                # Сохраняем в кэш
-                self.hot_cache[cache_key] = content
-                bot_logger.log_info("Hot контент успешно сгенерирован")
-                return content
-                
-            except Exception as api_error:
-                raise GroqApiError(f"Ошибка API при генерации hot контента: {str(api_error)}")
-                
-        except (InvalidUserInputError, GroqApiError):
-            raise
-        except Exception as e:
-            result = error_handler.handle_error(e, {
-                'function': 'generate_hot_content',
-                'level': level
-            })
+        try:
+            response = await self.client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": f"Создай {level} контент"}
+                ],
+                max_tokens=100,
+                temperature=0.8
+            )
             
-            # Возвращаем fallback контент
-            content = self._fallback_hot_content(level)
-            bot_logger.log_warning("Использование fallback hot контента")
+            if not response or not response.choices:
+                raise GroqApiError("Пустой ответ от Groq API для hot контента")
+            
+            content = response.choices[0].message.content.strip()
+            
+            # Сохраняем в кэш
+            await self.hot_cache.set(cache_key, content)
+            self.failures.record_success(failure_key)
+            bot_logger.log_info("Hot контент успешно сгенерирован")
             return content
+            
+        except Exception as api_error:
+            self.failures.record_failure(failure_key)
+            raise GroqApiError(f"Ошибка API при генерации hot контента: {str(api_error)}")
     
     def _parse_variants(self, content: str) -> List[str]:
         """Парсинг вариантов из ответа API с обработкой ошибок"""
@@ -496,6 +558,18 @@ async def generate_reply_variants(user_text: str, style: str = 'friendly') -> Li
             "Расскажи мне больше! 🌟"
         ]
 
+async def get_cached_reply_variants(user_text: str, style: str = 'friendly') -> Optional[List[str]]:
+    """Получение вариантов ответов из кэша без обращения к API"""
+    try:
+        generator = get_content_generator()
+        variants = await generator.reply_cache.get(generator._get_cache_key(user_text, style))
+        if variants is None:
+            variants = await generator.similar_replies.get(user_text, style)
+        return variants
+    except Exception as e:
+        bot_logger.log_warning(f"Ошибка чтения кэша вариантов ответов: {e}")
+        return None
+
 async def generate_ppv_description(price: int) -> str:
     """Глобальная функция для генерации PPV описания с обработкой ошибок"""
     try:
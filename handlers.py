@@ -10,6 +10,7 @@ from telebot import types
 from api_handler import deepseek_handler
 from services.ai_integration import ai_service
 from enhanced_logging import BotLogger
+from app.core import state_manager
 import config
 
 # Инициализация
@@ -270,16 +271,25 @@ class BotHandlers:
             reply_markup=keyboard
         )
         
-        # Сохраняем исходное сообщение для генерации ответов
-        if not hasattr(self, 'pending_messages'):
-            self.pending_messages = {}
-        self.pending_messages[message.message_id] = {
-            'text': user_text,
-            'user_id': message.from_user.id,
-            'chat_id': message.chat.id,
-            'username': message.from_user.username or "Anonymous",
-            'first_name': message.from_user.first_name or "Красавчик"
-        }
+        # Сохраняем исходное сообщение для генерации ответов в StateManager:
+        # callback может прийти в другой процесс бота
+        await state_manager.set_user_message(
+            self._pending_key(message.chat.id, message.message_id),
+            message.from_user.id,
+            user_text,
+            additional_data={
+                'text': user_text,
+                'user_id': message.from_user.id,
+                'chat_id': message.chat.id,
+                'username': message.from_user.username or "Anonymous",
+                'first_name': message.from_user.first_name or "Красавчик"
+            }
+        )
+
+    @staticmethod
+    def _pending_key(chat_id: int, message_id: int) -> str:
+        """Ключ исходного сообщения и его вариантов в StateManager"""
+        return f"pending_{chat_id}_{message_id}"
 
     async def ppv_reminder(self, bot):
         """PPV напоминалка для всех активных чатов"""
@@ -415,11 +425,12 @@ class BotHandlers:
             message_id = int(message_id)
             
             # Получаем исходное сообщение
-            if not hasattr(self, 'pending_messages') or message_id not in self.pending_messages:
+            stored = await state_manager.get_user_message(self._pending_key(call.message.chat.id, message_id))
+            if stored is None:
                 await self.bot.answer_callback_query(call.id, "❌ Сообщение не найдено")
                 return
             
-            original_msg = self.pending_messages[message_id]
+            original_msg = stored['additional_data']
             
             # Показываем процесс генерации
             await self.bot.edit_message_text(
@@ -448,11 +459,12 @@ class BotHandlers:
             variant_index = int(variant_index)
             message_id = int(message_id)
             
-            if not hasattr(self, 'response_variants') or message_id not in self.response_variants:
+            pending_key = self._pending_key(call.message.chat.id, message_id)
+            responses = await state_manager.get_reply_variants(call.from_user.id, pending_key)
+            if not responses:
                 await self.bot.answer_callback_query(call.id, "❌ Варианты не найдены")
                 return
             
-            responses = self.response_variants[message_id]
             selected_response = responses[variant_index]
             
             # Отправляем выбранный ответ
@@ -464,8 +476,8 @@ class BotHandlers:
             )
             
             # Очищаем временные данные
-            del self.pending_messages[message_id]
-            del self.response_variants[message_id]
+            await state_manager.delete_user_message(pending_key)
+            await state_manager.clear_reply_variants(call.from_user.id, pending_key)
             
             await self.bot.answer_callback_query(call.id, f"✅ Вариант #{variant_index + 1} отправлен!")
             
@@ -542,10 +554,9 @@ class BotHandlers:
     
     async def show_response_variants(self, call, responses, style, message_id):
         """Показать варианты ответов для выбора"""
-        if not hasattr(self, 'response_variants'):
-            self.response_variants = {}
-        
-        self.response_variants[message_id] = responses
+        await state_manager.set_reply_variants(
+            call.from_user.id, self._pending_key(call.message.chat.id, message_id), responses
+        )
         
         # Создаем текст с вариантами
         style_names = {
@@ -22,6 +22,8 @@ try:
     from handlers import setup_handlers
     from enhanced_logging import BotLogger
     from api_handler import deepseek_handler
+    from app.core import cache_service, state_manager, sweeper
+    from app.core.snapshot import SnapshotManager
 except ImportError as e:
     print(f"❌ Ошибка импорта: {e}")
     print("💡 Установите зависимости: pip install -r requirements.txt")
@@ -41,6 +43,7 @@ class OFAssistantBot:
         """Инициализация бота"""
         self.bot = None
         self.handlers = None
+        self.snapshots = SnapshotManager(cache_service, state_manager)
         
     async def initialize(self):
         """Инициализация всех компонентов"""
@@ -69,6 +72,11 @@ class OFAssistantBot:
             self.handlers = setup_handlers(self.bot)
             logger.log_info("✅ Обработчики настроены")
             
+            # Прогретый кэш и состояния из снимка загружаются в фоне
+            self.snapshots.start()
+            # Фоновое удаление истекших записей кэша и состояний
+            sweeper.start()
+            
             # Тест DeepSeek
             test_response = await deepseek_handler.ask_deepseek("Тест подключения")
             if test_response:
@@ -120,6 +128,12 @@ class OFAssistantBot:
                 await self.bot.close_session()
                 logger.log_info("🔌 Сессия Telegram закрыта")
             
+            await self.snapshots.close()
+            await sweeper.stop()
+            await state_manager.close()
+            await cache_service.close()
+            logger.log_info("💾 Кэш выгружен")
+            
             logger.log_info("✅ Бот корректно завершил работу")
             print("\n👋 OF Assistant Bot остановлен")
             
@@ -63,8 +63,10 @@ try:
         InputValidator,
         handle_bot_errors
     )
-    from app.core import state_manager
-    from groq_integration import generate_reply_variants
+    from app.core import state_manager, cache_service, sweeper
+    from app.core.speculative import SpeculativeGenerator
+    from app.core.snapshot import SnapshotManager
+    from groq_integration import generate_reply_variants, get_cached_reply_variants
 except ImportError as e:
     print(f"❌ Ошибка импорта: {e}")
     print("Убедитесь, что все необходимые файлы существуют")
@@ -104,6 +106,11 @@ class TelegramBot:
             self.logger.log_error(f"❌ Ошибка инициализации бота: {e}", exc_info=True)
             raise
         
+        # Упреждающая генерация вероятных стилей после /reply
+        self.speculator = SpeculativeGenerator(generate_reply_variants, state_manager)
+        # Снимок горячего кэша и состояний между перезапусками
+        self.snapshots = SnapshotManager(cache_service, state_manager)
+        
         # Регистрация обработчиков
         self._register_handlers()
         
@@ -298,6 +305,8 @@ class TelegramBot:
                 
                 if result:
                     self.logger.log_info(f"✅ Меню выбора стиля отправлено пользователю {user_id}")
+                    # Пока пользователь выбирает стиль, генерируем вероятные варианты
+                    await self.speculator.speculate(user_id, message_hash, user_message)
                 
             except InvalidUserInputError as e:
                 # Отправляем помощь если ошибка валидации
@@ -329,9 +338,9 @@ class TelegramBot:
                 self.logger.log_user_activity(user_id, "stats_command", {"username": username})
                 
                 # Получаем статистику пользователя из StateManager
-                reply_requests = await state_manager.get_user_stat(user_id, 'reply_requests')
-                replies_selected = await state_manager.get_user_stat(user_id, 'replies_selected')
-                user_stats = await state_manager.get_user_stats(user_id)
+                user_stats = await state_manager.get_many(user_id, ('stat_reply_requests', 'stat_replies_selected'))
+                reply_requests = user_stats['stat_reply_requests'] or 0
+                replies_selected = user_stats['stat_replies_selected'] or 0
                 
                 # Формируем сообщение со статистикой
                 if reply_requests > 0:
@@ -423,22 +432,24 @@ class TelegramBot:
                 # Валидируем стиль
                 InputValidator.validate_style(style_code)
                 
-                # Получаем исходное сообщение
+                # Получаем исходное сообщение (callback мог прийти до перезапуска)
+                await self.snapshots.ensure_restored()
                 stored_message = await state_manager.get_user_message(message_hash)
                 if not stored_message:
                     raise InvalidUserInputError("Сообщение не найдено или истекло")
                 
                 user_message = stored_message['message']
                 
+                # История выбора стилей и метрика упреждающей генерации
+                await self.speculator.record_choice(user_id, message_hash, style_code)
+                
                 self.logger.log_user_activity(user_id, "style_selected", {
                     "style": style_code,
                     "message_hash": message_hash
                 })
                 
-                # Проверяем кэш
-                from app.core import memory_cache
-                cache_key = memory_cache.get_cache_key(style_code, hashlib.md5(user_message.encode()).hexdigest())
-                cached_variants = memory_cache.get(cache_key)
+                # Проверяем общий кэш вариантов (заполняется generate_reply_variants)
+                cached_variants = await get_cached_reply_variants(user_message, style_code)
                 
                 if cached_variants:
                     self.logger.log_info(f"Использование кэшированных вариантов для пользователя {user_id}")
@@ -459,9 +470,6 @@ class TelegramBot:
                         if not variants or len(variants) == 0:
                             raise GroqApiError("Получен пустой список вариантов от API")
                         
-                        # Сохраняем в кэш
-                        memory_cache.set(cache_key, variants)
-                        
                         self.logger.log_api_call("Groq API успешный вызов", {
                             "style": style_code,
                             "variants_count": len(variants),
@@ -567,21 +575,22 @@ class TelegramBot:
                     raise InvalidUserInputError("Неверный индекс варианта")
                 
                 # Получаем сохраненные варианты
-                variants = await state_manager.get_reply_variants(user_id, message_hash)
-                if not variants:
-                    raise InvalidUserInputError("Варианты ответов не найдены")
-                
-                if variant_index < 0 or variant_index >= len(variants):
-                    raise InvalidUserInputError("Неверный индекс варианта")
-                
-                selected_variant = variants[variant_index]
-                
-                # Получаем данные об исходном сообщении для дополнительного контекста
-                original_message_data = await state_manager.get_last_message_for_reply(user_id)
-                original_message_text = original_message_data.get('text') if original_message_data else None
-                
-                # Увеличиваем счетчик успешно выбранных ответов
-                selected_count = await state_manager.increment_user_stat(user_id, 'replies_selected')
+                await self.snapshots.ensure_restored()
+                async with state_manager.transaction(user_id) as user_state:
+                    variants = user_state.get(f'reply_variants_{message_hash}')
+                    if not variants:
+                        raise InvalidUserInputError("Варианты ответов не найдены")
+                    
+                    if variant_index < 0 or variant_index >= len(variants):
+                        raise InvalidUserInputError("Неверный индекс варианта")
+                    
+                    selected_variant = variants[variant_index]
+                    
+                    # Получаем данные об исходном сообщении для дополнительного контекста
+                    original_message_text = user_state.get('last_message_text_for_reply')
+                    
+                    # Увеличиваем счетчик успешно выбранных ответов
+                    selected_count = user_state.increment('stat_replies_selected')
                 
                 self.logger.log_user_activity(user_id, "reply_selected", {
                     "variant_index": variant_index + 1,  # Для логов используем 1-based индекс
@@ -648,6 +657,8 @@ class TelegramBot:
         """Запуск polling с обработкой ошибок"""
         try:
             self.logger.log_info("🚀 Запуск polling режима...")
+            self.snapshots.start()
+            sweeper.start()
             await self.bot.polling(non_stop=True)
         except Exception as e:
             error_result = self.error_handler.handle_error(e, {
@@ -661,6 +672,16 @@ class TelegramBot:
         try:
             self.logger.log_info("🛑 Остановка бота...")
             await self.bot.stop_polling()
+            await self.speculator.close()
+            self.logger.log_info(f"📈 Упреждающая генерация: {self.speculator.get_stats()}")
+            # Снимок до выгрузки кэша, пока L1 еще заполнен
+            await self.snapshots.close()
+            await sweeper.stop()
+            self.logger.log_info(f"🧹 Sweeper: {sweeper.get_stats()}")
+            # Дописываем буфер состояний в SQLite
+            await state_manager.close()
+            # Выгружаем отложенные записи кэша на диск/в Redis
+            await cache_service.close()
             self.logger.log_info("✅ Бот остановлен")
         except Exception as e:
             self.logger.log_error(f"❌ Ошибка остановки бота: {e}")
@@ -19,6 +19,7 @@ except ImportError:
 import aiohttp
 from config import config
 from enhanced_logging import BotLogger
+from app.core.tiered_cache import cache_service, make_cache_key
 
 logger = BotLogger(
     log_dir="logs",
@@ -51,9 +52,9 @@ class AIService:
         if not self.client:
             logger.log_info("🔄 Использую HTTP API fallback")
         
-        # Кэш ответов
-        self.response_cache = {}
-        self.cache_ttl = 300  # 5 минут
+        # Кэш ответов - пространство имен общего кэша (TTL 5 минут в конфигурации)
+        self.response_cache = cache_service.namespace("ai_response")
+        self._clear_task: Optional[asyncio.Task] = None
         
         # Статистика
         self.stats = {
@@ -78,7 +79,7 @@ class AIService:
         
         # Проверка кэша
         cache_key = self._get_cache_key(prompt, context)
-        cached_response = self._get_cached_response(cache_key)
+        cached_response = await self.response_cache.get(cache_key)
         if cached_response:
             self.stats["cache_hits"] += 1
             logger.log_info(f"💾 Возвращен кэшированный ответ")
@@ -95,7 +96,7 @@ class AIService:
                 response = await self._get_http_response(messages)
             
             # Кэширование
-            self._cache_response(cache_key, response)
+            await self.response_cache.set(cache_key, response)
             
             self.stats["successful_requests"] += 1
             logger.log_info(f"✅ AI ответ получен (длина: {len(response)})")
@@ -214,30 +215,15 @@ class AIService:
     def _get_cache_key(self, prompt: str, context: Optional[Dict] = None) -> str:
         """Генерация ключа кэша"""
         context_str = json.dumps(context, sort_keys=True) if context else ""
-        return f"{hash(prompt + context_str)}"
+        return make_cache_key(prompt, context_str)
     
     def _get_cached_response(self, cache_key: str) -> Optional[str]:
-        """Получение из кэша"""
-        if cache_key in self.response_cache:
-            cached_time, response = self.response_cache[cache_key]
-            if (datetime.now().timestamp() - cached_time) < self.cache_ttl:
-                return response
-            else:
-                del self.response_cache[cache_key]
-        return None
+        """Получение из кэша (только L1, без ожидания)"""
+        return self.response_cache.get_nowait(cache_key)
     
     def _cache_response(self, cache_key: str, response: str):
-        """Кэширование ответа"""
-        self.response_cache[cache_key] = (datetime.now().timestamp(), response)
-        
-        # Очистка старого кэша
-        current_time = datetime.now().timestamp()
-        expired_keys = [
-            key for key, (cached_time, _) in self.response_cache.items()
-            if (current_time - cached_time) > self.cache_ttl
-        ]
-        for key in expired_keys:
-            del self.response_cache[key]
+        """Кэширование ответа (L1 сразу, нижние уровни - отложенно)"""
+        self.response_cache.set_nowait(cache_key, response)
     
     def _get_fallback_response(self, prompt: str, context: Optional[Dict] = None) -> str:
         """Fallback ответ при ошибках"""
@@ -261,7 +247,14 @@ class AIService:
     
     def clear_cache(self):
         """Очистка кэша"""
-        self.response_cache.clear()
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Нет цикла событий: очищаем все уровни сразу
+            asyncio.run(self.response_cache.clear())
+        else:
+            # Внутри цикла событий: очистка нижних уровней идет в фоне
+            self._clear_task = loop.create_task(self.response_cache.clear())
         logger.log_info("🗑️ Кэш очищен")
 
 # Глобальный экземпляр
@@ -292,4 +292,458 @@ async def test_memory_cache_edge_cases(memory_cache):
     await memory_cache.set("zero_ttl_key", "zero_ttl_value", ttl=0)
     await asyncio.sleep(0.01)  # Небольшая задержка
     value = await memory_cache.get("zero_ttl_key")
-    assert value is None 
\ No newline at end of file
+    assert value is None 
+
+# === Тесты реального app.core.cache.MemoryCache ===
+
+from app.core.cache import MemoryCache as CoreMemoryCache, MemoryBudget
+from app.core.tinylfu import CountMinSketch, TinyLFU
+from app.core.timing_wheel import TimingWheel
+
+
+class FakeClock:
+    """Управляемые часы для детерминированных тестов TTL"""
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+@pytest.mark.asyncio
+async def test_core_memory_cache_lru_eviction():
+    """Тест O(1) LRU вытеснения в реальном MemoryCache"""
+    cache = CoreMemoryCache(max_size=3, default_ttl=60)
+    for i in range(3):
+        await cache.set(f"key_{i}", i)
+
+    # key_0 становится недавно использованным
+    assert await cache.get("key_0") == 0
+    await cache.set("key_3", 3)
+
+    assert await cache.get("key_1") is None
+    assert await cache.get("key_0") == 0
+    assert await cache.get("key_3") == 3
+    assert len(cache._cache) == 3
+
+
+@pytest.mark.asyncio
+async def test_core_memory_cache_ttl_with_timing_wheel():
+    """Тест истечения TTL через колесо таймеров"""
+    clock = FakeClock()
+    cache = CoreMemoryCache(max_size=100, clock=clock)
+    await cache.set("short", "a", ttl_seconds=5)
+    await cache.set("long", "b", ttl_seconds=500)
+    await cache.set("forever", "c", ttl_seconds=0)
+
+    clock.advance(6)
+    assert await cache.get("short") is None
+    assert await cache.get("long") == "b"
+
+    # Истечение без обращения к ключу - через cleanup_expired
+    clock.advance(600)
+    await cache.cleanup_expired()
+    assert "long" not in cache._cache
+    assert await cache.get("forever") == "c"
+    assert len(cache._expiry) == 0
+
+
+@pytest.mark.asyncio
+async def test_core_memory_cache_overwrite_reschedules_ttl():
+    """Тест перепланирования TTL при перезаписи ключа"""
+    clock = FakeClock()
+    cache = CoreMemoryCache(max_size=10, clock=clock)
+    await cache.set("key", "old", ttl_seconds=5)
+    clock.advance(4)
+    await cache.set("key", "new", ttl_seconds=50)
+    clock.advance(10)
+    await cache.cleanup_expired()
+    assert await cache.get("key") == "new"
+
+
+@pytest.mark.asyncio
+async def test_core_memory_cache_byte_accounting():
+    """Тест учета объема записей в байтах"""
+    cache = CoreMemoryCache(max_size=None, default_ttl=60)
+    await cache.set("small", "x")
+    small = cache.bytes_used
+    await cache.set("large", ["длинный вариант ответа " * 20] * 3)
+    assert cache.bytes_used - small > 10 * small
+
+    # Перезапись и удаление корректируют счетчик
+    await cache.set("large", "y")
+    assert cache.bytes_used < 3 * small
+    await cache.delete("large")
+    await cache.delete("small")
+    assert cache.bytes_used == 0
+
+
+@pytest.mark.asyncio
+async def test_core_memory_cache_max_bytes_eviction():
+    """Тест вытеснения по объему вместо количества элементов"""
+    cache = CoreMemoryCache(max_size=None, default_ttl=60, max_bytes=4000)
+    for i in range(100):
+        await cache.set(f"key_{i}", "v" * 100)
+    assert cache.bytes_used <= 4000
+    assert cache.evictions > 0
+    assert await cache.get("key_99") is not None
+    assert await cache.get("key_0") is None
+
+    # Значение больше лимита не кэшируется
+    await cache.set("huge", "x" * 10000)
+    assert await cache.get("huge") is None
+    stats = await cache.get_stats()
+    assert stats["bytes"] == cache.bytes_used
+
+
+@pytest.mark.asyncio
+async def test_memory_budget_weighted_eviction():
+    """Тест общего бюджета: доли памяти пропорциональны весам"""
+    budget = MemoryBudget(max_bytes=60000)
+    heavy = CoreMemoryCache(max_size=None, default_ttl=60, budget=budget, name="heavy", weight=2.0)
+    light = CoreMemoryCache(max_size=None, default_ttl=60, budget=budget, name="light", weight=1.0)
+    for i in range(1000):
+        await heavy.set(f"h{i}", "h" * 200)
+        await light.set(f"l{i}", "l" * 200)
+
+    assert budget.used_bytes == heavy.bytes_used + light.bytes_used
+    assert budget.used_bytes <= 60000
+    ratio = heavy.bytes_used / light.bytes_used
+    assert 1.8 < ratio < 2.2
+    assert budget.usage() == {"heavy": heavy.bytes_used, "light": light.bytes_used}
+
+    await heavy.clear()
+    assert budget.used_bytes == light.bytes_used
+
+
+
+def test_count_min_sketch_estimates_and_ages():
+    """Тест count-min скетча: оценка частоты, насыщение и старение"""
+    sketch = CountMinSketch(width=1024, sample_size=200)
+    for _ in range(20):
+        sketch.add("hot")
+    sketch.add("cold")
+
+    assert sketch.estimate("hot") == 15  # счетчики насыщаются
+    assert sketch.estimate("cold") >= 1
+    assert sketch.estimate("missing") == 0
+
+    for i in range(200):
+        sketch.add(f"noise{i}")
+    assert sketch.resets == 1
+    assert sketch.estimate("hot") == 7
+
+
+@pytest.mark.asyncio
+async def test_tinylfu_keeps_hot_keys_during_scan():
+    """Тест W-TinyLFU: поток разовых ключей не вымывает популярные"""
+    cache = CoreMemoryCache(max_size=100, default_ttl=60,
+                            admission=TinyLFU(sketch_width=4096, window_ratio=0.05))
+    for _ in range(5):
+        for i in range(50):
+            await cache.set(f"hot{i}", i)
+            await cache.get(f"hot{i}")
+
+    for i in range(1000):
+        await cache.get(f"once{i}")
+        await cache.set(f"once{i}", i)
+
+    assert len(cache) == 100
+    assert all([await cache.get(f"hot{i}") == i for i in range(50)])
+    stats = await cache.get_stats()
+    assert stats["admission"]["rejected"] > 0
+    assert stats["admission"]["window_items"] == 5
+
+
+@pytest.mark.asyncio
+async def test_tinylfu_admits_recurring_new_key():
+    """Тест W-TinyLFU: новый ключ, к которому часто обращаются, вытесняет редкий"""
+    cache = CoreMemoryCache(max_size=10, default_ttl=60,
+                            admission=TinyLFU(sketch_width=1024, window_ratio=0.1))
+    for i in range(10):
+        await cache.set(f"old{i}", i)
+
+    for i in range(5):
+        await cache.get("new")
+    await cache.set("new", "value")
+    await cache.set("filler", 0)  # вытесняет "new" из окна в основную область
+
+    assert await cache.get("new") == "value"
+    assert len(cache) == 10
+
+
+@pytest.mark.asyncio
+async def test_tinylfu_counts_miss_and_insert_once():
+    """Тест W-TinyLFU: промах с последующей вставкой - одно обращение в скетче"""
+    admission = TinyLFU(sketch_width=1024)
+    cache = CoreMemoryCache(max_size=10, default_ttl=60, admission=admission)
+    assert await cache.get("key") is None
+    await cache.set("key", "value")
+    assert admission.sketch.estimate("key") == 1
+
+
+@pytest.mark.asyncio
+async def test_tinylfu_with_memory_budget():
+    """Тест W-TinyLFU совместно с общим бюджетом памяти"""
+    budget = MemoryBudget(max_bytes=20000)
+    cache = CoreMemoryCache(max_size=None, default_ttl=60, budget=budget, name="reply",
+                            admission=TinyLFU(sketch_width=1024))
+    for i in range(500):
+        await cache.set(f"k{i}", "x" * 100)
+
+    assert budget.used_bytes == cache.bytes_used <= 20000
+    assert len(cache) > 0
+
+def test_timing_wheel_cascades_levels():
+    """Тест каскадирования ключей со старших уровней колеса"""
+    clock = FakeClock(0.0)
+    wheel = TimingWheel(tick=1.0, slots=8, levels=3, clock=clock)
+    wheel.schedule("near", 3.5)
+    wheel.schedule("mid", 20.0)
+    wheel.schedule("far", 300.0)  # верхний уровень колеса
+
+    assert wheel.advance(3.0) == []
+    assert wheel.advance(4.0) == ["near"]
+    assert wheel.advance(19.9) == []
+    assert wheel.advance(20.0) == ["mid"]
+    wheel.cancel("far")
+    assert wheel.advance(1000.0) == []
+    assert len(wheel) == 0
+
+
+def test_timing_wheel_limit_is_hard():
+    """Тест: limit соблюдается и внутри одного слота, остаток приходит следующим вызовом"""
+    clock = FakeClock(0.0)
+    wheel = TimingWheel(tick=1.0, slots=8, levels=3, clock=clock)
+    for i in range(10):
+        wheel.schedule(f"k{i}", 2.0)
+    wheel.schedule("late", 5.0)
+
+    batches = [wheel.advance(6.0, limit=3) for _ in range(4)]
+    assert [len(batch) for batch in batches] == [3, 3, 3, 2]
+    assert sorted(sum(batches, [])) == sorted([f"k{i}" for i in range(10)] + ["late"])
+    assert len(wheel) == 0 and wheel.advance(6.0, limit=3) == []
+
+
+# === Тесты FileCache ===
+
+from app.core.cache import FileCache
+from app.core.error_handler import CacheError
+
+
+@pytest.mark.asyncio
+async def test_file_cache_survives_restart(tmp_path):
+    """Тест теплого перезапуска: значения читаются из журнала"""
+    cache = FileCache(path=str(tmp_path), default_ttl=3600)
+    await cache.set("reply:1", ["Привет! 😊", "Как дела?", "Рада тебя видеть"])
+    await cache.set("ppv:10", "Эксклюзив за $10")
+    await cache.delete("ppv:10")
+    cache.close()
+
+    restarted = FileCache(path=str(tmp_path), default_ttl=3600)
+    assert await restarted.get("reply:1") == ["Привет! 😊", "Как дела?", "Рада тебя видеть"]
+    assert await restarted.get("ppv:10") is None
+    restarted.close()
+
+
+@pytest.mark.asyncio
+async def test_file_cache_ttl(tmp_path):
+    """Тест истечения TTL, в том числе после перезапуска"""
+    clock = FakeClock(1_700_000_000.0)
+    cache = FileCache(path=str(tmp_path), clock=clock)
+    await cache.set("short", "a", ttl_seconds=10)
+    await cache.set("long", "b", ttl_seconds=1000)
+    cache.close()
+
+    clock.advance(20)
+    restarted = FileCache(path=str(tmp_path), clock=clock)
+    assert await restarted.get("short") is None
+    assert await restarted.get("long") == "b"
+    restarted.close()
+
+
+@pytest.mark.asyncio
+async def test_file_cache_discards_torn_tail(tmp_path):
+    """Тест восстановления после оборванной записи"""
+    cache = FileCache(path=str(tmp_path))
+    await cache.set("ok", "value")
+    await cache.set("torn", "x" * 100)
+    cache.close()
+
+    segment = sorted(tmp_path.glob("*.seg"))[-1]
+    data = segment.read_bytes()
+    segment.write_bytes(data[:-30])  # имитация сбоя посреди записи
+
+    restarted = FileCache(path=str(tmp_path))
+    assert await restarted.get("ok") == "value"
+    assert await restarted.get("torn") is None
+    # Новые записи дописываются после отрезанного хвоста
+    await restarted.set("after", 1)
+    restarted.close()
+    assert await FileCache(path=str(tmp_path)).get("after") == 1
+
+
+@pytest.mark.asyncio
+async def test_file_cache_concurrent_writes_with_fsync_and_compaction(tmp_path):
+    """Тест: конкурентные записи при fsync и компактификации в отдельном потоке"""
+    cache = FileCache(path=str(tmp_path), segment_size=1024, compaction_ratio=0.3, fsync=True)
+
+    async def writer(worker: int):
+        for i in range(30):
+            await cache.set(f"k{worker}", f"value_{worker}_{i}")
+            assert await cache.get(f"k{worker}") is not None
+
+    await asyncio.gather(*(writer(worker) for worker in range(5)))
+    stats = await cache.get_stats()
+    assert stats["total_items"] == 5
+    assert stats["total_bytes"] < 30 * 5 * 40  # мертвые записи удалялись
+    cache.close()
+
+    restarted = FileCache(path=str(tmp_path))
+    assert [await restarted.get(f"k{worker}") for worker in range(5)] == \
+        [f"value_{worker}_29" for worker in range(5)]
+    restarted.close()
+
+
+@pytest.mark.asyncio
+async def test_file_cache_clear_survives_crash(tmp_path):
+    """Тест: сбой посреди clear не возвращает очищенные записи"""
+    cache = FileCache(path=str(tmp_path))
+    await cache.set("reply:1", "a")
+
+    def crash():
+        raise OSError("сбой при открытии сегмента")
+
+    cache._open_active = crash
+    with pytest.raises(OSError):
+        await cache.clear()
+    cache.close()
+
+    restarted = FileCache(path=str(tmp_path))
+    assert await restarted.get("reply:1") is None
+    restarted.close()
+
+
+def test_file_cache_removes_only_own_temp_files(tmp_path):
+    """Тест: при старте удаляются только недописанные сегменты компактификации"""
+    (tmp_path / "00000007.tmp").write_bytes(b"partial")
+    (tmp_path / "snapshot.bin.tmp").write_bytes(b"foreign")
+    FileCache(path=str(tmp_path)).close()
+    assert not (tmp_path / "00000007.tmp").exists()
+    assert (tmp_path / "snapshot.bin.tmp").read_bytes() == b"foreign"
+
+
+def test_file_cache_directory_is_exclusive(tmp_path):
+    """Тест: каталог файлового кэша не открывается вторым экземпляром"""
+    cache = FileCache(path=str(tmp_path))
+    with pytest.raises(CacheError):
+        FileCache(path=str(tmp_path))
+    cache.close()
+    FileCache(path=str(tmp_path)).close()
+
+
+@pytest.mark.asyncio
+async def test_file_cache_compaction(tmp_path):
+    """Тест компактификации: мертвые и истекшие записи удаляются"""
+    clock = FakeClock(1_700_000_000.0)
+    cache = FileCache(path=str(tmp_path), segment_size=512, compaction_ratio=0.5, clock=clock)
+    await cache.set("expiring", "e", ttl_seconds=5)
+    for i in range(50):
+        await cache.set("hot", f"value_{i}")
+    await cache.set("keep", "k")
+
+    clock.advance(10)
+    await cache.compact()
+    stats = await cache.get_stats()
+    assert stats["total_items"] == 2
+    assert stats["dead_bytes"] == 0
+    assert await cache.get("hot") == "value_49"
+    assert await cache.get("keep") == "k"
+    assert await cache.get("expiring") is None
+    cache.close()
+
+    restarted = FileCache(path=str(tmp_path), clock=clock)
+    assert await restarted.get("hot") == "value_49"
+    assert (await restarted.get_stats())["total_items"] == 2
+    restarted.close()
+
+
+# === Тесты RedisCache (fakeredis) ===
+
+import pickle
+from app.core.cache import RedisCache
+from app.core.config import RedisConfig
+
+
+@pytest.fixture
+def redis_cache():
+    """RedisCache поверх fakeredis"""
+    fakeredis = pytest.importorskip("fakeredis")
+    return RedisCache(client=fakeredis.aioredis.FakeRedis(), default_ttl=3600, secret="test-secret")
+
+
+@pytest.mark.asyncio
+async def test_redis_cache_basic_operations(redis_cache):
+    """Тест get/set/delete с бинарной сериализацией"""
+    await redis_cache.set("reply:1", ["a", "b", "c"])
+    assert await redis_cache.get("reply:1") == ["a", "b", "c"]
+    await redis_cache.delete("reply:1")
+    assert await redis_cache.get("reply:1") is None
+
+
+@pytest.mark.asyncio
+async def test_redis_cache_ttl_maps_to_ex(redis_cache):
+    """Тест передачи TTL как EX"""
+    await redis_cache.set("ttl_key", "value", ttl_seconds=120)
+    await redis_cache.set("no_ttl_key", "value", ttl_seconds=0)
+    assert 0 < await redis_cache._client.ttl("ofbot:ttl_key") <= 120
+    assert await redis_cache._client.ttl("ofbot:no_ttl_key") == -1
+    value, remaining = await redis_cache.get_with_ttl("ttl_key")
+    assert value == "value" and 0 < remaining <= 120
+    assert await redis_cache.get_with_ttl("no_ttl_key") == ("value", None)
+
+
+@pytest.mark.asyncio
+async def test_redis_cache_bulk_operations(redis_cache):
+    """Тест конвейерных set_many/get_many"""
+    items = {f"key_{i}": {"variants": [str(i)]} for i in range(20)}
+    await redis_cache.set_many(items, ttl_seconds=60)
+    result = await redis_cache.get_many(list(items) + ["missing"])
+    assert result == items
+
+    await redis_cache.clear()
+    assert await redis_cache.get_many(list(items)) == {}
+
+
+@pytest.mark.asyncio
+async def test_redis_cache_delete_prefix(redis_cache):
+    """Тест удаления ключей одного пространства имен"""
+    await redis_cache.set_many({"reply:1": "a", "reply:2": "b", "ppv:1": "c"}, ttl_seconds=60)
+    assert await redis_cache.delete_prefix("reply:") == 2
+    assert await redis_cache.get_many(["reply:1", "reply:2", "ppv:1"]) == {"ppv:1": "c"}
+
+
+@pytest.mark.asyncio
+async def test_redis_cache_rejects_unsigned_values(redis_cache):
+    """Тест: значение без верной подписи не распаковывается"""
+    await redis_cache._client.set("ofbot:forged", pickle.dumps(["evil"]))
+    assert await redis_cache.get("forged") is None
+
+    await redis_cache.set("signed", ["ok"])
+    raw = await redis_cache._client.get("ofbot:signed")
+    await redis_cache._client.set("ofbot:signed", raw[:-1] + b"\x00")
+    assert await redis_cache.get("signed") is None
+
+
+def test_redis_cache_requires_secret():
+    """Тест: без ключа подписи Redis-кэш не создается"""
+    with pytest.raises(CacheError):
+        RedisCache(RedisConfig(url="redis://localhost:6379"), client=object())
+    cache = RedisCache(RedisConfig(url="redis://localhost:6379", secret="s"), client=object())
+    assert cache._loads(cache._dumps({"a": 1})) == {"a": 1}
+    assert cache._loads(b"x" * 40) is None
+
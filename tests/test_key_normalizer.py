@@ -0,0 +1,51 @@
+"""
+Тесты нормализации текста для ключей кэша
+"""
+
+import pytest
+
+from app.core import key_normalizer
+from app.core.key_normalizer import TextNormalizer, normalize_text, set_key_normalizer
+from app.core.tiered_cache import make_text_key
+
+
+@pytest.fixture
+def normalizer():
+    return TextNormalizer(stop_words=["Ну", "пожалуйста"])
+
+
+def test_variants_collapse_to_one_form(normalizer):
+    """Тест: регистр, пробелы, пунктуация и эмодзи не влияют на ключ"""
+    variants = ["Привет!", "привет", "Привет  !", "  ПРИВЕТ!!! 😘", "Привет…\n"]
+    assert {normalizer(text) for text in variants} == {"привет"}
+
+
+def test_nfkc_and_casefold(normalizer):
+    """Тест Unicode NFKC и casefold"""
+    assert normalizer("ｈｅｌｌｏ") == "hello"
+    assert normalizer("Straße") == normalizer("STRASSE")
+
+
+def test_stop_words_are_normalized(normalizer):
+    """Тест стоп-листа: стоп-слова проходят ту же нормализацию"""
+    assert normalizer("Ну, покажи фото, пожалуйста!") == "покажи фото"
+    assert normalizer("НУ покажи фото") == "покажи фото"
+
+
+def test_emoji_only_messages_stay_distinct():
+    """Тест: сообщения из одних эмодзи не сливаются в один ключ"""
+    assert normalize_text("😘") != normalize_text("🔥")
+    assert make_text_key("😘", "friendly") != make_text_key("🔥", "friendly")
+
+
+def test_key_normalizer_is_pluggable():
+    """Тест замены нормализатора"""
+    previous = key_normalizer.get_key_normalizer()
+    try:
+        set_key_normalizer(None)
+        assert make_text_key("Привет!", "friendly") != make_text_key("привет", "friendly")
+        set_key_normalizer(str.upper)
+        assert normalize_text("привет") == "ПРИВЕТ"
+    finally:
+        set_key_normalizer(previous)
+    assert make_text_key("Привет!", "friendly") == make_text_key("привет", "friendly")
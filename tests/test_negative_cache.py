@@ -0,0 +1,95 @@
+"""
+Тесты негативного кэша ошибок провайдеров
+"""
+
+import pytest
+
+from app.core.negative_cache import NegativeCache, get_negative_cache
+from app.core.config import CacheConfig
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_negative_cache(clock, **overrides):
+    params = {"negative_ttl": 5.0, "negative_max_ttl": 40.0,
+              "negative_provider_threshold": 3, "negative_max_entries": 100}
+    params.update(overrides)
+    return NegativeCache("groq", CacheConfig(**params), clock=clock, jitter=0)
+
+
+def test_failure_blocks_key_for_base_ttl():
+    """Тест: после ошибки ключ заблокирован на базовый TTL"""
+    clock = FakeClock()
+    failures = make_negative_cache(clock)
+
+    assert not failures.is_blocked("reply:a")
+    assert failures.record_failure("reply:a") == 5.0
+    assert failures.is_blocked("reply:a")
+    assert not failures.is_blocked("reply:b")
+
+    clock.now += 5.1
+    assert not failures.is_blocked("reply:a")
+
+
+def test_repeated_failures_grow_ttl_up_to_cap():
+    """Тест: повторные ошибки удваивают срок блокировки до максимума"""
+    clock = FakeClock()
+    failures = make_negative_cache(clock, negative_provider_threshold=100)
+
+    ttls = []
+    for _ in range(6):
+        ttls.append(failures.record_failure("reply:a"))
+        clock.now += ttls[-1] + 1
+    assert ttls == [5.0, 10.0, 20.0, 40.0, 40.0, 40.0]
+
+
+def test_success_resets_backoff():
+    """Тест: успешный ответ снимает блокировку и сбрасывает счетчик"""
+    clock = FakeClock()
+    failures = make_negative_cache(clock)
+    failures.record_failure("reply:a")
+    failures.record_failure("reply:a")
+
+    failures.record_success("reply:a")
+    assert not failures.is_blocked("reply:a")
+    assert failures.record_failure("reply:a") == 5.0
+
+
+def test_consecutive_failures_block_provider():
+    """Тест: серия ошибок по разным ключам блокирует весь провайдер"""
+    clock = FakeClock()
+    failures = make_negative_cache(clock)
+    for key in ("reply:a", "reply:b", "ppv:c"):
+        failures.record_failure(key)
+
+    assert failures.is_blocked("hot:new")
+    stats = failures.get_stats()
+    assert stats["consecutive_failures"] == 3
+    assert stats["provider_blocked_for"] == 5.0
+    assert stats["short_circuits"] == 1
+
+    failures.record_success("reply:a")
+    assert not failures.is_blocked("hot:new")
+
+
+def test_failure_memory_expires():
+    """Тест: запись об ошибке забывается после окна памяти"""
+    clock = FakeClock()
+    failures = make_negative_cache(clock, negative_provider_threshold=100)
+    failures.record_failure("reply:a")
+
+    clock.now += 5.0 + 40.0 + 1
+    assert failures.record_failure("reply:a") == 5.0
+    assert failures.get_stats()["tracked_keys"] == 1
+
+
+def test_registry_shares_instance_per_provider():
+    """Тест: один негативный кэш на провайдера"""
+    assert get_negative_cache("groq") is get_negative_cache("groq")
+    assert get_negative_cache("groq") is not get_negative_cache("deepseek")
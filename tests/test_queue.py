@@ -5,7 +5,7 @@
 import pytest
 import asyncio
 from datetime import datetime
-from app.core.queue import TaskQueue, TaskManager, TaskStatus, TaskPriority
+from app.core.queue import TaskQueue, TaskManager, TaskStatus, TaskPriority, TaskSummary
 
 @pytest.fixture
 async def queue():
@@ -41,7 +41,7 @@ async def test_task_execution(queue):
     task_id = await queue.add_task(test_func)
     await asyncio.sleep(0.1)  # Даем время на выполнение
     
-    task = queue.tasks[task_id]
+    task = await queue.get_task_status(task_id)
     assert task.status == TaskStatus.COMPLETED
     assert task.result == "test"
     assert result == "test"
@@ -83,7 +83,7 @@ async def test_task_retry(queue):
     
     await asyncio.sleep(0.5)  # Даем время на выполнение
     
-    task = queue.tasks[task_id]
+    task = await queue.get_task_status(task_id)
     assert task.status == TaskStatus.COMPLETED
     assert task.result == "success"
     assert attempts == 3
@@ -101,7 +101,7 @@ async def test_task_timeout(queue):
     
     await asyncio.sleep(0.2)  # Даем время на выполнение
     
-    task = queue.tasks[task_id]
+    task = await queue.get_task_status(task_id)
     assert task.status == TaskStatus.FAILED
     assert isinstance(task.error, asyncio.TimeoutError)
     
@@ -115,7 +115,7 @@ async def test_task_cancellation(queue):
     success = await queue.cancel_task(task_id)
     
     assert success
-    assert queue.tasks[task_id].status == TaskStatus.CANCELLED
+    assert (await queue.get_task_status(task_id)).status == TaskStatus.CANCELLED
     
 async def test_queue_stats(queue):
     """Тест статистики очереди"""
@@ -173,7 +173,7 @@ async def test_concurrent_tasks(queue):
     
     # Проверяем, что все задачи выполнены
     for task_id in tasks:
-        task = queue.tasks[task_id]
+        task = await queue.get_task_status(task_id)
         assert task.status == TaskStatus.COMPLETED
         
     # Проверяем, что все результаты получены
@@ -209,7 +209,170 @@ async def test_worker_error_handling(queue):
     await asyncio.sleep(0.2)  # Даем время на выполнение
     
     # Проверяем, что ошибка обработана
-    task = queue.tasks[task_id]
+    task = await queue.get_task_status(task_id)
     assert task.status == TaskStatus.FAILED
     assert isinstance(task.error, ValueError)
-    assert error_count == 1  # Только одна попытка выполнения 
\ No newline at end of file
+    assert error_count == 1  # Только одна попытка выполнения 
+
+@pytest.mark.asyncio
+async def test_priority_dispatch_without_polling():
+    """Тест: свободный воркер сразу получает задачу с наивысшим приоритетом"""
+    queue = TaskQueue(max_workers=1)
+    await queue.start()
+    order = []
+    gate = asyncio.Event()
+
+    async def blocker():
+        await gate.wait()
+
+    async def record(value):
+        order.append(value)
+
+    await queue.add_task(blocker)
+    await asyncio.sleep(0)  # единственный воркер занят
+    for value, priority in [("low", TaskPriority.LOW), ("normal", TaskPriority.NORMAL),
+                            ("critical", TaskPriority.CRITICAL), ("high", TaskPriority.HIGH),
+                            ("low2", TaskPriority.LOW)]:
+        await queue.add_task(record, value, priority=priority)
+    assert (await queue.get_queue_stats())["queues"]["LOW"] == 2
+
+    gate.set()
+    # Опрос с таймаутом 0.1 с на очередь не уложился бы в это время
+    await asyncio.sleep(0.01)
+    assert order == ["critical", "high", "normal", "low", "low2"]
+    await queue.stop()
+    assert queue.workers == []
+
+
+@pytest.mark.asyncio
+async def test_retry_backoff_does_not_hold_workers():
+    """Тест: ожидание повтора не занимает воркер"""
+    queue = TaskQueue(max_workers=1, retry_jitter=0)
+    await queue.start()
+    done = []
+
+    async def failing():
+        raise ValueError("Groq недоступен")
+
+    async def healthy():
+        done.append(True)
+
+    failed_id = await queue.add_task(failing, max_retries=2, retry_delay=0.2)
+    await asyncio.sleep(0.01)
+    assert queue.tasks[failed_id].status == TaskStatus.RETRYING
+    assert (await queue.get_queue_stats())["delayed"] == 1
+
+    # Единственный воркер свободен, пока упавшая задача ждет повтора
+    await queue.add_task(healthy)
+    await asyncio.sleep(0.01)
+    assert done == [True]
+
+    # Задержки 0.2 и 0.4 с: экспоненциальный рост
+    await asyncio.sleep(0.25)
+    assert queue.tasks[failed_id].retry_count == 2
+    assert queue.tasks[failed_id].status == TaskStatus.RETRYING
+    await asyncio.sleep(0.45)
+    assert (await queue.get_task_status(failed_id)).status == TaskStatus.FAILED
+    await queue.stop()
+
+
+@pytest.mark.asyncio
+async def test_stop_cancels_delayed_retries():
+    """Тест: задачи, ждущие повтора, завершаются при остановке и не занимают место"""
+    queue = TaskQueue(max_workers=1, max_queue_size=1, retry_jitter=0)
+    await queue.start()
+
+    async def failing():
+        raise ValueError("Groq недоступен")
+
+    task_id = await queue.add_task(failing, max_retries=2, retry_delay=10)
+    await asyncio.sleep(0.01)
+    assert queue.tasks[task_id].status == TaskStatus.RETRYING
+
+    await queue.stop()
+    assert queue.tasks == {}
+    assert (await queue.get_queue_stats())["delayed"] == 0
+    summary = await queue.get_task_status(task_id)
+    assert summary.status == TaskStatus.CANCELLED and summary.retry_count == 1
+
+    # После перезапуска место в очереди свободно
+    await queue.start()
+    await queue.add_task(asyncio.sleep, 0)
+    await queue.stop()
+
+
+@pytest.mark.asyncio
+async def test_finished_tasks_are_pruned_from_admission():
+    """Тест: завершенные задачи не занимают место в очереди, итоги ограничены"""
+    queue = TaskQueue(max_workers=2, max_queue_size=5, result_limit=3, result_ttl=0.2)
+    await queue.start()
+
+    async def test_func(value):
+        return value
+
+    task_ids = [await queue.add_task(test_func, i) for i in range(5)]
+    await asyncio.sleep(0.01)
+    # Все пять выполнены: место освободилось, хранятся итоги трех последних
+    assert queue.tasks == {}
+    await queue.add_task(test_func, 5)
+    assert await queue.get_task_status(task_ids[0]) is None
+    summary = await queue.get_task_status(task_ids[4])
+    assert isinstance(summary, TaskSummary)
+    assert summary.status == TaskStatus.COMPLETED and summary.result == 4
+
+    await asyncio.sleep(0.25)
+    assert await queue.get_task_status(task_ids[4]) is None
+    assert (await queue.get_queue_stats())["finished_tasks"] == 0
+    await queue.stop()
+
+
+@pytest.mark.asyncio
+async def test_fair_queuing_across_users():
+    """Тест: поток задач одного пользователя не задерживает остальных"""
+    queue = TaskQueue(max_workers=1, weights={"vip": 2})
+    await queue.start()
+    order = []
+    gate = asyncio.Event()
+
+    async def blocker():
+        await gate.wait()
+
+    async def record(value):
+        order.append(value)
+
+    await queue.add_task(blocker)
+    await asyncio.sleep(0)
+    for i in range(4):
+        await queue.add_task(record, f"heavy{i}", fair_key="heavy")
+    for key in ("light", "vip", "vip", "vip"):
+        await queue.add_task(record, key, fair_key=key)
+    assert (await queue.get_queue_stats())["fair_flows"] == 3
+
+    gate.set()
+    await asyncio.sleep(0.01)
+    assert order == ["heavy0", "light", "vip", "vip", "heavy1", "vip", "heavy2", "heavy3"]
+    await queue.stop()
+
+
+@pytest.mark.asyncio
+async def test_worker_pool_autoscaling():
+    """Тест: пул растет под очередью и сокращается после простоя"""
+    queue = TaskQueue(max_workers=8, min_workers=1, scale_interval=0.02, scale_down_delay=0.06)
+    await queue.start()
+    assert queue.pool_size == 1
+
+    async def ai_call():
+        await asyncio.sleep(0.02)
+
+    for _ in range(40):
+        await queue.add_task(ai_call)
+    await asyncio.sleep(0.05)
+    assert queue.pool_size > 1
+    peak = queue.pool_size
+
+    await asyncio.sleep(0.5)  # очередь разобрана, цель держится ниже пула
+    stats = await queue.get_queue_stats()
+    assert stats["total_tasks"] == 0
+    assert stats["pool_size"] == 1 < peak
+    assert len(queue.workers) == 1
+    await queue.stop()
@@ -0,0 +1,71 @@
+"""
+Тесты индекса почти-дубликатов и кэша по похожим сообщениям
+"""
+
+import pytest
+
+from app.core.similarity_index import NearDuplicateIndex, NearDuplicateCache
+from app.core.tiered_cache import TieredCache, make_text_key
+from app.core.config import CacheConfig
+
+
+@pytest.fixture
+def index():
+    return NearDuplicateIndex(threshold=0.8)
+
+
+def test_signature_similarity(index):
+    """Тест оценки сходства сигнатур"""
+    base = index.signature("Привет, как у тебя дела?")
+    assert index.similarity(base, index.signature("привет как у тебя дела")) == 1.0
+    assert index.similarity(base, index.signature("Привет, как у тебя дела сегодня?")) >= 0.8
+    assert index.similarity(base, index.signature("Сколько стоит видео?")) < 0.3
+    # Слишком короткие тексты не индексируются
+    assert index.signature("да") is None
+
+
+def test_lookup_finds_paraphrase(index):
+    """Тест поиска перефразированного сообщения"""
+    index.add("Привет, как у тебя дела?", "greeting")
+    index.add("Сколько стоит твое новое видео?", "price")
+
+    key, score = index.lookup("Привет, как у тебя дела сегодня?")
+    assert key == "greeting" and score >= 0.8
+    assert index.lookup("Покажи мне новые фото") is None
+    # Порог можно ужесточить для отдельного запроса
+    assert index.lookup("Привет, как у тебя дела сегодня?", threshold=0.99) is None
+
+
+def test_remove_and_capacity():
+    """Тест удаления и ограничения размера индекса"""
+    index = NearDuplicateIndex(max_entries=2)
+    index.add("первое длинное сообщение", "a")
+    index.add("второе длинное сообщение", "b")
+    index.add("третье длинное сообщение", "c")
+    assert len(index) == 2 and "a" not in index
+
+    index.remove("b")
+    assert "b" not in index
+    assert all(all("b" not in bucket for bucket in table.values()) for table in index._tables)
+
+
+@pytest.mark.asyncio
+async def test_near_duplicate_cache_per_style():
+    """Тест кэша по похожим сообщениям с отдельным индексом на стиль"""
+    cache = TieredCache(CacheConfig(file_enabled=False, redis_enabled=False, write_back_interval=0))
+    replies = cache.namespace("reply")
+    similar = NearDuplicateCache(replies, threshold=0.8, enabled=True)
+
+    key = make_text_key("Привет, как у тебя дела?", "friendly")
+    await replies.set(key, ["вариант 1", "вариант 2", "вариант 3"])
+    similar.add("Привет, как у тебя дела?", "friendly", key)
+
+    assert await similar.get("Привет, как у тебя дела сегодня?", "friendly") == ["вариант 1", "вариант 2", "вариант 3"]
+    assert await similar.get("Привет, как у тебя дела сегодня?", "flirty") is None
+
+    # Вытесненное значение убирается из индекса
+    await replies.delete(key)
+    assert await similar.get("Привет, как у тебя дела сегодня?", "friendly") is None
+    stats = similar.get_stats()
+    assert stats["near_hits"] == 1 and stats["stale"] == 1
+    assert stats["entries"]["friendly"] == 0
@@ -0,0 +1,109 @@
+"""
+Тесты объединения одинаковых одновременных запросов (single-flight)
+"""
+
+import asyncio
+import pytest
+
+from app.core.single_flight import SingleFlight
+from app.core.tiered_cache import TieredCache
+from app.core.config import CacheConfig
+
+
+class SlowLoader:
+    """Загрузчик, который ждет сигнала и считает вызовы"""
+
+    def __init__(self, result="variants"):
+        self.calls = 0
+        self.release = asyncio.Event()
+        self.result = result
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_share_one_load():
+    """Тест: одновременные вызовы ждут один загрузчик"""
+    flights = SingleFlight()
+    loader = SlowLoader()
+    callers = [asyncio.create_task(flights.do("key", loader)) for _ in range(5)]
+    await asyncio.sleep(0)
+    loader.release.set()
+
+    assert await asyncio.gather(*callers) == ["variants"] * 5
+    assert loader.calls == 1
+    assert flights.get_stats() == {"calls": 1, "coalesced": 4, "cancelled": 0, "in_flight": 0}
+
+
+@pytest.mark.asyncio
+async def test_errors_reach_every_waiter_and_are_not_kept():
+    """Тест: ошибка доставляется всем, следующий вызов выполняется заново"""
+    flights = SingleFlight()
+    loader = SlowLoader(RuntimeError("api down"))
+    callers = [asyncio.create_task(flights.do("key", loader)) for _ in range(3)]
+    await asyncio.sleep(0)
+    loader.release.set()
+
+    results = await asyncio.gather(*callers, return_exceptions=True)
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert "key" not in flights
+
+    loader.result = "ok"
+    assert await flights.do("key", loader) == "ok"
+    assert loader.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_does_not_cancel_others():
+    """Тест отмены: уход одного ожидающего не прерывает вызов для остальных"""
+    flights = SingleFlight()
+    loader = SlowLoader()
+    first = asyncio.create_task(flights.do("key", loader))
+    second = asyncio.create_task(flights.do("key", loader))
+    await asyncio.sleep(0)
+
+    first.cancel()
+    await asyncio.sleep(0)
+    loader.release.set()
+    assert await second == "variants"
+    assert first.cancelled()
+    assert flights.cancelled == 0
+
+
+@pytest.mark.asyncio
+async def test_load_cancelled_when_nobody_waits():
+    """Тест отмены: вызов прерывается, когда ожидающих не осталось"""
+    flights = SingleFlight()
+    loader = SlowLoader()
+    callers = [asyncio.create_task(flights.do("key", loader)) for _ in range(2)]
+    await asyncio.sleep(0)
+
+    for caller in callers:
+        caller.cancel()
+    await asyncio.gather(*callers, return_exceptions=True)
+    await asyncio.sleep(0)
+    assert flights.cancelled == 1
+    assert "key" not in flights
+
+
+@pytest.mark.asyncio
+async def test_tiered_cache_get_or_set_coalesces():
+    """Тест: read-through кэш вызывает loader один раз на ключ"""
+    cache = TieredCache(CacheConfig(file_enabled=False, redis_enabled=False, write_back_interval=0))
+    replies = cache.namespace("reply")
+    loader = SlowLoader(["a", "b", "c"])
+    callers = [asyncio.create_task(replies.get_or_set("key", loader)) for _ in range(4)]
+    await asyncio.sleep(0)
+    loader.release.set()
+
+    assert await asyncio.gather(*callers) == [["a", "b", "c"]] * 4
+    assert loader.calls == 1
+    stats = await cache.get_stats()
+    assert stats["namespaces"]["reply"]["coalesced"] == 3
+    assert stats["namespaces"]["reply"]["loads"] == 1
+    assert await replies.get("key") == ["a", "b", "c"]
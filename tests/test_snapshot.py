@@ -0,0 +1,101 @@
+"""
+Тесты снимка горячего кэша и состояний StateManager
+"""
+
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.core.config import CacheConfig, SnapshotConfig
+from app.core.snapshot import SnapshotManager, read_snapshot, write_snapshot
+from app.core.state import StateManager
+from app.core.tiered_cache import TieredCache
+
+
+def make_cache() -> TieredCache:
+    return TieredCache(CacheConfig(file_enabled=False, redis_enabled=False,
+                                   write_back_interval=0, namespace_soft_ttls={}))
+
+
+def make_manager(tmp_path, cache, state, **overrides) -> SnapshotManager:
+    params = dict(path=str(tmp_path / "snapshot.bin"), interval=0)
+    params.update(overrides)
+    return SnapshotManager(cache, state, SnapshotConfig(**params))
+
+
+@pytest.mark.asyncio
+async def test_snapshot_roundtrip(tmp_path):
+    """Тест: кэш и состояния переживают перезапуск"""
+    cache, state = make_cache(), StateManager()
+    await cache.namespace("reply").set("k1", ["вариант"] * 3)
+    await cache.namespace("ppv").set("p1", "описание")
+    await state.set_user_message("hash1", 42, "Привет")
+    await state.set_last_message_for_reply(42, "Привет", "hash1")
+    await state.increment_user_stat(42, "reply_requests")
+    await make_manager(tmp_path, cache, state).close()
+
+    restarted_cache, restarted_state = make_cache(), StateManager()
+    manager = make_manager(tmp_path, restarted_cache, restarted_state)
+    manager.start()
+    await manager.ensure_restored()
+
+    assert await restarted_cache.namespace("reply").get("k1") == ["вариант"] * 3
+    assert await restarted_cache.namespace("ppv").get("p1") == "описание"
+    assert (await restarted_state.get_user_message("hash1"))["message"] == "Привет"
+    assert await restarted_state.get_last_message_for_reply(42) == {"text": "Привет", "hash": "hash1"}
+    assert await restarted_state.get_user_stat(42, "reply_requests") == 1
+    assert manager.get_stats()["restored_entries"] == 2
+
+
+@pytest.mark.asyncio
+async def test_snapshot_skips_expired_and_keeps_newer(tmp_path):
+    """Тест: истекшие записи не загружаются, свежие значения не перезаписываются"""
+    path = str(tmp_path / "snapshot.bin")
+    past = datetime.now() - timedelta(minutes=1)
+    payload = {
+        "cache": {"reply": [("old", "v", 5.0), ("kept", "v", 100.0), ("fresh", "старое", 100.0)]},
+        "state": {
+            "states": {"gone": {"user_id": 1, "message": "x", "expires_at": past}},
+            "user_data": {7: ({"stat_a": 1}, past)}
+        }
+    }
+    write_snapshot(path, payload, created_at=time.time() - 10)
+
+    cache, state = make_cache(), StateManager()
+    await cache.namespace("reply").set("fresh", "новое")
+    manager = make_manager(tmp_path, cache, state)
+    assert await manager.restore() == 1
+
+    reply = cache.namespace("reply")
+    assert await reply.get("old") is None
+    assert await reply.get("kept") == "v"
+    assert await reply.get("fresh") == "новое"
+    assert await state.get_user_message("gone") is None
+    assert await state.get_user_stat(7, "a") == 0
+
+
+def test_corrupted_snapshot_is_ignored(tmp_path):
+    """Тест: поврежденный снимок пропускается"""
+    path = str(tmp_path / "snapshot.bin")
+    write_snapshot(path, {"cache": {}, "state": {}})
+    with open(path, "r+b") as f:
+        f.seek(-1, 2)
+        f.write(b"\x00")
+    assert read_snapshot(path) is None
+    assert read_snapshot(str(tmp_path / "missing.bin")) is None
+
+
+@pytest.mark.asyncio
+async def test_snapshot_limits_hot_entries(tmp_path):
+    """Тест: в снимок попадают только самые свежие записи пространства имен"""
+    cache = make_cache()
+    ppv = cache.namespace("ppv")
+    for i in range(10):
+        await ppv.set(f"k{i}", i)
+    await ppv.get("k0")  # становится самой свежей
+
+    manager = make_manager(tmp_path, cache, StateManager(), max_entries_per_namespace=3)
+    await manager.save()
+    _, payload = read_snapshot(manager.path)
+    assert [key for key, _, _ in payload["cache"]["ppv"]] == ["k8", "k9", "k0"]
@@ -0,0 +1,98 @@
+"""
+Тесты упреждающей генерации вариантов ответа
+"""
+
+import asyncio
+import pytest
+
+from app.core.config import SpeculationConfig
+from app.core.speculative import SpeculativeGenerator
+from app.core.state import StateManager
+
+
+class FakeGenerator:
+    """Генератор, который запоминает вызовы и ждет сигнала"""
+
+    def __init__(self):
+        self.calls = []
+        self.release = asyncio.Event()
+
+    async def __call__(self, text, style):
+        self.calls.append((text, style))
+        await self.release.wait()
+        return [f"{style}:{text}"]
+
+
+def make_speculator(generator, **overrides) -> SpeculativeGenerator:
+    params = dict(enabled=True, max_concurrent=4, global_top=2,
+                  default_styles=["friendly", "flirty"], max_tracked=100)
+    params.update(overrides)
+    return SpeculativeGenerator(generator, StateManager(), SpeculationConfig(**params))
+
+
+@pytest.mark.asyncio
+async def test_new_user_gets_global_top_styles():
+    """Тест: новому пользователю генерируются глобально популярные стили"""
+    generator = FakeGenerator()
+    speculator = make_speculator(generator)
+    assert await speculator.predict(1) == ["friendly", "flirty"]
+
+    for user_id in (10, 11, 12):
+        await speculator.record_choice(user_id, f"h{user_id}", "romantic")
+    await speculator.record_choice(13, "h13", "passionate")
+    assert await speculator.predict(1) == ["romantic", "passionate"]
+
+
+@pytest.mark.asyncio
+async def test_user_history_wins_and_hits_are_counted():
+    """Тест: стиль из истории пользователя и подсчет попаданий"""
+    generator = FakeGenerator()
+    speculator = make_speculator(generator)
+    await speculator.record_choice(1, "old", "passionate")
+
+    assert await speculator.speculate(1, "hash1", "Привет") == ["passionate"]
+    generator.release.set()
+    await asyncio.sleep(0)
+    assert generator.calls == [("Привет", "passionate")]
+
+    assert await speculator.record_choice(1, "hash1", "passionate") is True
+    stats = speculator.get_stats()
+    assert stats["hits"] == 1 and stats["wasted"] == 0 and stats["hit_rate"] == 100.0
+
+
+@pytest.mark.asyncio
+async def test_unused_styles_are_counted_as_waste():
+    """Тест: невыбранные упреждающие генерации считаются потерями"""
+    generator = FakeGenerator()
+    generator.release.set()
+    speculator = make_speculator(generator, max_tracked=1)
+
+    await speculator.speculate(1, "hash1", "Привет")
+    await asyncio.sleep(0)
+    assert await speculator.record_choice(1, "hash1", "romantic") is False
+    stats = speculator.get_stats()
+    assert stats["misses"] == 1 and stats["wasted"] == 2
+
+    # Вытеснение невыбранных сообщений из отслеживания тоже потеря
+    await speculator.speculate(2, "hash2", "Как дела")
+    await asyncio.sleep(0)
+    await speculator.speculate(3, "hash3", "Что нового")
+    stats = speculator.get_stats()
+    assert stats["launched"] == 6 and stats["wasted"] == 4 and stats["pending"] == 1
+    await speculator.close()
+
+
+@pytest.mark.asyncio
+async def test_concurrency_budget_skips_extra_generations():
+    """Тест: сверх бюджета упреждающая генерация пропускается"""
+    generator = FakeGenerator()
+    speculator = make_speculator(generator, max_concurrent=3)
+
+    await speculator.speculate(1, "hash1", "первое")
+    await speculator.speculate(2, "hash2", "второе")
+    await asyncio.sleep(0)
+    stats = speculator.get_stats()
+    assert stats["launched"] == 3 and stats["skipped"] == 1 and stats["in_flight"] == 3
+
+    await speculator.close()
+    assert speculator.get_stats()["in_flight"] == 0
@@ -6,6 +6,7 @@ import pytest
 import asyncio
 import json
 from pathlib import Path
+from datetime import datetime, timedelta
 from app.core.state import StateManager
 
 @pytest.fixture
@@ -19,6 +20,17 @@ async def state_manager(tmp_path):
     if state_file.exists():
         state_file.unlink()
 
+class FakeClock:
+    """Управляемые часы для проверки TTL"""
+    def __init__(self):
+        self.now = datetime(2024, 1, 1, 12, 0, 0)
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, minutes: float):
+        self.now += timedelta(minutes=minutes)
+
 @pytest.mark.asyncio
 async def test_state_initialization(state_manager):
     """Тест инициализации состояния"""
@@ -120,4 +132,161 @@ async def test_concurrent_operations(state_manager):
     
     # Проверка финального значения
     value = await state_manager.get("test_key")
-    assert value in [f"value_{i}" for i in range(5)] 
\ No newline at end of file
+    assert value in [f"value_{i}" for i in range(5)] 
+
+# === Тесты шардированного StateManager ===
+
+@pytest.mark.asyncio
+async def test_sharded_reply_context_roundtrip():
+    """Тест: данные /reply и статистика в шардированном менеджере"""
+    manager = StateManager(shards=4)
+    for user_id in range(20):
+        await manager.set_last_message_for_reply(user_id, f"текст {user_id}", f"hash{user_id}")
+        await manager.set_user_message(f"hash{user_id}", user_id, f"текст {user_id}")
+        await manager.increment_user_stat(user_id, "reply_requests")
+
+    assert await manager.get_last_message_for_reply(7) == {"text": "текст 7", "hash": "hash7"}
+    assert (await manager.get_user_message("hash7"))["user_id"] == 7
+    assert await manager.get_user_stats(7) == {"reply_requests": 1}
+
+    await manager.delete_user_data(7, "stat_reply_requests")
+    await manager.delete_user_message("hash7")
+    stats = await manager.get_stats()
+    assert stats["total_users_with_data"] == 20
+    assert stats["total_user_data_keys"] == 20 * 3 - 1
+    assert stats["total_message_states"] == 19
+    assert stats["shards"] == 4
+
+
+@pytest.mark.asyncio
+async def test_heap_expiry_and_ttl_refresh():
+    """Тест: истечение по куче учитывает продление TTL"""
+    clock = FakeClock()
+    manager = StateManager(ttl_minutes=30, shards=2, clock=clock)
+    await manager.set_user_data(1, "a", 1)
+    await manager.set_user_data(2, "a", 2)
+    await manager.set_user_message("m", 1, "текст")
+
+    clock.advance(20)
+    await manager.set_user_data(1, "b", 3)  # продлевает TTL пользователя 1
+    clock.advance(15)
+    await manager.cleanup_expired()
+
+    assert await manager.get_user_data(1, "a") == 1
+    assert await manager.get_user_data(2, "a") is None
+    assert await manager.get_user_message("m") is None
+    stats = await manager.get_stats()
+    assert (stats["total_users_with_data"], stats["total_user_data_keys"],
+            stats["total_message_states"]) == (1, 2, 0)
+
+
+@pytest.mark.asyncio
+async def test_heap_compaction_keeps_size_bounded():
+    """Тест: частые продления TTL не раздувают кучу"""
+    manager = StateManager(shards=1)
+    for i in range(10000):
+        await manager.set_user_data(1, "counter", i)
+
+    shard = manager._shards[0]
+    assert len(shard.heap) <= 2 * 1 + 64 + 1
+    assert await manager.get_user_data(1, "counter") == 9999
+
+
+@pytest.mark.asyncio
+async def test_user_record_keeps_dict_semantics():
+    """Тест: компактная запись снаружи ведет себя как словарь данных"""
+    manager = StateManager(shards=1)
+    await manager.set_last_message_for_reply(1, "текст", "h1")
+    await manager.set_reply_variants(1, "h1", ["a", "b"])
+    await manager.set_reply_variants(1, "h2", ["c"])
+    assert await manager.increment_user_stat(1, "reply_requests") == 1
+    assert await manager.increment_user_stat(1, "reply_requests") == 2
+    await manager.set_user_data(1, "stat_ratio", 0.5)  # не целое - вне массива
+    await manager.set_user_data(1, "language", "ru")
+
+    assert await manager.get_all_user_data(1) == {
+        "last_message_text_for_reply": "текст",
+        "last_message_hash_for_reply": "h1",
+        "reply_variants_h1": ["a", "b"],
+        "reply_variants_h2": ["c"],
+        "stat_reply_requests": 2,
+        "stat_ratio": 0.5,
+        "language": "ru"
+    }
+    assert await manager.get_user_stats(1) == {"reply_requests": 2, "ratio": 0.5}
+    assert (await manager.get_stats())["total_user_data_keys"] == 7
+
+    await manager.clear_reply_variants(1, "h1")
+    await manager.clear_last_message_for_reply(1)
+    await manager.set_user_data(1, "stat_ratio", 3)  # переезжает в массив
+    assert await manager.get_reply_variants(1, "h1") is None
+    assert await manager.get_last_message_for_reply(1) is None
+    assert await manager.get_user_stats(1) == {"reply_requests": 2, "ratio": 3}
+    assert (await manager.get_stats())["total_user_data_keys"] == 4
+
+    record = manager._shards[0].users[1]
+    assert record.extra == {"language": "ru"}
+
+
+@pytest.mark.asyncio
+async def test_batched_user_data_api():
+    """Тест: get_many/set_many и транзакция над данными пользователя"""
+    manager = StateManager(shards=1)
+    await manager.set_many(1, {"a": 1, "b": "x"})
+    assert await manager.get_many(1, ["a", "b", "c"]) == {"a": 1, "b": "x", "c": None}
+    assert await manager.get_many(2, ["a"]) == {"a": None}
+
+    async with manager.transaction(1) as tx:
+        assert tx.increment("stat_reply_requests") == 1
+        assert tx.increment("stat_reply_requests") == 2
+        tx.delete("b")
+        assert tx.get("b") is None
+        # До выхода из блока изменения не видны
+        assert await manager.get_user_data(1, "stat_reply_requests") is None
+    assert await manager.get_all_user_data(1) == {"a": 1, "stat_reply_requests": 2}
+
+    with pytest.raises(RuntimeError):
+        async with manager.transaction(1) as tx:
+            tx.set("a", 100)
+            raise RuntimeError("откат")
+    assert await manager.get_user_data(1, "a") == 1
+
+    await manager.set_many(1, {"a": None, "stat_reply_requests": None})
+    assert (await manager.get_stats())["total_users_with_data"] == 0
+
+
+@pytest.mark.asyncio
+async def test_max_users_evicts_least_recently_used():
+    """Тест: лимит пользователей вытесняет давно не использованных"""
+    manager = StateManager(shards=1, max_users=2)
+    await manager.set_user_data(1, "a", 1)
+    await manager.set_user_data(2, "a", 2)
+    assert await manager.get_user_data(1, "a") == 1  # 1 становится свежим
+    await manager.set_user_data(3, "a", 3)
+
+    assert await manager.get_user_data(2, "a") is None
+    assert await manager.get_user_data(1, "a") == 1
+    assert await manager.get_user_data(3, "a") == 3
+    stats = await manager.get_stats()
+    assert stats["total_users_with_data"] == 2
+    assert stats["total_user_data_keys"] == 2
+    assert stats["evictions"] == 1
+    assert stats["spilled_users"] == 0
+
+
+@pytest.mark.asyncio
+async def test_max_messages_evicts_least_recently_used():
+    """Тест: лимит состояний сообщений вытесняет давно не использованные"""
+    manager = StateManager(shards=1, max_messages=2)
+    await manager.set_user_message("h1", 1, "первое")
+    await manager.set_user_message("h2", 1, "второе")
+    assert await manager.get_user_message("h1") is not None  # h1 становится свежим
+    await manager.set_user_message("h3", 1, "третье")
+
+    assert await manager.get_user_message("h2") is None
+    assert (await manager.get_user_message("h1"))["message"] == "первое"
+    assert (await manager.get_user_message("h3"))["message"] == "третье"
+    stats = await manager.get_stats()
+    assert stats["total_message_states"] == 2
+    assert stats["message_evictions"] == 1
+    assert stats["spilled_messages"] == 0
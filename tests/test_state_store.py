@@ -0,0 +1,267 @@
+"""
+Тесты персистентного хранилища StateManager на SQLite
+"""
+
+import asyncio
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.core.config import StateConfig
+from app.core.error_handler import ConfigurationError
+from app.core.state import StateManager
+from app.core.state_store import SQLiteStateStore, SharedStateStore, create_state_store
+
+
+def make_manager(tmp_path, **overrides) -> StateManager:
+    params = dict(store=SQLiteStateStore(str(tmp_path / "state.db")), flush_interval=60, batch_size=1000)
+    params.update(overrides)
+    return StateManager(**params)
+
+
+def count_rows(tmp_path, table: str) -> int:
+    with sqlite3.connect(str(tmp_path / "state.db")) as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+@pytest.mark.asyncio
+async def test_state_survives_restart(tmp_path):
+    """Тест: контекст /reply, варианты и счетчики переживают перезапуск"""
+    manager = make_manager(tmp_path)
+    await manager.set_user_message("hash1", 42, "Привет")
+    await manager.set_last_message_for_reply(42, "Привет", "hash1")
+    await manager.set_reply_variants(42, "hash1", ["a", "b", "c"])
+    await manager.increment_user_stat(42, "reply_requests")
+    await manager.close()
+
+    restarted = make_manager(tmp_path)
+    assert (await restarted.get_stats())["total_users_with_data"] == 0
+    assert await restarted.get_last_message_for_reply(42) == {"text": "Привет", "hash": "hash1"}
+    assert await restarted.get_reply_variants(42, "hash1") == ["a", "b", "c"]
+    assert await restarted.increment_user_stat(42, "reply_requests") == 2
+    assert (await restarted.get_user_message("hash1"))["message"] == "Привет"
+    stats = await restarted.get_stats()
+    assert stats["backend"] == "sqlite"
+    assert stats["total_users_with_data"] == 1  # прочитан в память
+    await restarted.close()
+
+
+@pytest.mark.asyncio
+async def test_writes_are_batched(tmp_path):
+    """Тест: изменения копятся в буфере и пишутся одной транзакцией"""
+    manager = make_manager(tmp_path, flush_interval=0.05)
+    for user_id in range(100):
+        await manager.increment_user_stat(user_id, "reply_requests")
+    assert count_rows(tmp_path, "users") == 0
+    assert (await manager.get_stats())["pending_writes"] == 100
+
+    await asyncio.sleep(0.3)
+    stats = await manager.get_stats()
+    assert stats["pending_writes"] == 0
+    assert stats["store"]["batches"] == 1
+    assert count_rows(tmp_path, "users") == 100
+    await manager.close()
+
+
+@pytest.mark.asyncio
+async def test_full_batch_flushes_early(tmp_path):
+    """Тест: при batch_size измененных ключей запись не ждет интервала"""
+    manager = make_manager(tmp_path, flush_interval=60, batch_size=10)
+    for user_id in range(10):
+        await manager.set_user_data(user_id, "a", 1)
+    await asyncio.sleep(0.2)
+    assert count_rows(tmp_path, "users") == 10
+    await manager.close()
+
+
+@pytest.mark.asyncio
+async def test_deletes_are_not_resurrected(tmp_path):
+    """Тест: удаленные данные не читаются обратно из хранилища"""
+    manager = make_manager(tmp_path)
+    await manager.set_user_data(1, "a", 1)
+    await manager.set_user_message("hash1", 1, "текст")
+    await manager.flush()
+
+    await manager.delete_user_data(1)
+    await manager.delete_user_message("hash1")
+    assert await manager.get_user_data(1, "a") is None
+    assert await manager.get_user_message("hash1") is None
+    await manager.close()
+    assert count_rows(tmp_path, "users") == count_rows(tmp_path, "messages") == 0
+
+
+@pytest.mark.asyncio
+async def test_expired_rows_are_not_loaded(tmp_path):
+    """Тест: истекшие строки хранилища считаются отсутствующими"""
+    now = datetime(2024, 1, 1)
+    manager = make_manager(tmp_path, ttl_minutes=1, clock=lambda: now)
+    await manager.set_user_data(1, "a", 1)
+    await manager.close()
+
+    now += timedelta(minutes=2)
+    restarted = make_manager(tmp_path, ttl_minutes=1, clock=lambda: now)
+    assert await restarted.get_user_data(1, "a") is None
+    assert await restarted.get_all_user_data(1) == {}
+    await restarted.close()
+
+
+def test_backend_selected_by_config(tmp_path):
+    """Тест: backend выбирается конфигурацией"""
+    assert create_state_store(StateConfig(backend="memory")) is None
+    store = create_state_store(StateConfig(backend="sqlite", sqlite_path=str(tmp_path / "s.db")))
+    assert isinstance(store, SQLiteStateStore)
+    mode = store._reader.execute("PRAGMA journal_mode").fetchone()[0]
+    store.close()
+    assert mode == "wal"
+
+
+@pytest.mark.asyncio
+async def test_evicted_users_spill_to_store(tmp_path):
+    """Тест: вытесненные по лимиту пользователи дописываются в хранилище"""
+    manager = make_manager(tmp_path, shards=1, max_users=10)
+    for user_id in range(50):
+        await manager.increment_user_stat(user_id, "reply_requests")
+    stats = await manager.get_stats()
+    assert stats["total_users_with_data"] == 10
+    assert stats["evictions"] == 40
+    assert stats["spilled_users"] == 40
+
+    # Вытесненный, но еще не записанный пользователь читается из буфера
+    assert await manager.increment_user_stat(0, "reply_requests") == 2
+    assert await manager.flush() == 50
+    assert count_rows(tmp_path, "users") == 50
+    assert await manager.get_user_stat(5, "reply_requests") == 1
+    assert await manager.get_user_stat(0, "reply_requests") == 2
+    await manager.close()
+
+
+@pytest.mark.asyncio
+async def test_evicted_messages_spill_to_store(tmp_path):
+    """Тест: вытесненные по лимиту состояния сообщений дописываются в хранилище"""
+    manager = make_manager(tmp_path, shards=1, max_messages=10)
+    for i in range(50):
+        await manager.set_user_message(f"hash{i}", i, f"сообщение {i}")
+    stats = await manager.get_stats()
+    assert stats["total_message_states"] == 10
+    assert stats["message_evictions"] == 40
+    assert stats["spilled_messages"] == 40
+
+    # Вытесненное, но еще не записанное состояние читается из буфера
+    assert (await manager.get_user_message("hash0"))["message"] == "сообщение 0"
+    await manager.delete_user_message("hash1")
+    assert await manager.flush() == 50
+    assert count_rows(tmp_path, "messages") == 49
+    assert (await manager.get_user_message("hash5"))["message"] == "сообщение 5"
+    assert await manager.get_user_message("hash1") is None
+    await manager.close()
+
+
+def make_worker(tmp_path, **overrides) -> StateManager:
+    """Процесс бота с общим хранилищем (у каждого свой экземпляр)"""
+    params = dict(flush_interval=60, batch_size=1000, sync_interval=0)
+    params.update(overrides)
+    return StateManager(store=SharedStateStore(str(tmp_path / "shared.db")), **params)
+
+
+@pytest.mark.asyncio
+async def test_shared_store_serves_callbacks_on_other_worker(tmp_path):
+    """Тест: контекст /reply, записанный одним процессом, виден другому"""
+    first, second = make_worker(tmp_path), make_worker(tmp_path)
+    assert await second.get_last_message_for_reply(42) is None  # промах запомнен
+
+    await first.set_user_message("hash1", 42, "Привет")
+    await first.set_last_message_for_reply(42, "Привет", "hash1")
+    await first.set_reply_variants(42, "hash1", ["a", "b"])
+    await first.flush()
+
+    assert await second.get_last_message_for_reply(42) == {"text": "Привет", "hash": "hash1"}
+    assert await second.get_reply_variants(42, "hash1") == ["a", "b"]
+    assert (await second.get_user_message("hash1"))["message"] == "Привет"
+
+    # Изменение во втором процессе сбрасывает локальную копию в первом
+    await second.clear_reply_variants(42, "hash1")
+    await second.flush()
+    assert await first.get_reply_variants(42, "hash1") is None
+    assert (await first.get_stats())["backend"] == "shared"
+    await first.close()
+    await second.close()
+
+
+@pytest.mark.asyncio
+async def test_shared_store_merges_conflicting_writes(tmp_path):
+    """Тест: одновременные изменения одного пользователя не теряются"""
+    first, second = make_worker(tmp_path), make_worker(tmp_path)
+    await first.increment_user_stat(7, "reply_requests")
+    await first.flush()
+    assert await second.get_user_stat(7, "reply_requests") == 1
+
+    # Оба процесса меняют пользователя на одной версии строки
+    await first.set_reply_variants(7, "h1", ["a"])
+    await second.increment_user_stat(7, "replies_selected")
+    await first.flush()
+    await second.flush()  # конфликт: ключи второго накладываются на строку первого
+    assert second._store.get_stats()["conflicts"] == 1
+    assert await second.flush() == 1
+
+    for worker in (first, second):
+        assert await worker.get_all_user_data(7) == {
+            "reply_variants_h1": ["a"],
+            "stat_reply_requests": 1,
+            "stat_replies_selected": 1
+        }
+    await first.close()
+    await second.close()
+
+
+@pytest.mark.asyncio
+async def test_shared_store_replays_concurrent_increments(tmp_path):
+    """Тест: одновременные приращения счетчика в двух процессах суммируются"""
+    first, second = make_worker(tmp_path), make_worker(tmp_path)
+    await first.increment_user_stat(7, "reply_requests")
+    await first.flush()
+    assert await second.get_user_stat(7, "reply_requests") == 1
+
+    # Оба процесса увеличивают счетчик с 1 на одной версии строки
+    assert await first.increment_user_stat(7, "reply_requests") == 2
+    async with second.transaction(7) as user_state:
+        assert user_state.increment("stat_reply_requests") == 2
+    await first.flush()
+    await second.flush()  # конфликт: приращение повторяется поверх строки первого
+    assert await second.flush() == 1
+
+    for worker in (first, second):
+        assert await worker.get_user_stat(7, "reply_requests") == 3
+    await first.close()
+    await second.close()
+
+
+def test_shared_store_refuses_other_host(tmp_path):
+    """Тест: общий файл нельзя открыть с другой машины"""
+    path = str(tmp_path / "shared.db")
+    SharedStateStore(path, host_id="bot-1").close()
+    SharedStateStore(path, host_id="bot-1").close()
+    with pytest.raises(ConfigurationError):
+        SharedStateStore(path, host_id="bot-2")
+
+
+@pytest.mark.asyncio
+async def test_shared_store_polls_changes_at_most_once_per_interval(tmp_path):
+    """Тест: журнал чужих изменений опрашивается не на каждое чтение"""
+    writer, reader = make_worker(tmp_path), make_worker(tmp_path, sync_interval=3600)
+    polls = 0
+    poll_changes = reader._store.poll_changes
+
+    def counting_poll():
+        nonlocal polls
+        polls += 1
+        return poll_changes()
+
+    reader._store.poll_changes = counting_poll
+    await writer.set_user_data(1, "k", "v")
+    await writer.flush()
+    for _ in range(100):
+        assert await reader.get_user_data(1, "k") == "v"
+    assert polls == 1
+    await writer.close()
+    await reader.close()
@@ -0,0 +1,139 @@
+"""
+Тесты фонового инкрементального sweeper
+"""
+
+import asyncio
+import gc
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.core.cache import MemoryCache
+from app.core.config import SweeperConfig
+from app.core.performance import PerformanceManager
+from app.core.state import StateManager
+from app.core.sweeper import Sweeper
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class Backlog:
+    """Структура с заданным количеством истекших записей"""
+
+    def __init__(self, expired: int):
+        self.expired = expired
+        self.calls = 0
+
+    def sweep(self, limit: int) -> int:
+        self.calls += 1
+        removed = min(limit, self.expired)
+        self.expired -= removed
+        return removed
+
+    def sweep_lag(self) -> float:
+        return float(self.expired)
+
+
+def make_sweeper(**overrides) -> Sweeper:
+    params = dict(interval=0.01, max_items=1000, time_slice=1.0)
+    params.update(overrides)
+    return Sweeper(SweeperConfig(**params))
+
+
+def test_tick_respects_item_budget():
+    """Тест: за тик обрабатывается не больше max_items записей"""
+    sweeper = make_sweeper(max_items=300)
+    first, second = Backlog(1000), Backlog(50)
+    sweeper.register("first", first)
+    sweeper.register("second", second)
+
+    assert sweeper.tick() == 300
+    assert second.expired == 0  # порции чередуются между структурами
+    assert first.expired == 750
+
+    while sweeper.tick():
+        pass
+    stats = sweeper.get_stats()
+    assert stats["swept"] == 1050
+    assert stats["budget_exhausted"] >= 3
+    assert stats["targets"]["first"] == {"swept": 1000, "lag_seconds": 0.0}
+
+
+def test_tick_respects_time_slice():
+    """Тест: исчерпанный бюджет времени прерывает тик"""
+    sweeper = make_sweeper(time_slice=0.0)
+    backlog = Backlog(10_000)
+    sweeper.register("backlog", backlog)
+    sweeper.tick()
+    assert backlog.calls == 1
+    assert sweeper.get_stats()["max_lag_seconds"] == 10_000 - 128
+
+
+def test_targets_are_weakly_referenced():
+    """Тест: регистрация не удерживает структуру в памяти"""
+    sweeper = make_sweeper()
+    sweeper.register("temp", Backlog(10))
+    gc.collect()
+    assert sweeper.tick() == 0
+    assert sweeper.get_stats()["targets"] == {}
+
+
+def test_memory_cache_expires_only_through_sweep():
+    """Тест: запись в кэш не чистит истекшие элементы, это делает sweep"""
+    clock = FakeClock()
+    cache = MemoryCache(max_size=None, default_ttl=10, clock=clock)
+    for i in range(100):
+        cache.set_nowait(f"k{i}", i)
+    clock.now += 15
+    cache.set_nowait("fresh", 1, ttl_seconds=60)
+    assert len(cache) == 101
+    assert cache.sweep_lag() > 0
+
+    sweeper = make_sweeper(max_items=40)
+    sweeper.register("cache", cache)
+    while sweeper.tick():
+        pass
+    assert len(cache) == 1
+    assert cache.get_nowait("fresh") == 1
+
+
+@pytest.mark.asyncio
+async def test_state_manager_swept_incrementally():
+    """Тест: sweeper снимает истекшие состояния порциями по шардам"""
+    now = datetime(2024, 1, 1)
+    manager = StateManager(ttl_minutes=1, shards=4, clock=lambda: now)
+    for user_id in range(50):
+        await manager.set_user_data(user_id, "a", 1)
+    now += timedelta(minutes=2)
+
+    assert manager.sweep(20) == 20
+    assert manager.sweep_lag() > 0
+    while manager.sweep(20):
+        pass
+    stats = await manager.get_stats()
+    assert stats["total_users_with_data"] == 0
+    assert manager.sweep_lag() == 0
+
+
+@pytest.mark.asyncio
+async def test_background_loop_and_rate_limit_windows():
+    """Тест: фоновый цикл удаляет окна неактивных пользователей"""
+    manager = PerformanceManager()
+    for user in range(5):
+        assert manager.check_rate_limit(f"user{user}", limit=2, window=0)
+    assert len(manager.rate_limits) == 5
+
+    sweeper = make_sweeper()
+    sweeper.register("rate_limits", manager)
+    sweeper.start()
+    await asyncio.sleep(0.05)
+    await sweeper.stop()
+
+    assert manager.rate_limits == {}
+    assert sweeper.get_stats()["ticks"] >= 1
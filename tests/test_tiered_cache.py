@@ -0,0 +1,311 @@
+"""
+Тесты многоуровневого кэша TieredCache
+"""
+
+import pytest
+import asyncio
+from app.core.config import CacheConfig
+from app.core.cache import FileCache
+from app.core.tiered_cache import TieredCache, make_cache_key
+
+
+def make_config(**overrides) -> CacheConfig:
+    """Конфигурация без автоматически создаваемых L2/L3 и без мягких TTL"""
+    params = dict(file_enabled=False, redis_enabled=False, write_back_interval=0,
+                  namespace_soft_ttls={})
+    params.update(overrides)
+    return CacheConfig(**params)
+
+
+@pytest.fixture
+def file_cache(tmp_path):
+    cache = FileCache(path=str(tmp_path))
+    yield cache
+    cache.close()
+
+
+@pytest.mark.asyncio
+async def test_read_through_loads_once():
+    """Тест read-through: loader вызывается только при промахе"""
+    cache = TieredCache(make_config())
+    calls = 0
+
+    async def loader():
+        nonlocal calls
+        calls += 1
+        return ["a", "b", "c"]
+
+    assert await cache.get_or_set("reply", "k", loader) == ["a", "b", "c"]
+    assert await cache.get_or_set("reply", "k", loader) == ["a", "b", "c"]
+    assert calls == 1
+
+    stats = await cache.get_stats()
+    assert stats["totals"]["l1_hits"] == 1
+    assert stats["totals"]["misses"] == 1
+    assert stats["totals"]["loads"] == 1
+
+
+@pytest.mark.asyncio
+async def test_l2_promotion(file_cache):
+    """Тест подъема значения из файлового уровня в память"""
+    cache = TieredCache(make_config(), file_cache=file_cache)
+    await cache.set("ppv", "10", "описание")
+
+    # Новый процесс: пустая память, тот же диск
+    restarted = TieredCache(make_config(), file_cache=file_cache)
+    assert await restarted.get("ppv", "10") == "описание"
+    assert await restarted.get("ppv", "10") == "описание"
+    stats = await restarted.get_stats()
+    assert stats["namespaces"]["ppv"]["l2_hits"] == 1
+    assert stats["namespaces"]["ppv"]["l1_hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_write_back_batches_lower_tiers(file_cache):
+    """Тест write-back: нижний уровень получает данные только при flush"""
+    cache = TieredCache(make_config(write_back_interval=60), file_cache=file_cache)
+    await cache.set("reply", "k1", "v1")
+    await cache.set("reply", "k2", "v2")
+    assert await file_cache.get("reply:k1") is None
+    assert (await cache.get_stats())["pending_write_back"] == 2
+
+    await cache.flush()
+    assert await file_cache.get("reply:k1") == "v1"
+    assert await file_cache.get("reply:k2") == "v2"
+    await cache.close()
+
+
+@pytest.mark.asyncio
+async def test_namespace_ttls_and_views():
+    """Тест TTL пространств имен и представлений"""
+    now = [0.0]
+    cache = TieredCache(make_config(namespace_ttls={"short": 5, "long": 500}),
+                        clock=lambda: now[0])
+    short, long = cache.namespace("short"), cache.namespace("long")
+    await short.set("k", 1)
+    await long.set("k", 2)
+
+    now[0] = 10.0
+    assert await short.get("k") is None
+    assert await long.get("k") == 2
+    assert short.ttl == 5
+    long.ttl = 1000
+    assert cache.get_ttl("long") == 1000
+
+    # Синхронный доступ к L1 для старого кода
+    short.set_nowait("sync", "value")
+    assert short.get_nowait("sync") == "value"
+    assert len(short) == 1
+
+
+@pytest.mark.asyncio
+async def test_shared_memory_budget_stats():
+    """Тест общего бюджета памяти и статистики байт по пространствам имен"""
+    cache = TieredCache(make_config(memory_budget_bytes=50000,
+                                    namespace_weights={"reply": 4.0, "ppv": 1.0}))
+    reply, ppv = cache.namespace("reply"), cache.namespace("ppv")
+    for i in range(500):
+        await reply.set(f"r{i}", ["вариант " * 10] * 3)
+        await ppv.set(f"p{i}", "описание " * 10)
+
+    stats = await cache.get_stats()
+    memory = stats["memory"]
+    assert memory["used_bytes"] <= memory["budget_bytes"] == 50000
+    assert memory["evictions"] > 0
+    namespaces = stats["namespaces"]
+    assert namespaces["reply"]["bytes"] == reply.bytes_used > 0
+    assert namespaces["reply"]["bytes"] > 3 * namespaces["ppv"]["bytes"]
+    assert namespaces["reply"]["weight"] == 4.0
+
+    # После изменения веса память перераспределяется при новых записях
+    reply.weight = 0.25
+    for i in range(500, 1000):
+        await ppv.set(f"p{i}", "описание " * 10)
+    assert reply.bytes_used < ppv.bytes_used
+
+
+
+@pytest.mark.asyncio
+async def test_admission_protects_hot_reply_keys():
+    """Тест W-TinyLFU в пространстве имен reply: разовые ключи не вымывают популярные"""
+    cache = TieredCache(make_config(memory_budget_bytes=40000, admission_namespaces=["reply"]))
+    reply, ppv = cache.namespace("reply"), cache.namespace("ppv")
+    for _ in range(3):
+        for i in range(20):
+            if await reply.get(f"hot{i}") is None:
+                await reply.set(f"hot{i}", ["привет"] * 3)
+    for i in range(2000):
+        if await reply.get(f"once{i}") is None:
+            await reply.set(f"once{i}", ["разовый"] * 3)
+        await ppv.set(f"p{i}", "описание")
+
+    assert all([await reply.get(f"hot{i}") is not None for i in range(20)])
+    assert "admission" not in await cache._l1("ppv").get_stats()
+
+def test_make_cache_key_is_stable():
+    """Тест стабильности ключей между процессами"""
+    assert make_cache_key("Привет", "friendly") == make_cache_key("Привет", "friendly")
+    assert make_cache_key("Привет", "friendly") != make_cache_key("Привет", "flirty")
+    assert len(make_cache_key("x")) == 32
+
+
+@pytest.mark.asyncio
+async def test_stale_while_revalidate():
+    """Тест: устаревшее значение отдается сразу, обновление идет в фоне"""
+    now = [0.0]
+    cache = TieredCache(make_config(namespace_ttls={"reply": 100},
+                                    namespace_soft_ttls={"reply": 10}),
+                        clock=lambda: now[0])
+    replies = cache.namespace("reply")
+    release = asyncio.Event()
+    calls = []
+
+    async def loader():
+        calls.append(now[0])
+        await release.wait()
+        return f"fresh@{now[0]}"
+
+    release.set()
+    assert await replies.get_or_set("key", loader) == "fresh@0.0"
+
+    # После мягкого TTL - старое значение без ожидания и одно фоновое обновление
+    now[0] = 20.0
+    release.clear()
+    assert await replies.get_or_set("key", loader) == "fresh@0.0"
+    assert await replies.get_or_set("key", loader) == "fresh@0.0"
+    release.set()
+    await asyncio.sleep(0.01)
+    assert calls == [0.0, 20.0]
+    assert await replies.get("key") == "fresh@20.0"
+
+    stats = (await cache.get_stats())["namespaces"]["reply"]
+    assert stats["stale_hits"] == 2 and stats["refreshes"] == 1
+    assert stats["soft_ttl"] == 10
+
+    # После жесткого TTL значение исчезает
+    now[0] = 200.0
+    assert await replies.get("key") is None
+
+
+@pytest.mark.asyncio
+async def test_stale_value_survives_failed_refresh(file_cache):
+    """Тест: ошибка фонового обновления не убирает устаревшее значение"""
+    now = [0.0]
+    cache = TieredCache(make_config(namespace_ttls={"ppv": 100},
+                                    namespace_soft_ttls={"ppv": 10}),
+                        file_cache=file_cache, clock=lambda: now[0])
+    ppv = cache.namespace("ppv")
+    await ppv.set("price:10", "описание")
+
+    async def failing():
+        raise RuntimeError("api down")
+
+    now[0] = 50.0
+    assert await ppv.get("price:10", refresh=failing) == "описание"
+    await asyncio.sleep(0.01)
+    assert await ppv.get("price:10") == "описание"
+    # Обертка не видна снаружи и на L2
+    await cache._memory["ppv"].clear()
+    assert await ppv.get("price:10") == "описание"
+
+
+@pytest.mark.asyncio
+async def test_soft_ttl_entries_are_billed_by_payload():
+    """Тест: обертка мягкого TTL не скрывает размер значения от бюджета памяти"""
+    plain = TieredCache(make_config())
+    soft = TieredCache(make_config(namespace_soft_ttls={"reply": 10}))
+    payload = ["вариант ответа " * 50] * 3
+    await plain.set("reply", "k", payload)
+    await soft.set("reply", "k", payload)
+
+    assert soft.namespace("reply").bytes_used >= plain.namespace("reply").bytes_used > 2000
+
+
+@pytest.mark.asyncio
+async def test_clear_namespace_removes_lower_tiers(file_cache):
+    """Тест: очищенное пространство имен не поднимается обратно из L2"""
+    cache = TieredCache(make_config(), file_cache=file_cache)
+    await cache.set("reply", "k", "ответ")
+    await cache.set("ppv", "k", "описание")
+
+    await cache.namespace("reply").clear()
+    assert await cache.get("reply", "k") is None
+    assert await file_cache.get("reply:k") is None
+    assert await cache.get("ppv", "k") == "описание"
+
+    await cache.clear()
+    assert await cache.get("ppv", "k") is None
+
+
+@pytest.mark.asyncio
+async def test_promotion_keeps_remaining_ttl(tmp_path):
+    """Тест: значение из L2 живет в L1 только оставшийся срок"""
+    now = [0.0]
+    file_cache = FileCache(path=str(tmp_path), clock=lambda: now[0])
+    cache = TieredCache(make_config(namespace_ttls={"ppv": 100}), file_cache=file_cache,
+                        clock=lambda: now[0])
+    await cache.set("ppv", "k", "описание")
+
+    now[0] = 90.0
+    restarted = TieredCache(make_config(namespace_ttls={"ppv": 100}), file_cache=file_cache,
+                            clock=lambda: now[0])
+    assert await restarted.get("ppv", "k") == "описание"
+    now[0] = 101.0
+    assert restarted.get_nowait("ppv", "k") is None
+    file_cache.close()
+
+
+class SlowFileCache:
+    """L2, у которого каждая запись занимает время"""
+
+    def __init__(self):
+        self.data = {}
+
+    async def get_with_ttl(self, key):
+        return (self.data[key], None) if key in self.data else None
+
+    async def set(self, key, value, ttl_seconds=None):
+        await asyncio.sleep(0.005)
+        self.data[key] = value
+
+    def close(self):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_close_during_flush_keeps_write_back_data():
+    """Тест: close посреди выгрузки дописывает весь пакет"""
+    file_cache = SlowFileCache()
+    cache = TieredCache(make_config(write_back_interval=0.01), file_cache=file_cache)
+    for i in range(20):
+        await cache.set("reply", f"k{i}", i)
+    await asyncio.sleep(0.03)  # отложенная выгрузка уже пишет пакет
+    assert 0 < len(file_cache.data) < 20
+
+    await cache.close()
+    assert file_cache.data == {f"reply:k{i}": i for i in range(20)}
+
+
+class FailingRedisCache:
+    """L3, у которого падает первый конвейер"""
+
+    def __init__(self):
+        self.data = {}
+        self.calls = 0
+
+    async def set_many(self, items, ttl_seconds=None):
+        self.calls += 1
+        if self.calls == 1:
+            raise ConnectionError("redis down")
+        self.data.update(items)
+
+
+@pytest.mark.asyncio
+async def test_l3_error_does_not_abort_other_batches():
+    """Тест: ошибка одного конвейера L3 не отменяет остальные группы TTL"""
+    redis_cache = FailingRedisCache()
+    cache = TieredCache(make_config(write_back_interval=60), redis_cache=redis_cache)
+    await cache.set("reply", "short", 1, ttl_seconds=10)
+    await cache.set("reply", "long", 2, ttl_seconds=1000)
+    await cache.flush()
+    assert redis_cache.calls == 2 and len(redis_cache.data) == 1